@@ -31,7 +31,7 @@ setup(name='ssp',
           'ssp.chassis.ibm', 'ssp.chassis.wbem',
           'ssp.chassis.ipmi'
       ],
-      scripts=['tools/ssp-chassis-scanner'],
+      scripts=['tools/ssp-chassis-scanner', 'tools/ssp-scan-worker'],
       include_package_data=True,
       install_requires=[
           'pywbem',
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent discovery and SP identity caches"""
+
+import logging
+import os
+import time
+import json
+import fcntl
+import threading
+
+from ssp.chassis.common.result import DiscoveryRecord, DiscoveryResultSet
+from ssp.oui import normalize_mac
+
+__all__ = [ "DiscoveryCache", "IdentityCache" ]
+LOG = logging.getLogger("ssp.chassis.common.cache")
+
+DEFAULT_CACHE = "/var/cache/ssp/discovery.json"
+DEFAULT_TTL = 3600
+
+DEFAULT_IDENTITY_CACHE = "/var/cache/ssp/identity.json"
+DEFAULT_IDENTITY_TTL = 86400
+
+
+class DiscoveryCache(object):
+	"""Represents an on-disk snapshot of discovered hosts with per-host last-seen timestamps."""
+
+	__path = None
+	"""File to keep the snapshot in."""
+
+	__ttl = None
+	"""Seconds after which a host has to be probed again."""
+
+	__hosts = None
+	"""Snapshot entries by IP."""
+
+	def __init__(self, path=DEFAULT_CACHE, ttl=DEFAULT_TTL):
+		self.__path = path
+		self.__ttl = ttl
+		self.__hosts = {}
+		self.load()
+
+	def load(self):
+		"""Load the snapshot from disk. Missing or broken file gives an empty snapshot."""
+		self.__hosts = {}
+		if not os.path.exists(self.__path):
+			return
+		try:
+			fd = open(self.__path, 'r')
+			try:
+				self.__hosts = json.load(fd)
+			finally:
+				fd.close()
+		except (IOError, ValueError), e:
+			LOG.error("Cannot load discovery cache %s. %s", self.__path, e)
+
+	def save(self):
+		"""Atomically write the snapshot to disk."""
+		directory = os.path.dirname(self.__path)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		tmp = self.__path + ".tmp"
+		fd = open(tmp, 'w')
+		try:
+			json.dump(self.__hosts, fd)
+		finally:
+			fd.close()
+		os.rename(tmp, self.__path)
+
+	def __entry(self, record, now, first_seen=None):
+		"""Return snapshot entry for DiscoveryRecord."""
+		return {'mac': record.mac,
+			'proto': sorted(record.proto),
+			'scanners': record.scanners,
+			'info': record.info,
+			'first_seen': first_seen or now,
+			'last_seen': now}
+
+	def __changed(self, old, new):
+		if old['proto'] != new['proto']:
+			return True
+		return bool(new['mac'] and old['mac'] and new['mac'] != old['mac'])
+
+	def update(self, results, probed=(), now=None, callback=None):
+		"""Merge DiscoveryResultSet into the snapshot and return the list of (event, ip, entry).
+
+		   event is 'added' for unknown hosts, 'changed' for hosts with new protocols or MAC and
+		   'removed' for probed hosts which did not reply. callback(event, ip, entry) is called
+		   for every event as well."""
+
+		now = now or time.time()
+		events = []
+		for ip, record in results.items():
+			old = self.__hosts.get(ip)
+			if old is None:
+				entry = self.__entry(record, now)
+				events.append(('added', ip, entry))
+			else:
+				entry = self.__entry(record, now, old['first_seen'])
+				if not entry['mac']:
+					entry['mac'] = old['mac']
+				if self.__changed(old, entry):
+					events.append(('changed', ip, entry))
+			self.__hosts[ip] = entry
+		for ip in probed:
+			if ip not in results and ip in self.__hosts:
+				events.append(('removed', ip, self.__hosts.pop(ip)))
+		if callback:
+			for event in events:
+				callback(*event)
+		return events
+
+	def stale(self, now=None):
+		"""Return the list of IPs not seen for longer than TTL."""
+		now = now or time.time()
+		return [ip for ip, entry in self.__hosts.items() if entry['last_seen'] + self.__ttl <= now]
+
+	def origins(self, ip):
+		"""Return the set of scanner names which found ip last time."""
+		entry = self.__hosts.get(ip)
+		if not entry:
+			return set()
+		return set([s.get('origin') for s in entry['scanners'] if s.get('origin')])
+
+	def results(self):
+		"""Return the snapshot as DiscoveryResultSet."""
+		out = DiscoveryResultSet()
+		for ip, entry in self.__hosts.items():
+			out.add_record(DiscoveryRecord(ip, entry['mac'], set(entry['proto']), list(entry['scanners']), dict(entry['info'])))
+		return out
+
+	def get(self, ip):
+		return self.__hosts.get(ip)
+
+	def keys(self):
+		return self.__hosts.keys()
+
+	def __contains__(self, ip):
+		return ip in self.__hosts
+
+	def __len__(self):
+		return len(self.__hosts)
+
+
+class IdentityCache(object):
+	"""Represents an on-disk table of identified SPs: type, working credentials and firmware.
+	   Entries are keyed by SP MAC with IP as a secondary key, so a known SP is recognized
+	   after its IP changes. MACs are normalized (see ssp.oui.normalize_mac), so the ARP
+	   and VPD forms of one MAC share an entry. The file holds passwords and is only
+	   readable by its owner."""
+
+	__path = None
+	"""File to keep the table in."""
+
+	__ttl = None
+	"""Seconds after which credentials have to be validated again."""
+
+	__entries = None
+	"""Entries by key: MAC or 'ip:<IP>' for SPs with unknown MAC."""
+
+	__by_ip = None
+	"""Entry key by IP."""
+
+	__changed = None
+	"""Keys of entries changed since load(), merged into the file by save()."""
+
+	__dropped = None
+	"""Keys of entries dropped since load()."""
+
+	__lock = None
+	"""Serializes changes and saves of threads sharing the table."""
+
+	def __init__(self, path=DEFAULT_IDENTITY_CACHE, ttl=DEFAULT_IDENTITY_TTL):
+		self.__path = path
+		self.__ttl = ttl
+		self.__lock = threading.RLock()
+		self.load()
+
+	def load(self):
+		"""Load the table from disk. Missing or broken file gives an empty table."""
+		self.__entries = {}
+		self.__by_ip = {}
+		self.__changed = set()
+		self.__dropped = set()
+		if not os.path.exists(self.__path):
+			return
+		try:
+			fd = open(self.__path, 'r')
+			try:
+				self.__entries = json.load(fd)
+			finally:
+				fd.close()
+		except (IOError, ValueError), e:
+			LOG.error("Cannot load identity cache %s. %s", self.__path, e)
+		for key, entry in self.__entries.items():
+			if not key.startswith("ip:") and normalize_mac(key) != key:
+				del self.__entries[key]
+				key = entry['mac'] = normalize_mac(key)
+				self.__entries[key] = entry
+			if entry.get('ip'):
+				self.__by_ip[entry['ip']] = key
+
+	def save(self):
+		"""Atomically write the table to disk with owner only permissions. Entries changed
+		   or dropped here since load() are merged into the file as it is now, so processes
+		   sharing the file do not lose each other's entries."""
+		with self.__lock:
+			directory = os.path.dirname(self.__path)
+			if directory and not os.path.isdir(directory):
+				os.makedirs(directory, 0700)
+			lock = os.open(self.__path + ".lock", os.O_WRONLY | os.O_CREAT, 0600)
+			try:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+				changed = dict([(key, self.__entries[key]) for key in self.__changed if key in self.__entries])
+				dropped = self.__dropped - set(changed.keys())
+				self.load()
+				for key in dropped:
+					self.__entries.pop(key, None)
+				self.__entries.update(changed)
+				for key, entry in changed.items():
+					if entry.get('ip'):
+						stale = self.__by_ip.get(entry['ip'])
+						if stale and stale != key and stale.startswith("ip:"):
+							self.__entries.pop(stale, None)
+						self.__by_ip[entry['ip']] = key
+				tmp = self.__path + ".tmp"
+				fd = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w')
+				try:
+					os.chmod(tmp, 0600)
+					json.dump(self.__entries, fd)
+				finally:
+					fd.close()
+				os.rename(tmp, self.__path)
+			finally:
+				os.close(lock)
+
+	def __key(self, ip=None, mac=None):
+		if mac:
+			return normalize_mac(mac)
+		if ip in self.__by_ip:
+			return self.__by_ip[ip]
+		return ip and "ip:" + ip
+
+	def lookup(self, ip=None, mac=None):
+		"""Return the entry of SP by MAC or, if MAC is unknown, by IP. None if not known.
+		   An entry found by MAC is moved to ip if it was known by another IP."""
+		with self.__lock:
+			key = self.__key(ip, mac)
+			entry = self.__entries.get(key)
+			if entry is None and mac and ip in self.__by_ip:
+				# Known by IP only so far
+				entry = self.__entries.get(self.__by_ip[ip])
+				if entry and not entry.get('mac'):
+					self.__rekey(self.__by_ip[ip], key, entry)
+				elif entry:
+					entry = None
+			if entry and ip and entry.get('ip') != ip:
+				LOG.debug("SP %s moved from %s to %s", key, entry.get('ip'), ip)
+				if self.__by_ip.get(entry.get('ip')) == key:
+					del self.__by_ip[entry['ip']]
+				entry['ip'] = ip
+				self.__by_ip[ip] = key
+				self.__changed.add(key)
+			return entry
+
+	def __rekey(self, old, new, entry):
+		del self.__entries[old]
+		self.__dropped.add(old)
+		entry['mac'] = new
+		self.__entries[new] = entry
+		self.__changed.add(new)
+		if entry.get('ip'):
+			self.__by_ip[entry['ip']] = new
+
+	def fresh(self, entry, now=None):
+		"""Return True if credentials of entry were validated less than TTL ago."""
+		now = now or time.time()
+		return bool(entry and entry.get('user') and entry.get('validated', 0) + self.__ttl > now)
+
+	def remember(self, ip, mac=None, sptype=None, user=None, password=None, firmware=None, now=None):
+		"""Store SP type and credentials just validated on the SP. Return the entry."""
+		now = now or time.time()
+		with self.__lock:
+			key = self.__key(ip, mac)
+			entry = self.lookup(ip, mac) or {'identified': now}
+			entry.update({'ip': ip, 'mac': normalize_mac(mac) or entry.get('mac'), 'validated': now})
+			for name, value in (('sptype', sptype), ('user', user), ('password', password), ('firmware', firmware)):
+				if value is not None:
+					entry[name] = value
+			old = self.__by_ip.get(ip)
+			if old and old != key and old.startswith("ip:"):
+				self.__entries.pop(old, None)
+				self.__dropped.add(old)
+			self.__entries[key] = entry
+			self.__by_ip[ip] = key
+			self.__changed.add(key)
+			return entry
+
+	def record_firmware(self, ip, mac=None, sptype=None, firmware=None):
+		"""Store firmware version read from SP. Credentials and the time they were validated
+		   are kept. Return True if the version changed."""
+		with self.__lock:
+			entry = self.lookup(ip, mac)
+			if entry is None:
+				self.remember(ip, mac, sptype, firmware=firmware)
+				return True
+			if entry.get('firmware') == firmware:
+				return False
+			entry['firmware'] = firmware
+			self.__changed.add(self.__key(ip, mac))
+			return True
+
+	def invalidate(self, ip=None, mac=None):
+		"""Drop credentials of SP (e.g. after authentication failure). SP type is kept."""
+		with self.__lock:
+			entry = self.lookup(ip, mac)
+			if entry:
+				for name in ('user', 'password', 'validated'):
+					entry.pop(name, None)
+				self.__changed.add(self.__key(ip, mac))
+
+	def forget(self, ip=None, mac=None):
+		"""Drop SP from the table."""
+		with self.__lock:
+			key = self.__key(ip, mac)
+			entry = self.__entries.pop(key, None)
+			self.__dropped.add(key)
+			self.__changed.discard(key)
+			if entry and self.__by_ip.get(entry.get('ip')) == key:
+				del self.__by_ip[entry['ip']]
+
+	def changed(self):
+		"""Return True if the table has changes not saved yet."""
+		return bool(self.__changed or self.__dropped)
+
+	def keys(self):
+		return self.__entries.keys()
+
+	def __len__(self):
+		return len(self.__entries)
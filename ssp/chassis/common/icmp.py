@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""ICMP echo (ping) engine pinging many hosts at once from one socket"""
+
+import logging
+import os
+import socket
+import struct
+import time
+
+from ssp.chassis.common.probe import UDP_PROBER
+
+__all__ = [ "ICMP_PROBER", "ping_hosts", "alive_hosts" ]
+LOG = logging.getLogger("ssp.chassis.common.icmp")
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+_ECHO = struct.Struct("!BBHHH")
+"""ICMP type, code, checksum, identifier and sequence number."""
+
+_STAMP = struct.Struct("!d")
+"""Send time carried in the echo payload and returned by the host."""
+
+_PAD = "ssp-ping" * 4
+
+
+def checksum(data):
+	"""Return the Internet checksum (RFC 1071) of data."""
+	if len(data) % 2:
+		data += '\0'
+	total = sum(struct.unpack("!%dH" % (len(data) / 2), data))
+	total = (total >> 16) + (total & 0xffff)
+	total += total >> 16
+	return ~total & 0xffff
+
+
+def echo_request(ident, seq, now=None):
+	"""Return an ICMP echo request datagram carrying send time."""
+	payload = _STAMP.pack(now or time.time()) + _PAD
+	header = _ECHO.pack(ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+	return _ECHO.pack(ICMP_ECHO_REQUEST, 0, checksum(header + payload), ident, seq) + payload
+
+
+def parse_echo_reply(data):
+	"""Return (identifier, sequence, rtt) of an echo reply or None. data may start with an IPv4 header."""
+	if data and ord(data[0]) >> 4 == 4:
+		data = data[(ord(data[0]) & 0x0f) * 4:]
+	if len(data) < _ECHO.size + _STAMP.size:
+		return None
+	mtype, code, csum, ident, seq = _ECHO.unpack_from(data)
+	if mtype != ICMP_ECHO_REPLY:
+		return None
+	sent = _STAMP.unpack_from(data, _ECHO.size)[0]
+	return ident, seq, time.time() - sent
+
+
+class ICMP_PROBER(UDP_PROBER):
+	"""UDP_PROBER sending ICMP echo requests. Uses a raw socket if permitted and an
+	   unprivileged datagram ICMP socket (net.ipv4.ping_group_range) otherwise.
+	   Raises socket.error if neither is allowed."""
+
+	raw = None
+	"""True if the last socket opened was raw."""
+
+	def __init__(self, timeout=1.0, window=None, rate=None, retries=0):
+		UDP_PROBER.__init__(self, 0, timeout=timeout, window=window, rate=rate, retries=retries)
+
+	def _open(self):
+		try:
+			sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+			self.raw = True
+		except socket.error, e:
+			LOG.debug("Raw ICMP socket is not permitted (%s), trying datagram ICMP socket", e)
+			sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+			self.raw = False
+		sock.setblocking(0)
+		return sock
+
+
+def ping_hosts(ips, timeout=1.0, retries=1, rate=None, window=None, callback=None):
+	"""Ping all ips at once and return dict of ip -> RTT in seconds for the hosts which replied.
+	   callback(ip, rtt) is called for every host as soon as it replies.
+	   Raises socket.error if ICMP sockets are not permitted."""
+
+	targets = []
+	seqs = {}
+	for ip in ips:
+		if ip not in seqs:
+			seqs[ip] = len(targets) & 0xffff
+			targets.append(ip)
+	by_seq = {}
+	for ip in targets:
+		by_seq.setdefault(seqs[ip], []).append(ip)
+	# Raw sockets see all echo replies of the host, datagram sockets only own ones
+	ident = (os.getpid() ^ id(by_seq)) & 0xffff
+	prober = ICMP_PROBER(timeout=timeout, window=window, rate=rate, retries=retries)
+	rtts = {}
+
+	def request(ip):
+		return echo_request(ident, seqs[ip])
+
+	def parse(data, addr):
+		reply = parse_echo_reply(data)
+		if reply is None:
+			return None
+		rident, seq, rtt = reply
+		if prober.raw and rident != ident:
+			return None
+		if addr[0] not in by_seq.get(seq, ()):
+			return None
+		return {'target': addr[0], 'host': addr[0], 'rtt': rtt}
+
+	def collect(reply):
+		if reply['host'] in rtts:
+			return
+		rtts[reply['host']] = reply['rtt']
+		if callback:
+			callback(reply['host'], reply['rtt'])
+
+	prober.probe(targets, request, parse, collect)
+	LOG.debug("%d of %d hosts replied to ping", len(rtts), len(targets))
+	return rtts
+
+
+def alive_hosts(ips, timeout=1.0, retries=1):
+	"""Return the set of ips replying to ping. Reachability pre-filter before expensive connects."""
+	return set(ping_hosts(ips, timeout, retries).keys())
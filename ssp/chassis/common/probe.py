@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Non-blocking UDP probing engine shared by the scanners"""
+
+import logging
+import socket
+import select
+import errno
+import time
+from collections import deque
+
+__all__ = [ "UDP_PROBER", "PACER" ]
+LOG = logging.getLogger("ssp.chassis.common.probe")
+
+_SEND_RETRY = (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS)
+"""sendto() errors meaning 'socket buffer is full, try again later'."""
+
+_BURST = 0.02
+"""Seconds of unused send rate allowed to be caught up with a burst."""
+
+_RECV_IGNORE = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+"""recvfrom() errors reported back by ICMP for earlier probes. Not fatal."""
+
+_CANCEL_POLL = 0.05
+"""Seconds between checks of the cancel event of a probe() run."""
+
+
+class PACER(object):
+	"""Loss-based AIMD controller of the probe rate and the listen window.
+
+	   A round ends every round_size probes. A round in which more than loss_threshold
+	   of the replies answered a retransmitted probe (or the socket buffer overflowed)
+	   halves the rate, otherwise the rate grows by a tenth of the initial one.
+	   The listen window follows the smoothed RTT as in RFC 6298, but never exceeds
+	   the initial timeout."""
+
+	START_RATE = 500
+	"""Probes per second to start from when no rate is specified."""
+
+	MIN_RATE = 20
+	MIN_TIMEOUT = 0.1
+	round_size = 64
+	loss_threshold = 0.05
+
+	def __init__(self, rate=None, timeout=1.0, adaptive=False):
+		self.adaptive = adaptive
+		if adaptive and not rate:
+			rate = self.START_RATE
+		self.rate = rate
+		self.max_rate = rate and rate * 8
+		self.step = rate and rate / 10.0
+		self.timeout = timeout
+		self.max_timeout = timeout
+		self.srtt = None
+		self.rttvar = None
+		self.rounds = 0
+		self.sent = 0
+		self.replies = 0
+		self.late = 0
+		self.__round_sent = 0
+		self.__round_replies = 0
+		self.__round_late = 0
+		self.__round_congested = False
+
+	def interval(self):
+		"""Seconds between two probes."""
+		if not self.rate:
+			return 0
+		return 1.0 / self.rate
+
+	def on_send(self):
+		self.sent += 1
+		self.__round_sent += 1
+		if self.__round_sent >= self.round_size:
+			self.__end_round()
+
+	def on_congestion(self):
+		self.__round_congested = True
+
+	def on_reply(self, rtt=None, attempt=1):
+		self.replies += 1
+		self.__round_replies += 1
+		if attempt > 1:
+			self.late += 1
+			self.__round_late += 1
+		if rtt is None or not self.adaptive or attempt > 1:
+			# Karn's algorithm: RTT of retransmitted probes is ambiguous
+			return
+		if self.srtt is None:
+			self.srtt = rtt
+			self.rttvar = rtt / 2
+		else:
+			self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+			self.srtt = 0.875 * self.srtt + 0.125 * rtt
+		self.timeout = min(self.max_timeout, max(self.MIN_TIMEOUT, self.srtt + 4 * self.rttvar))
+
+	def __end_round(self):
+		self.rounds += 1
+		if self.adaptive:
+			loss = float(self.__round_late) / max(self.__round_replies, 1)
+			if self.__round_congested or loss > self.loss_threshold:
+				self.rate = max(self.MIN_RATE, self.rate / 2.0)
+			else:
+				self.rate = min(self.max_rate, self.rate + self.step)
+			LOG.debug("Round %d: %d sent, %d replies, %d late, rate %.0f/s, window %.3fs",
+				self.rounds, self.__round_sent, self.__round_replies, self.__round_late, self.rate, self.timeout)
+		self.__round_sent = 0
+		self.__round_replies = 0
+		self.__round_late = 0
+		self.__round_congested = False
+
+	def stats(self):
+		return {'sent': self.sent, 'replies': self.replies, 'late': self.late, 'rounds': self.rounds,
+			'rate': self.rate, 'timeout': self.timeout, 'srtt': self.srtt}
+
+
+class UDP_PROBER(object):
+	"""Sends datagram probes to many targets from a single non-blocking
+	   socket and collects the replies as they arrive."""
+
+	__port = None
+	"""Destination UDP port of the probes."""
+
+	__timeout = None
+	"""Seconds to keep listening for replies after the last probe was sent."""
+
+	__bind_ip = None
+	"""Local address to send probes from. Any by default."""
+
+	__window = None
+	"""Maximum number of probes waiting for a reply at once. Unbounded if None."""
+
+	__rate = None
+	"""Maximum number of probes sent per second. Unbounded if None."""
+
+	__retries = None
+	"""How many times a probe is sent again to a target which did not reply."""
+
+	__adaptive = None
+	"""Adjust rate and listen window to measured loss and RTT. See PACER."""
+
+	stats = None
+	"""PACER statistics of the last probe() run."""
+
+	def __init__(self, port, timeout=1.0, bind_ip='', window=None, rate=None, retries=0, adaptive=False):
+		self.__port = port
+		self.__timeout = timeout
+		self.__bind_ip = bind_ip
+		self.__window = window
+		self.__rate = rate
+		self.__retries = retries
+		self.__adaptive = adaptive
+
+	def _open(self):
+		"""Return a new non-blocking UDP socket able to send broadcasts."""
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+		sock.bind((self.__bind_ip, 0))
+		sock.setblocking(0)
+		return sock
+
+	def __send(self, sock, target, payload, pacer):
+		"""Send one probe. Return False if it has to be retried later.
+
+		   A target is an address or a tuple (multicast address, local interface address, ...).
+		   Extra tuple items are only meaningful to the request callable."""
+		try:
+			if isinstance(target, tuple):
+				dest = target[0]
+				if target[1]:
+					sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(target[1]))
+			else:
+				dest = target
+			sock.sendto(payload, (dest, self.__port))
+		except socket.error, e:
+			if e.args[0] in _SEND_RETRY:
+				pacer.on_congestion()
+				return False
+			LOG.error("Cannot send probe to %s:%s. %s", target, self.__port, e)
+		return True
+
+	def __drain(self, sock, parse, replies, callback, inflight, answered, attempts, pacer):
+		"""Read every datagram already queued on the socket."""
+		while True:
+			try:
+				data, addr = sock.recvfrom(65535)
+			except socket.error, e:
+				if e.args[0] in _RECV_IGNORE:
+					continue
+				if e.args[0] in _SEND_RETRY:
+					return
+				raise
+			reply = parse(data, addr)
+			if reply is None:
+				continue
+			target = reply.get('target', addr[0])
+			when = inflight.pop(target, None)
+			if target not in answered:
+				answered.add(target)
+				if when is None:
+					pacer.on_reply(None, attempts.get(target, 1))
+				else:
+					pacer.on_reply(time.time() - when, attempts.get(target, 1))
+			reply.setdefault('host', addr[0])
+			replies.append(reply)
+			if callback:
+				callback(reply)
+
+	def __can_send(self, pending, inflight):
+		return pending and (not self.__window or len(inflight) < self.__window)
+
+	def __loop(self, sock, targets, request, parse, callback, replies, answered, pacer, retries, cancel=None):
+		"""Probe targets until every probe is answered or expired or cancel is set."""
+		pending = list(targets)
+		pending.reverse()
+		inflight = {}
+		attempts = {}
+		sent = deque()
+		next_send = time.time()
+		while True:
+			if cancel is not None and cancel.is_set():
+				break
+			now = time.time()
+			while sent and sent[0][0] + pacer.timeout <= now:
+				when, target = sent.popleft()
+				if inflight.get(target) != when:
+					continue
+				del inflight[target]
+				if target not in answered and attempts[target] <= retries:
+					pending.append(target)
+			cansend = self.__can_send(pending, inflight)
+			if not cansend and not inflight:
+				break
+			if sent:
+				wait = max(0, sent[0][0] + pacer.timeout - now)
+			else:
+				wait = pacer.timeout
+			wlist = []
+			if cansend:
+				if next_send > now:
+					wait = min(wait, next_send - now)
+				else:
+					wlist = [sock]
+			if cancel is not None:
+				wait = min(wait, _CANCEL_POLL)
+			try:
+				r, w, x = select.select([sock], wlist, [], wait)
+			except select.error, e:
+				if e.args[0] == errno.EINTR:
+					continue
+				raise
+			if r:
+				self.__drain(sock, parse, replies, callback, inflight, answered, attempts, pacer)
+			while w and self.__can_send(pending, inflight):
+				now = time.time()
+				if now < next_send:
+					break
+				target = pending[-1]
+				if callable(request):
+					payload = request(target)
+				else:
+					payload = request
+				if not self.__send(sock, target, payload, pacer):
+					break
+				pending.pop()
+				attempts[target] = attempts.get(target, 0) + 1
+				inflight[target] = now
+				sent.append((now, target))
+				pacer.on_send()
+				next_send = max(next_send, now - _BURST) + pacer.interval()
+
+	def probe(self, targets, request, parse, callback=None, expected=None, cancel=None):
+		"""Send a probe to every target and return the list of parsed replies.
+
+		   request is the payload string or a callable returning the payload for a target.
+		   parse(data, addr) returns a dict for a valid reply or None to ignore the datagram.
+		   The reply answers the target in its 'target' key or the target equal to the
+		   sender address by default.
+		   callback(reply) is called for every reply as soon as it is parsed.
+		   A probe stays in flight until its target replies or the timeout expires. Targets
+		   which did not reply are probed again up to retries times.
+		   Targets listed in expected (e.g. known from a previous scan) which are still silent
+		   get a final slower retry wave with a longer listen window.
+		   Probing stops early once the threading.Event cancel is set."""
+
+		replies = []
+		answered = set()
+		pacer = PACER(self.__rate, self.__timeout, self.__adaptive)
+		sock = self._open()
+		try:
+			self.__loop(sock, targets, request, parse, callback, replies, answered, pacer, self.__retries, cancel)
+			silent = [t for t in (expected or ()) if t not in answered]
+			if cancel is not None and cancel.is_set():
+				silent = []
+			if silent:
+				LOG.debug("Final retry wave for %d expected but silent targets", len(silent))
+				wave = PACER(pacer.rate and max(PACER.MIN_RATE, pacer.rate / 4.0), self.__timeout * 2)
+				self.__loop(sock, silent, request, parse, callback, replies, answered, wave, 1, cancel)
+				pacer.sent += wave.sent
+				pacer.late += wave.replies
+				pacer.replies += wave.replies
+		finally:
+			sock.close()
+		self.stats = pacer.stats()
+		return replies
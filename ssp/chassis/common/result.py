@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Container for discovery results"""
+
+import logging
+
+from ssp.netconfig import classify_ips
+
+__all__ = [ "DiscoveryRecord", "DiscoveryResultSet" ]
+LOG = logging.getLogger("ssp.chassis.common.result")
+
+LOCAL_HOSTS = frozenset(['[::]','127.0.0.1','0::0'])
+"""Replies from these addresses are ignored."""
+
+
+class DiscoveryRecord(object):
+	"""Represents one discovered host. Can be read as a dict for compatibility."""
+
+	__slots__ = ('host', 'mac', 'proto', 'scanners', 'info')
+
+	def __init__(self, host, mac=None, proto=None, scanners=None, info=None):
+		self.host = host
+		self.mac = mac
+		self.proto = proto or set()
+		self.scanners = scanners or []
+		self.info = info or {}
+
+	def __getitem__(self, key):
+		if key not in self.__slots__:
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __contains__(self, key):
+		return key in self.__slots__
+
+	def get(self, key, default=None):
+		if key not in self.__slots__:
+			return default
+		return getattr(self, key)
+
+	def keys(self):
+		return list(self.__slots__)
+
+	def to_dict(self):
+		"""Return the record as a plain dict suitable for JSON or XML-RPC."""
+		return {'host': self.host, 'mac': self.mac, 'proto': sorted(self.proto),
+			'scanners': self.scanners, 'info': self.info}
+
+	@classmethod
+	def from_dict(cls, d):
+		"""Return a record made of to_dict() output."""
+		return cls(d['host'], d.get('mac'), set(d.get('proto', ())), list(d.get('scanners', ())), dict(d.get('info', {})))
+
+	def __repr__(self):
+		return repr(dict([(k, getattr(self, k)) for k in self.__slots__]))
+
+
+class DiscoveryResultSet(object):
+	"""Discovered hosts indexed by IP, MAC, protocol and originating scanner.
+	   Behaves as a read-only dict of DiscoveryRecord keyed by IP."""
+
+	__hosts = None
+	"""DiscoveryRecord by IP."""
+
+	__by_mac = None
+	"""Set of IPs by MAC."""
+
+	__by_proto = None
+	"""Set of IPs by protocol."""
+
+	__by_scanner = None
+	"""Set of IPs by originating scanner name."""
+
+	def __init__(self, records=None):
+		self.__hosts = {}
+		self.__by_mac = {}
+		self.__by_proto = {}
+		self.__by_scanner = {}
+		if records:
+			for s in records:
+				self.add(s)
+
+	def __index(self, index, key, ip):
+		if key is None:
+			return
+		if key in index:
+			index[key].add(ip)
+		else:
+			index[key] = set([ip])
+
+	def __scanner_name(self, scanner):
+		return scanner.get('origin') or scanner.get('scanner')
+
+	def add(self, s):
+		"""Merge a raw scanner record {'host', 'type', 'scanner'[, 'info', 'mac']}.
+		   Return 'new' for a new host, 'update' for a known one and None if ignored."""
+		ip = s['host']
+		if ip in LOCAL_HOSTS:
+			return None
+		r = self.__hosts.get(ip)
+		if r is None:
+			r = self.__hosts[ip] = DiscoveryRecord(ip)
+			event = 'new'
+		else:
+			event = 'update'
+		r.proto.add(s['type'])
+		r.scanners.append(s['scanner'])
+		r.info.update(s.get('info', {}))
+		self.__index(self.__by_proto, s['type'], ip)
+		self.__index(self.__by_scanner, self.__scanner_name(s['scanner']), ip)
+		if s.get('mac'):
+			self.set_mac(ip, s['mac'])
+		return event
+
+	def add_record(self, record):
+		"""Merge a DiscoveryRecord (e.g. from another set)."""
+		ip = record.host
+		r = self.__hosts.get(ip)
+		if r is None:
+			r = self.__hosts[ip] = DiscoveryRecord(ip)
+			event = 'new'
+		else:
+			event = 'update'
+		r.proto.update(record.proto)
+		r.scanners.extend(record.scanners)
+		r.info.update(record.info)
+		for proto in record.proto:
+			self.__index(self.__by_proto, proto, ip)
+		for scanner in record.scanners:
+			self.__index(self.__by_scanner, self.__scanner_name(scanner), ip)
+		if record.mac:
+			self.set_mac(ip, record.mac)
+		return event
+
+	def set_mac(self, ip, mac):
+		"""Set MAC address of a known host."""
+		r = self.__hosts[ip]
+		mac = mac.lower()
+		if r.mac and r.mac != mac and r.mac in self.__by_mac:
+			self.__by_mac[r.mac].discard(ip)
+		r.mac = mac
+		self.__index(self.__by_mac, mac, ip)
+
+	def update(self, other):
+		"""Merge all hosts of other DiscoveryResultSet into this one."""
+		for record in other.values():
+			self.add_record(record)
+		return self
+
+	def __ior__(self, other):
+		return self.update(other)
+
+	def __or__(self, other):
+		return DiscoveryResultSet().update(self).update(other)
+
+	def to_list(self):
+		"""Return all records as a list of plain dicts suitable for JSON or XML-RPC."""
+		return [r.to_dict() for r in self.__hosts.values()]
+
+	@classmethod
+	def from_list(cls, records):
+		"""Return a set made of to_list() output."""
+		out = cls()
+		for d in records:
+			out.add_record(DiscoveryRecord.from_dict(d))
+		return out
+
+	def by_mac(self, mac):
+		"""Return the list of records with specified MAC."""
+		return [self.__hosts[ip] for ip in self.__by_mac.get(mac.lower(), ())]
+
+	def by_proto(self, proto):
+		"""Return the set of IPs which replied to specified protocol."""
+		return set(self.__by_proto.get(proto, ()))
+
+	def by_scanner(self, name):
+		"""Return the set of IPs found by specified scanner."""
+		return set(self.__by_scanner.get(name, ()))
+
+	def only_proto(self, proto):
+		"""Return the set of IPs which replied to specified protocol and nothing else."""
+		return set([ip for ip in self.__by_proto.get(proto, ()) if len(self.__hosts[ip].proto) == 1])
+
+	def by_network(self):
+		"""Return dict of globaly defined network name -> set of IPs in it."""
+		out={}
+		for ip, names in classify_ips(self.__hosts.keys()).iteritems():
+			for name in names:
+				out.setdefault(name, set()).add(ip)
+		return out
+
+	def protocols(self):
+		return self.__by_proto.keys()
+
+	def scanners(self):
+		return self.__by_scanner.keys()
+
+	def __getitem__(self, ip):
+		return self.__hosts[ip]
+
+	def __contains__(self, ip):
+		return ip in self.__hosts
+
+	def __iter__(self):
+		return iter(self.__hosts)
+
+	def __len__(self):
+		return len(self.__hosts)
+
+	def get(self, ip, default=None):
+		return self.__hosts.get(ip, default)
+
+	def keys(self):
+		return self.__hosts.keys()
+
+	def values(self):
+		return self.__hosts.values()
+
+	def items(self):
+		return self.__hosts.items()
+
+	def __repr__(self):
+		return repr(self.__hosts)
@@ -20,10 +20,13 @@
 """Tools to scan for SP devices"""
 
 import logging
+import threading
+import Queue
 import time
 import re
 
-from ssp.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks
+from ssp.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks, get_networks
+from ssp.chassis.common.result import DiscoveryResultSet
 from socket import gethostname,getaddrinfo
 
 HWCONTROLS = [ "COMMON_SCANNER" ]
@@ -52,6 +55,37 @@ def Request_decorator(func):
 	return decorator
 
 
+def stream_records(run):
+	"""Call run(callback) in a background thread and yield (event, host, record)
+	   for every record passed to callback as soon as it arrives. See DiscoveryResultSet.add() for events."""
+	q=Queue.Queue()
+	done=object()
+	failure=[]
+
+	def worker():
+		try:
+			run(q.put)
+		except Exception, e:
+			failure.append(e)
+		q.put(done)
+
+	t=threading.Thread(target=worker)
+	t.daemon=True
+	t.start()
+	out=DiscoveryResultSet()
+	while True:
+		try:
+			s=q.get(True, 1)
+		except Queue.Empty:
+			continue
+		if s is done:
+			break
+		event=out.add(s)
+		if event:
+			yield event, s['host'], out[s['host']]
+	if failure:
+		raise failure[0]
+
 
 class COM_SCANNER(object):
 	"""Represents an skeleton SCANNER class."""
@@ -68,43 +102,96 @@ class COM_SCANNER(object):
 	__hostname = None
 	"""Hostname of the local host"""
 
-	def __init__(self, host=None, iface=None, networks=None):
+	timeout = 1.0
+	"""Seconds to wait for replies after the last probe was sent."""
+
+	def __init__(self, host=None, iface=None, networks=None, timeout=None):
 		self.__host = host
 		self.__ifaces = iface
 		self.__networks = networks
 		self.__hostname = gethostname()
+		if timeout is not None:
+			self.timeout = timeout
+
+	__sink = None
+	"""Callback receiving every host record as soon as it is discovered."""
+
+	def _found(self, h):
+		"""Pass a freshly discovered host record to the streaming consumer if any."""
+		if self.__sink:
+			h['scanner'].setdefault('origin', self.name)
+			self.__sink(h)
 
 	@Request_decorator
 	def __post_process(self,scanlist=None):
-		out={}
+		out=DiscoveryResultSet()
 		for s in scanlist:
-			if s['host'] in out.keys():
-				out[s['host']]['proto'].add(s['type'])
-				out[s['host']]['scanners'].append(s['scanner'])
-			elif s['host'] not in ['[::]','127.0.0.1','0::0']:
-				out[s['host']]={'proto':set([s['type']]),'scanners':[s['scanner']]}
+			s['scanner'].setdefault('origin', self.name)
+			out.add(s)
 		return out
 
+	def __run(self, scan, callback):
+		"""Run scan method with callback set as records sink."""
+		self.__sink = callback
+		try:
+			return scan()
+		finally:
+			self.__sink = None
+
 	@Request_decorator
-	def scan(self, networks=None):
-		"""Scan for SP devices on selected networks only."""
+	def scan(self, networks=None, callback=None):
+		"""Scan for SP devices on selected networks only.
+		   callback(record) is called for every raw host record as soon as it arrives."""
 		if networks:
 		    scanset=set(networks)
 		else:
 		    scanset=set(['management'])
 		networks_to_scan=get_global_to_local_networks_projection(scanset)
-		s=self._scan(networks_to_scan)
+		s=self.__run(lambda: self._scan(networks_to_scan), callback)
 		return self.__post_process(s)
 
 	@Request_decorator
-	def scan_all(self):
+	def scan_all(self, callback=None):
 		"""Scan for SP devices on all globaly defined networks."""
 		networks_to_scan=get_all_global_to_local_networks_projection()
-		s=self._scan(networks_to_scan)
+		s=self.__run(lambda: self._scan(networks_to_scan), callback)
 		return self.__post_process(s)
 
 	@Request_decorator
-	def scan_blindly(self):
+	def scan_blindly(self, callback=None):
 		"""Scan for SP devices on all globaly defined networks."""
-		s=self._scan_blindly()
+		s=self.__run(self._scan_blindly, callback)
+		return self.__post_process(s)
+
+	@Request_decorator
+	def probe(self, ips, callback=None):
+		"""Probe specified IPs directly (by unicast) for SP devices."""
+		s=self.__run(lambda: self._probe(list(ips)), callback)
+		return self.__post_process(s)
+
+	@Request_decorator
+	def scan_unicast(self, networks=None, cidrs=None, rate=2000, retries=1, adaptive=True, expected=None, callback=None):
+		"""Probe every address of selected globaly defined networks (all by default) and/or
+		   of arbitrary CIDRs by unicast. For segments filtering broadcast and multicast.
+		   rate limits probes per second, retries resends probes to silent addresses.
+		   With adaptive the rate and listen window follow measured loss and RTT.
+		   IPs in expected (e.g. from a previous scan) still silent get a final retry wave."""
+		targets=set(cidrs or [])
+		if networks or not cidrs:
+			targets.update(get_networks(networks and set(networks)))
+		pacing={'rate': rate, 'retries': retries, 'adaptive': adaptive, 'expected': expected}
+		s=self.__run(lambda: self._scan_unicast(sorted(targets), **pacing), callback)
 		return self.__post_process(s)
+
+	def iscan(self, networks=None):
+		"""Scan for SP devices on selected networks and yield (event, host, record) as replies arrive.
+		   event is 'new' for the first reply from a host and 'update' for later replies enriching it."""
+		return stream_records(lambda callback: self.scan(networks, callback=callback))
+
+	def iscan_all(self):
+		"""Same as iscan() for all globaly defined networks."""
+		return stream_records(lambda callback: self.scan_all(callback=callback))
+
+	def iscan_blindly(self):
+		"""Same as iscan() without specifing interfaces."""
+		return stream_records(lambda callback: self.scan_blindly(callback=callback))
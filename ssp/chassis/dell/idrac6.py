@@ -33,6 +33,23 @@ __all__ = HWCONTROLS
 
 LOG = logging.getLogger("ssp.chassis.dell.idrac6")
 
+VPD_COMMANDS = {
+	'sysinfo':	"racadm getsysinfo",
+	'spinfo':	"racadm getconfig -g idRacInfo",
+	'spxinfo':	"show hdwr1/chassis1",
+}
+"""Commands VPD is read from."""
+
+VPD_QUERIES = {
+	# VPD group: commands it needs (system values are keyed by the spxinfo PlatformGUID)
+	'identity':	('sysinfo', 'spinfo', 'spxinfo'),
+	'macs':		('sysinfo', 'spxinfo'),
+	'firmware':	('sysinfo',),
+	'network':	('sysinfo',),
+	'power':	('sysinfo', 'spxinfo'),
+}
+"""Commands to run for each VPD group. See ssp.service_processor.VPD_GROUPS."""
+
 
 def Request_decorator(func):
 	"""Logs all requests."""
@@ -171,81 +188,102 @@ class DELLiDRAC6:
 
 
 	@Request_decorator
-	def getvpd(self):
-		"""Returns SP and systems VPD data."""
-
-		sysinfo = self.__sshpipe.command("racadm getsysinfo")
-		spinfo = self.__sshpipe.command("racadm getconfig -g idRacInfo")
-		spxinfo = self.__sshpipe.command("show hdwr1/chassis1")
+	def getvpd(self, fields=None):
+		"""Returns SP and systems VPD data.
+
+		   fields limits retrieval to the listed VPD groups (see VPD_QUERIES) so only
+		   the racadm commands they need are run. Values of other groups keep their defaults."""
+
+		commands = set()
+		for field in fields or VPD_QUERIES.keys():
+			if field not in VPD_QUERIES:
+				raise ValueError("Unknown VPD field {0}".format(field))
+			commands.update(VPD_QUERIES[field])
+		want = set(fields or VPD_QUERIES.keys())
+
+		sysinfo = spinfo = spxinfo = ''
+		if 'sysinfo' in commands:
+			sysinfo = self.__sshpipe.command(VPD_COMMANDS['sysinfo'])
+		if 'spinfo' in commands:
+			spinfo = self.__sshpipe.command(VPD_COMMANDS['spinfo'])
+		if 'spxinfo' in commands:
+			spxinfo = self.__sshpipe.command(VPD_COMMANDS['spxinfo'])
 		system={'macs':{}, 'sn':'', 'model':'', 'power':'' }
 		vpd={	'sp':	{'uuid':'', 'mac':'', 'name':'', 'ip':'', 'version':'', 'product':'', 'model':''},
 			'sys':	{}}
 
 		# SP attributes
-		res = re.search(r"(?m)^MAC Address\s+=\s+([a-f0-9:]{17}$)", sysinfo)
-		if res:
-			sp_mac=res.group(1)
-			vpd['sp']['mac']=sp_mac
-
-		res = re.search(r"(?m)^DNS RAC Name\s+=\s+([A-Za-z0-9-]+)$", sysinfo)
-		if res:
-			sp_name=res.group(1)
-			vpd['sp']['name']=sp_name
-
-		res = re.search(r"(?m)^Firmware Version\s+=\s+([0-9.]+)$", sysinfo)
-		if res:
-			sp_ver=res.group(1)
-			vpd['sp']['version']=sp_ver
-
-		res = re.search(r"(?m)^Current IP Address\s+=\s+([0-9.]+)$", sysinfo)
-		if res:
-			sp_ip=res.group(1)
-			vpd['sp']['ip']=sp_ip
-
-		res = re.search(r"(?m)^# idRacProductInfo\s*=\s*([A-Za-z0-9.-_ ]+)$", spinfo)
-		if res:
-			sp_prod = res.group(1)
-			vpd['sp']['product']=sp_prod
-
-		res = re.search(r"(?m)^# idRacName\s*=\s*([A-Za-z0-9]+)$", spinfo)
-		if res:
-			sp_model = res.group(1)
-			vpd['sp']['model']=sp_model
-
-		res = re.search(r"(?m)^# idRacType\s*=\s*([0-9]+)$", spinfo)
-		if res:
-			sp_subtype = res.group(1)
-			vpd['sp']['subtype']=sp_subtype
+		if 'macs' in want:
+			res = re.search(r"(?m)^MAC Address\s+=\s+([a-f0-9:]{17}$)", sysinfo)
+			if res:
+				sp_mac=res.group(1)
+				vpd['sp']['mac']=sp_mac
+
+		if 'network' in want:
+			res = re.search(r"(?m)^DNS RAC Name\s+=\s+([A-Za-z0-9-]+)$", sysinfo)
+			if res:
+				sp_name=res.group(1)
+				vpd['sp']['name']=sp_name
+
+			res = re.search(r"(?m)^Current IP Address\s+=\s+([0-9.]+)$", sysinfo)
+			if res:
+				sp_ip=res.group(1)
+				vpd['sp']['ip']=sp_ip
+
+		if 'firmware' in want:
+			res = re.search(r"(?m)^Firmware Version\s+=\s+([0-9.]+)$", sysinfo)
+			if res:
+				sp_ver=res.group(1)
+				vpd['sp']['version']=sp_ver
+
+		if 'identity' in want:
+			res = re.search(r"(?m)^# idRacProductInfo\s*=\s*([A-Za-z0-9.-_ ]+)$", spinfo)
+			if res:
+				sp_prod = res.group(1)
+				vpd['sp']['product']=sp_prod
+
+			res = re.search(r"(?m)^# idRacName\s*=\s*([A-Za-z0-9]+)$", spinfo)
+			if res:
+				sp_model = res.group(1)
+				vpd['sp']['model']=sp_model
+
+			res = re.search(r"(?m)^# idRacType\s*=\s*([0-9]+)$", spinfo)
+			if res:
+				sp_subtype = res.group(1)
+				vpd['sp']['subtype']=sp_subtype
 
 		# SYSTEM attributes
 		res = re.search(r"(?m)^\s+PlatformGUID\s+=\s+([A-Za-z0-9-]+)$", spxinfo)
-		if res:
-			sys_uuid=res.group(1).replace("-", "").upper()
-			vpd['sys'][sys_uuid]=system
-			# iDRAC share uuid between chassis and system
+		if not res:
+			return vpd
+		sys_uuid=res.group(1).replace("-", "").upper()
+		vpd['sys'][sys_uuid]=system
+		# iDRAC share uuid between chassis and system
+		if 'identity' in want:
 			vpd['sp']['uuid']=sys_uuid
 
-		for res in re.finditer(r"(?m)^NIC(?P<id>[0-9]+) Ethernet\s+=\s+(?P<mac>[a-f0-9:]{17}$)",sysinfo):
-			iface = res.groupdict()
-			eth_index = str(int(iface['id']) - 1)
-			vpd['sys'][sys_uuid]['macs'][eth_index] = iface['mac']
-
-		res = re.search(r"(?m)^System Model\s+=\s+([A-Za-z0-9.-_ ]+)$", sysinfo)
-		if res != None:
-			sys_model=res.group(1)
-			vpd['sys'][sys_uuid]['model']=sys_model
-		else:
-			ok_flag = False
-
-		res = re.search(r"(?m)^Service Tag\s+=\s+([A-Za-z0-9]+)$", sysinfo)
-		if res:
-			sys_sn=res.group(1)
-			vpd['sys'][sys_uuid]['sn']=sys_sn
-
-		res = re.search(r"(?m)^Power Status\s+=\s+.*(ON|OFF)$", sysinfo)
-		if res:
-			sys_power=res.group(1)
-			vpd['sys'][sys_uuid]['power']=sys_power
+		if 'macs' in want:
+			for res in re.finditer(r"(?m)^NIC(?P<id>[0-9]+) Ethernet\s+=\s+(?P<mac>[a-f0-9:]{17}$)",sysinfo):
+				iface = res.groupdict()
+				eth_index = str(int(iface['id']) - 1)
+				vpd['sys'][sys_uuid]['macs'][eth_index] = iface['mac']
+
+		if 'identity' in want:
+			res = re.search(r"(?m)^System Model\s+=\s+([A-Za-z0-9.-_ ]+)$", sysinfo)
+			if res:
+				sys_model=res.group(1)
+				vpd['sys'][sys_uuid]['model']=sys_model
+
+			res = re.search(r"(?m)^Service Tag\s+=\s+([A-Za-z0-9]+)$", sysinfo)
+			if res:
+				sys_sn=res.group(1)
+				vpd['sys'][sys_uuid]['sn']=sys_sn
+
+		if 'power' in want:
+			res = re.search(r"(?m)^Power Status\s+=\s+.*(ON|OFF)$", sysinfo)
+			if res:
+				sys_power=res.group(1)
+				vpd['sys'][sys_uuid]['power']=sys_power
 
 		return vpd
 
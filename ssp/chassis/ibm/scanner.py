@@ -25,7 +25,7 @@ import subprocess
 import time
 import re
 
-from ssp.chassis.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks
+from ssp.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks
 from ssp.chassis.wbem.scanner import WBEM_SCANNER
 from ssp.chassis.common.scanner import COM_SCANNER
 from socket import gethostname,getaddrinfo
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""IPMI Get Channel Authentication Capabilities prober (IPMI v2.0 22.13)"""
+
+import logging
+import struct
+
+from ssp.chassis.common.probe import UDP_PROBER
+from ssp.chassis.ipmi.rmcp import RMCP_PORT, RMCP_VERSION, RMCP_NOACK_SEQ
+from ssp.netconfig import iter_hosts
+
+__all__ = [ "get_channel_auth_capabilities" ]
+LOG = logging.getLogger("ssp.chassis.ipmi.authcap")
+
+RMCP_CLASS_IPMI = 0x07
+IPMI_BMC_ADDR = 0x20
+IPMI_REMOTE_SWID = 0x81
+IPMI_NETFN_APP = 0x06
+IPMI_CMD_GET_CHANNEL_AUTH_CAPS = 0x38
+IPMI_CHANNEL_CURRENT = 0x0E
+IPMI_GET_V2_DATA = 0x80
+IPMI_PRIV_ADMIN = 0x04
+IPMI_CC_INVALID_DATA = 0xCC
+
+WINDOW = 256
+"""Requests awaiting replies at once when no rate is given."""
+
+AUTH_TYPES = ((0x01, 'none'), (0x02, 'md2'), (0x04, 'md5'), (0x10, 'password'), (0x20, 'oem'))
+"""Authentication type support bits."""
+
+
+def _checksum(data):
+	"""Return IPMI 2's complement checksum of a byte string."""
+	return -sum(struct.unpack("%dB" % len(data), data)) & 0xFF
+
+
+def auth_capabilities_request(seq=0, v2=True):
+	"""Return a session-less Get Channel Authentication Capabilities datagram."""
+	channel = IPMI_CHANNEL_CURRENT
+	if v2:
+		channel |= IPMI_GET_V2_DATA
+	head = struct.pack("!BB", IPMI_BMC_ADDR, IPMI_NETFN_APP << 2)
+	body = struct.pack("!BBBBB", IPMI_REMOTE_SWID, (seq & 0x3F) << 2,
+			   IPMI_CMD_GET_CHANNEL_AUTH_CAPS, channel, IPMI_PRIV_ADMIN)
+	msg = head + struct.pack("!B", _checksum(head)) + body + struct.pack("!B", _checksum(body))
+	rmcp = struct.pack("!BBBB", RMCP_VERSION, 0, RMCP_NOACK_SEQ, RMCP_CLASS_IPMI)
+	session = struct.pack("!BIIB", 0, 0, 0, len(msg))
+	return rmcp + session + msg
+
+
+def parse_auth_capabilities(data, addr=None):
+	"""Return a dict describing the capabilities in data or None if it is not such a reply."""
+	if len(data) < 14:
+		return None
+	version, reserved, seq, mclass = struct.unpack_from("!BBBB", data)
+	if version != RMCP_VERSION or mclass & 0x1F != RMCP_CLASS_IPMI:
+		return None
+	authtype = struct.unpack_from("!B", data, 4)[0]
+	offset = 4 + 9
+	if authtype != 0:
+		offset += 16
+	if len(data) < offset + 1:
+		return None
+	length = struct.unpack_from("!B", data, offset)[0]
+	msg = data[offset + 1:offset + 1 + length]
+	if len(msg) < 8:
+		return None
+	rqaddr, netfn, chk1, rsaddr, rqseq, cmd, cc = struct.unpack_from("!7B", msg)
+	if netfn >> 2 != IPMI_NETFN_APP + 1 or cmd != IPMI_CMD_GET_CHANNEL_AUTH_CAPS:
+		return None
+	caps = {'seq': rqseq >> 2, 'cc': cc}
+	if cc != 0 or len(msg) < 16:
+		return caps
+	channel, auth, login, ext = struct.unpack_from("!4B", msg, 7)
+	caps['channel'] = channel
+	caps['auth_types'] = [name for bit, name in AUTH_TYPES if auth & bit]
+	caps['kg'] = bool(login & 0x20)
+	caps['per_message_auth'] = not login & 0x10
+	caps['user_level_auth'] = not login & 0x08
+	caps['non_null_users'] = bool(login & 0x04)
+	caps['null_users'] = bool(login & 0x02)
+	caps['anonymous_login'] = bool(login & 0x01)
+	if auth & 0x80 and ext & 0x02:
+		caps['ipmi_version'] = '2.0'
+	else:
+		caps['ipmi_version'] = '1.5'
+	caps['oem_iana'] = struct.unpack("!I", "\x00" + msg[11:14])[0]
+	caps['oem_aux'] = struct.unpack_from("!B", msg, 14)[0]
+	return caps
+
+
+def get_channel_auth_capabilities(targets, timeout=1.0, window=None, callback=None, rate=None, retries=0, adaptive=False, expected=None, cancel=None):
+	"""Ask every host of the targets (addresses, broadcasts or CIDR networks) for its
+	   channel authentication capabilities and return the list of replies.
+
+	   Hosts rejecting the IPMI v2.0 form of the request are asked again in the v1.5 form.
+	   rate limits requests per second and retries resends requests to silent hosts.
+	   window limits requests awaiting replies at once, by default as many as rate sends in timeout.
+	   Probing stops early once the threading.Event cancel is set.
+	   See UDP_PROBER for adaptive pacing and the final retry wave for expected hosts.
+	   Each reply carries 'scan_ip', the target it answered, when it can be told by sequence number."""
+
+	hosts = []
+	for spec in targets:
+		if spec:
+			hosts.extend(iter_hosts(spec))
+	seqs = {}
+	for index, host in enumerate(hosts):
+		seqs[host] = index % 0x40
+	result = {}
+	legacy = []
+
+	def accept(caps, addr):
+		caps['host'] = addr[0]
+		if caps['cc'] == IPMI_CC_INVALID_DATA:
+			legacy.append(addr[0])
+		elif caps['cc'] == 0 and addr[0] not in result:
+			result[addr[0]] = caps
+			if callback:
+				callback(caps)
+		return caps
+
+	def parse(data, addr):
+		caps = parse_auth_capabilities(data, addr)
+		if caps is None:
+			LOG.debug("Ignoring non-IPMI datagram from %s", addr[0])
+			return None
+		if len(hosts) <= 0x40 and caps['seq'] < len(hosts):
+			caps['scan_ip'] = hosts[caps['seq']]
+		else:
+			caps['scan_ip'] = None
+		return accept(caps, addr)
+
+	def parse_legacy(data, addr):
+		caps = parse_auth_capabilities(data, addr)
+		if caps is None or caps['cc'] != 0:
+			return None
+		caps['scan_ip'] = addr[0]
+		return accept(caps, addr)
+
+	if window is None:
+		window = max(WINDOW, int(rate * timeout)) if rate else WINDOW
+	prober = UDP_PROBER(RMCP_PORT, timeout=timeout, window=window, rate=rate, retries=retries, adaptive=adaptive)
+	LOG.debug("Probing %d IPMI targets", len(hosts))
+	prober.probe(hosts, lambda h: auth_capabilities_request(seqs.get(h, 0)), parse, expected=expected, cancel=cancel)
+
+	legacy = [h for h in set(legacy) if h not in result]
+	if legacy and not (cancel is not None and cancel.is_set()):
+		LOG.debug("Probing %d IPMI v1.5 only targets", len(legacy))
+		prober.probe(legacy, auth_capabilities_request(v2=False), parse_legacy, cancel=cancel)
+	return result.values()
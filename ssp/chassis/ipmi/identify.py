@@ -24,16 +24,26 @@ import subprocess
 import time
 import sys,os,re
 import httplib
+import socket
+import threading
+from multiprocessing.pool import ThreadPool
+
+from ssp.oui import vendor_for, vendors_for
+from ssp.netconfig import resolve_macs
+from ssp.chassis.common.icmp import ping_hosts
+from ssp.fingerprint import fingerprint
 
 __all__ = [ "IDENT" ]
 LOG = logging.getLogger("ssp.ident.ipmi")
 
-__MAC_TABLE_FILE="/home/yurix/eucalyptus/common/c2/hw/chassis/nmap-mac-prefixes"
-
-defaults={	'DELL-iDRAC6':{'user':'root','pass':'calvin'},
-		'IBM-BLADECENTER':{'user':'USERID','pass':'PASSW0RD'},
-		'IBM-RSA':{'user':'USERID','pass':'PASSW0RD'},
-		'HP-iLO':{'user':'Administrator','pass':None}}
+defaults={	'DELL-iDRAC6':[{'user':'root','pass':'calvin'}],
+		'IBM-BLADECENTER':[{'user':'USERID','pass':'PASSW0RD'},
+				   {'user':'USERID','pass':'PASSWORD'}],
+		'IBM-RSA':[{'user':'USERID','pass':'PASSW0RD'},
+			   {'user':'USERID','pass':'PASSWORD'}],
+		'HP-iLO':[{'user':'Administrator','pass':None},
+			  {'user':'admin','pass':'admin'}]}
+"""Factory default credential sets of every SP type, most common first."""
 
 def Request_decorator(func):
 	"""Logs all requests."""
@@ -52,6 +62,12 @@ def Request_decorator(func):
 @Request_decorator
 def ping(ip):
 	"""Ping ip and return True if alive."""
+	try:
+		if ping_hosts([ip], timeout=1.0):
+			return True
+		return None
+	except socket.error, e:
+		LOG.debug("Cannot ping in-process (%s), running ping command.", e)
 	try:
 		if subprocess.call(["ping","-c1","-w1", "-nrq", ip], stdout=open('/dev/null', 'w'), stderr=subprocess.STDOUT):
 			return None
@@ -64,13 +80,13 @@ def ping(ip):
 
 @Request_decorator
 def mac_by_ip(ip):
-	"""Lookup mac via arp table after ping request."""
-	
-	if ping(ip):
-		s = subprocess.Popen(["arp","-n", ip], stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
-		mac = re.search(r"(?m)^" + ip + r"\s+ether\s+([a-f0-9:]{17}).*$", s)
-		if mac:
-			return mac.group(1)
+	"""Lookup mac via arp table after triggering neighbor resolution."""
+	return resolve_macs([ip]).get(ip)
+
+
+def macs_by_ip(ips, timeout=1.0):
+	"""Return dict of ip -> mac of all directly connected ips resolved at once."""
+	return resolve_macs(ips, timeout)
 
 
 @Request_decorator
@@ -83,20 +99,7 @@ def macpreffix(mac):
 @Request_decorator
 def vendor_by_mac(mac):
 	"""Lookup mac via nmap-mac-prefixes table to guess SP vendor."""
-	
-	
-	try:
-		fd = open( __MAC_TABLE_FILE, 'r' )
-	except:
-		LOG.error("Cannot open mac table at %s .",
-			__MAC_TABLE_FILE)
-		raise
-	
-	data = fd.read()
-	vendor = re.search(r"(?m)^" + macpreffix(mac) + r" (.*)$", data)
-	if vendor:
-		vendor=vendor.group(1)
-	return vendor
+	return vendor_for(mac)
 
 
 @Request_decorator
@@ -108,11 +111,15 @@ def vendor_by_ip(ip):
 		return vendor_by_mac(mac)
 
 
-@Request_decorator
-def guess_sptype_by_ip(ip):
-	"""Return string array with possible SP types."""
-	
-	vendor=vendor_by_ip(ip)
+def vendors_by_ip(ips, timeout=1.0):
+	"""Return dict of ip -> vendor (None if unknown) of all resolved ips."""
+	macs = macs_by_ip(ips, timeout)
+	vendors = vendors_for(macs.values())
+	return dict([(ip, vendors[mac]) for ip, mac in macs.items()])
+
+
+def sptype_by_vendor(vendor):
+	"""Return possible SP types for MAC vendor name."""
 	if vendor in ("Dell","Dell Inc.","Dell Computer"):
 		return ("DELL-iDRAC6","DELL-CMC")
 	if vendor in ("IBM","IBM Japan, Fujisawa Mt+d"):
@@ -122,41 +129,59 @@ def guess_sptype_by_ip(ip):
 
 
 @Request_decorator
-def guess_sptype_by_http(ip):
-	"""Return array of strings with guessed SP types."""
+def guess_sptype_by_ip(ip):
+	"""Return string array with possible SP types."""
+	
+	return sptype_by_vendor(vendor_by_ip(ip))
+
+
+def http_fingerprint(ip, timeout=None):
+	"""Return (SP type, evidence) guessed from the web interface of ip. SP type is None if unknown.
+	   evidence is a dict of what was seen: 'location', 'https_location' and 'body_match'.
+	   timeout (seconds) applies to every connect and read."""
+	evidence = {}
 	try:
-		conn = httplib.HTTPConnection(ip)
+		conn = httplib.HTTPConnection(ip, timeout=timeout)
 		conn.request("GET", "/")
 		r1 = conn.getresponse()
 		location = r1.getheader('location')
 		doc = r1.read()
 		conn.close()
-	except:
-		return None
+	except Exception, e:
+		evidence['error'] = str(e)
+		return None, evidence
 	if location:
+		evidence['location'] = location
 		if re.match(r"https://" + ip + "/start.html",location):
-			return ("DELL-iDRAC6")
+			return ("DELL-iDRAC6"), evidence
 		if re.match(r"http://" + ip + "/private/main.php",location):
-			return ("IBM-BLADECENTER")
+			return ("IBM-BLADECENTER"), evidence
 		if re.match(r"http://" + ip + "/private/testcookie.ssi",location):
-			return ("IBM-RSA")
+			return ("IBM-RSA"), evidence
 		if re.match(r"https://" + ip + ":443/",location):
 			try:
-				conns = httplib.HTTPSConnection(ip)
+				conns = httplib.HTTPSConnection(ip, timeout=timeout)
 				conns.request("GET", "/")
 				r2 = conns.getresponse()
 				locations = r2.getheader('location')
 				conns.close()
 				if locations:
+					evidence['https_location'] = locations
 					if re.match(r"https://" + ip + ":443//cgi-bin/webcgi/index",locations):
-						return ("DELL-CMC")
-			except:
-				pass
+						return ("DELL-CMC"), evidence
+			except Exception, e:
+				evidence['https_error'] = str(e)
 	if doc:
 		if re.search(r"HP Integrated Lights-Out 2",doc):
-			return ("HP-iLO2")
-	#print r1.getheaders()
-	#print doc
+			evidence['body_match'] = "HP Integrated Lights-Out 2"
+			return ("HP-iLO2"), evidence
+	return None, evidence
+
+
+@Request_decorator
+def guess_sptype_by_http(ip, timeout=None):
+	"""Return array of strings with guessed SP types."""
+	return http_fingerprint(ip, timeout)[0]
 
 
 @Request_decorator
@@ -170,10 +195,76 @@ def guess_sptype_by_probeall(ip):
 
 @Request_decorator
 def suggest_sptype(ip):
-	"""Guess SP type by probbing http or mac preffix."""
+	"""Guess SP type by racing web, SSH and IPMI probes or by mac preffix."""
 	
-	sptype = guess_sptype_by_http(ip)
+	sptype = fingerprint(ip)[0]
 	if not sptype:
 		sptype = guess_sptype_by_ip(ip)
 	if sptype:
 		return sptype
+
+
+def rank_sptypes(ip, timeout=3.0):
+	"""Return SP types ip may be of, most likely first: every type given any score
+	   by the probes (see ssp.fingerprint), then the types of its MAC vendor.
+	   Empty if nothing points to any type."""
+
+	sptype, confidence, evidence = fingerprint(ip, timeout)
+	scores = evidence.get('scores', {})
+	ranked = sorted([t for t in scores.keys() if scores[t] > 0], key=lambda t: (-scores[t], t))
+	by_vendor = sptype_by_vendor(vendor_by_ip(ip)) or ()
+	if isinstance(by_vendor, basestring):
+		by_vendor = (by_vendor,)
+	for t in by_vendor:
+		if t not in ranked:
+			ranked.append(t)
+	return ranked
+
+
+def suggest_sptypes(ips, concurrency=64, timeout=5.0):
+	"""Guess SP types of many ips at once and yield (ip, sptype, evidence) as each one is done.
+	   At most concurrency hosts are fingerprinted at the same time (see ssp.fingerprint)
+	   with timeout seconds per probe, while MACs of all ips are resolved in one pass in
+	   background. The MAC vendor is used where the probes give no answer and MACs are
+	   resolved within another timeout seconds."""
+
+	ips = list(ips)
+	macs = {}
+	vendors = {}
+	resolved = threading.Event()
+
+	def resolve():
+		try:
+			macs.update(macs_by_ip(ips))
+			vendors.update(vendors_for(macs.values()))
+		except (IOError, socket.error), e:
+			LOG.warning("Cannot resolve MACs, guessing by web interface only. %s", e)
+		except Exception, e:
+			LOG.error("MAC resolution failed, guessing by web interface only. %s", e)
+		finally:
+			resolved.set()
+
+	def identify_one(ip):
+		sptype, confidence, evidence = fingerprint(ip, timeout)
+		evidence['source'] = 'probe'
+		evidence['confidence'] = confidence
+		if not sptype:
+			resolved.wait(timeout)
+		mac = resolved.is_set() and macs.get(ip)
+		if mac:
+			evidence['mac'] = mac
+			evidence['vendor'] = vendors.get(mac)
+			if not sptype and sptype_by_vendor(vendors.get(mac)):
+				sptype = sptype_by_vendor(vendors.get(mac))
+				evidence['source'] = 'mac'
+		return ip, sptype, evidence
+
+	resolver = threading.Thread(target=resolve, name="resolve-macs")
+	resolver.daemon = True
+	resolver.start()
+	pool = ThreadPool(max(1, min(concurrency, len(ips))))
+	try:
+		for result in pool.imap_unordered(identify_one, ips):
+			yield result
+	finally:
+		pool.terminate()
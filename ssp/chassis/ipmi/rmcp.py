@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""ASF/RMCP Presence Ping implementation (DSP0136)"""
+
+import logging
+import struct
+
+from ssp.chassis.common.probe import UDP_PROBER
+
+__all__ = [ "rmcp_ping" ]
+LOG = logging.getLogger("ssp.chassis.ipmi.rmcp")
+
+RMCP_PORT = 623
+RMCP_VERSION = 0x06
+RMCP_NOACK_SEQ = 0xFF
+RMCP_CLASS_ASF = 0x06
+ASF_IANA = 4542
+ASF_PRESENCE_PING = 0x80
+ASF_PRESENCE_PONG = 0x40
+
+_HEADER = struct.Struct("!BBBBIBBBB")
+"""RMCP header followed by the ASF message header."""
+
+_PONG = struct.Struct("!IIBB")
+"""Presence Pong data: IANA enterprise, OEM, supported entities and interactions."""
+
+
+def presence_ping(tag=0):
+	"""Return an ASF Presence Ping datagram with specified message tag."""
+	return _HEADER.pack(RMCP_VERSION, 0, RMCP_NOACK_SEQ, RMCP_CLASS_ASF,
+			    ASF_IANA, ASF_PRESENCE_PING, tag, 0, 0)
+
+
+def parse_presence_pong(data, addr=None):
+	"""Return a dict describing the Presence Pong in data or None if data is not a pong."""
+	if len(data) < _HEADER.size + _PONG.size:
+		return None
+	version, reserved, seq, mclass, iana, mtype, tag, reserved, length = _HEADER.unpack_from(data)
+	if version != RMCP_VERSION or mclass & 0x0F != RMCP_CLASS_ASF:
+		return None
+	if iana != ASF_IANA or mtype != ASF_PRESENCE_PONG:
+		return None
+	enterprise, oem, entities, interactions = _PONG.unpack_from(data, _HEADER.size)
+	return {'tag': tag,
+		'iana': enterprise,
+		'oem': oem,
+		'ipmi': bool(entities & 0x80),
+		'asf_version': entities & 0x0F,
+		'security': bool(interactions & 0x80),
+		'dash': bool(interactions & 0x20)}
+
+
+def rmcp_ping(targets, timeout=1.0, callback=None, rate=None, retries=0, adaptive=False, expected=None):
+	"""Ping all targets at once from one socket and return the list of pongs.
+	   See UDP_PROBER for pacing, retries and the final retry wave for expected hosts.
+
+	   Each pong carries 'scan_ip', the target it answered, when it can be told by message tag."""
+
+	targets = [t for t in targets if t]
+	tags = {}
+	for index, target in enumerate(targets):
+		tags[target] = index % 0xFF
+
+	def request(target):
+		return presence_ping(tags.get(target, 0))
+
+	def parse(data, addr):
+		pong = parse_presence_pong(data, addr)
+		if pong is None:
+			LOG.debug("Ignoring non-pong datagram from %s", addr[0])
+			return None
+		if len(targets) <= 0xFF:
+			pong['scan_ip'] = targets[pong['tag']] if pong['tag'] < len(targets) else None
+		else:
+			pong['scan_ip'] = None
+		return pong
+
+	LOG.debug("RMCP pinging %s", ", ".join(targets))
+	prober = UDP_PROBER(RMCP_PORT, timeout=timeout, rate=rate, retries=retries, adaptive=adaptive)
+	return prober.probe(targets, request, parse, callback, expected=expected)
@@ -20,12 +20,12 @@
 """Tools to scan for IPMI devices"""
 
 import logging
-import subprocess
 import time
-import re
 
-from ssp.chassis.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks
+from ssp.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks, get_special_ipv4
 from ssp.chassis.common.scanner import COM_SCANNER
+from ssp.chassis.ipmi.rmcp import rmcp_ping
+from ssp.chassis.ipmi.authcap import get_channel_auth_capabilities
 from socket import gethostname,getaddrinfo
 
 HWCONTROLS = [ "IPMIv2_SCANNER" ]
@@ -63,102 +63,108 @@ class IPMIv2_SCANNER(COM_SCANNER):
 	@Request_decorator
 	def _scan(self, networks={}):
 		"""Scan for IPMI devices on restricted set of networks."""
-		s = self.__scan_specific_ifaces_by_idiscover(networks)
+		s = self.__scan_specific_ifaces_by_authcap(networks)
 		s+= self.__scan_specific_ifaces_by_rmcp_ping(networks)
+		s+= self.__retry_silent(s)
 		return s
 
 	@Request_decorator
 	def _scan_blindly(self):
 		"""Scan for IPMI devices on all networks"""
-		s = self.__scan_blindly_by_idiscover()
+		s = self.__scan_blindly_by_authcap()
 		s+= self.__scan_blindly_by_rmcp_ping()
+		s+= self.__retry_silent(s)
 		return s
 
 	@Request_decorator
-	def __scan_specific_ifaces_by_idiscover(self, networks={}):
-		"""Scan for IPMI devices with idiscover on restricted set of networks."""
+	def __retry_silent(self, s):
+		"""Every IPMI BMC answers both RMCP ping and capabilities request. Ask hosts which
+		   answered only one of them again by unicast for the other, as the reply was likely lost."""
+		ipmi=set([h['host'] for h in s if h['type'] == 'IPMI'])
+		rmcp=set([h['host'] for h in s if h['type'] == 'RMCP'])
+		r = self.__authcap(sorted(rmcp - ipmi), retries=1, expected=sorted(rmcp - ipmi))
+		r+= self.__rmcp_ping(sorted(ipmi - rmcp), retries=1, expected=sorted(ipmi - rmcp))
+		return r
+
+	@Request_decorator
+	def _scan_unicast(self, cidrs=[], **pacing):
+		"""Sweep every address of CIDRs for IPMI devices.
+		   Channel authentication capabilities alone are used, as every IPMI BMC answers them."""
+		return self.__authcap(cidrs, **pacing)
+
+	@Request_decorator
+	def _probe(self, ips=[]):
+		"""Probe specified IPs for IPMI devices."""
+		s = self.__authcap(ips)
+		s+= self.__rmcp_ping(ips)
+		return s
+
+	@Request_decorator
+	def __scan_specific_ifaces_by_authcap(self, networks={}):
+		"""Scan for IPMI devices with Get Channel Authentication Capabilities on restricted set of networks."""
 		s=[]
 		if networks.keys():
-			for iface in get_attrset_of_networks(networks,'iface_name'):
-				s+=self.__idiscover(iface=iface, scantype="RMCP")
-				s+=self.__idiscover(iface=iface)
+			s+=self.__authcap(get_attrset_of_networks(networks,'iface_broadcast'))
 		return s
 
 	@Request_decorator
-	def __scan_blindly_by_idiscover(self):
-		"""Scan for IPMI devices with idiscover without specifing interfaces"""
-		s = self.__idiscover(scantype="RMCP")
-		s+= self.__idiscover()
-		return s
+	def __scan_blindly_by_authcap(self):
+		"""Scan for IPMI devices with Get Channel Authentication Capabilities without specifing interfaces"""
+		return self.__authcap([get_special_ipv4('ipmi-broadcast')])
 
 	@Request_decorator
 	def __scan_specific_ifaces_by_rmcp_ping(self, networks={}):
-		"""Scan for IPMI devices with rmcp_ping on restricted set of networks."""
+		"""Scan for IPMI devices with RMCP ping on restricted set of networks."""
 		s=[]
 		if networks.keys():
-			for bcast in get_attrset_of_networks(networks,'iface_broadcast'):
-				s+=self.__rmcp_ping(bcast)
+			s+=self.__rmcp_ping(get_attrset_of_networks(networks,'iface_broadcast'))
 		return s
 
 	@Request_decorator
 	def __scan_blindly_by_rmcp_ping(self):
-		"""Scan for IPMI devices with rmcp_ping without specifing interfaces"""
-		return self.__rmcp_ping()
+		"""Scan for IPMI devices with RMCP ping without specifing interfaces"""
+		return self.__rmcp_ping([get_special_ipv4('ipmi-broadcast')])
 
 	@Request_decorator
-	def __rmcp_ping(self, ip=None):
-		"""run rmcp_ping on IP and return list of hosts."""
+	def __rmcp_ping(self, ips=[], **pacing):
+		"""Ping all IPs at once with RMCP presence ping and return list of IPMI capable hosts."""
 
 		myhost=gethostname()
-		cmd=["rmcp_ping","-t1"]
 		hosts=[]
-		if ip:
-			cmd.append(ip)
-			LOG.debug("scanning " + ip)
-		try:
-			s = subprocess.Popen(cmd, stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
-			for r in re.finditer(r"(?m)^(?P<host>[^\s]+)\s+IPMI$",s):
-				h=r.groupdict()
-				hip=getaddrinfo(h['host'],623)[0][4][0]
-				h['host']=str(hip)
-				h['type']='RMCP'
-				h['scanner']={'host': myhost, 'scan_ip': ip, 'scanner': 'rmcp_ping', 'scanproto': 'RMCP'}
-				hosts.append(h)
+		ips=[ip for ip in ips if ip]
+		if not ips:
 			return hosts
-		except:
-			LOG.error("Cannot run rmcp_ping command.")
-			raise
+		LOG.debug("scanning " + ", ".join(ips))
+
+		def found(pong):
+			if not pong['ipmi']:
+				return
+			h={'host': pong['host'], 'type': 'RMCP'}
+			h['scanner']={'host': myhost, 'scan_ip': pong['scan_ip'], 'scanner': 'rmcp_ping', 'scanproto': 'RMCP'}
+			hosts.append(h)
+			self._found(h)
+
+		rmcp_ping(ips, timeout=self.timeout, callback=found, **pacing)
+		return hosts
 
 
 	@Request_decorator
-	def __idiscover(self, ip=None, scantype="IPMI", iface=None):
-		"""run idiscover on IP and return list of hosts. scantype is 'IPMI' (GetChannelAuthenticationCapabilities) or 'RMCP'"""
+	def __authcap(self, ips=[], **pacing):
+		"""Ask all IPs (addresses, broadcasts or CIDRs) at once for IPMI channel authentication capabilities."""
 
 		myhost=gethostname()
-		cmd=["idiscover","-a"]
 		hosts=[]
-		if ip:
-			cmd.append('-b')
-			cmd.append(ip)
-			LOG.debug("scanning " + ip)
-		if iface:
-			cmd.append('-i')
-			cmd.append(iface)
-			LOG.debug("via " + iface)
-		if scantype == "IPMI":
-			cmd.append('-g')
-		elif scantype == "RMCP":
-			pass
-		else:
-			raise
-		try:
-			s = subprocess.Popen(cmd, stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
-			for r in re.finditer(r"(?m)^[^|]+\|[^|]+\|\s*(?P<host>[^\s|]+)\s*\|.*$",s):
-				h=r.groupdict()
-				h['type']=scantype
-				h['scanner']={'host': myhost, 'iface': iface, 'scanner': 'idiscover', 'scanproto': scantype}
-				hosts.append(h)
+		ips=[ip for ip in ips if ip]
+		if not ips:
 			return hosts
-		except:
-			LOG.error("Cannot run idiscover command.")
-			raise
+		LOG.debug("scanning " + ", ".join(ips))
+
+		def found(caps):
+			h={'host': caps['host'], 'type': 'IPMI'}
+			h['scanner']={'host': myhost, 'scan_ip': caps['scan_ip'], 'scanner': 'authcap', 'scanproto': 'IPMI'}
+			h['info']={'ipmi': caps}
+			hosts.append(h)
+			self._found(h)
+
+		get_channel_auth_capabilities(ips, timeout=self.timeout, callback=found, **pacing)
+		return hosts
@@ -53,6 +53,16 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 ch.setFormatter(formatter)
 LOG.addHandler(ch)
 
+VPD_QUERIES = {
+	# VPD group: CIM classes (or properties needing value maps) it needs
+	'identity':	('CIM_Chassis',),
+	'macs':		('CIM_NetworkPort',),
+	'firmware':	('CIM_SoftwareIdentity',),
+	'network':	('OperationalStatus', 'CIM_IPProtocolEndpoint', 'CIM_DNSProtocolEndpoint'),
+	'power':	('CIM_AssociatedPowerManagementService',),
+}
+"""CIM queries to run for each VPD group besides CIM_ComputerSystem. See ssp.service_processor.VPD_GROUPS."""
+
 
 def Request_decorator(func):
 	"""Logs all requests."""
@@ -271,8 +281,17 @@ class WBEM:
 
 
 	@Request_decorator
-	def getvpd(self):
-		"""Returns SP and systems VPD data."""
+	def getvpd(self, fields=None):
+		"""Returns SP and systems VPD data.
+
+		   fields limits retrieval to the listed VPD groups (see VPD_QUERIES) so only
+		   the associations they need are followed. Values of other groups keep their defaults."""
+
+		queries = set()
+		for field in fields or VPD_QUERIES.keys():
+			if field not in VPD_QUERIES:
+				raise ValueError("Unknown VPD field {0}".format(field))
+			queries.update(VPD_QUERIES[field])
 
 		system={'macs':{}, 'sn':'', 'model':'', 'power':'' }
 		vpd={	'sp':	{'uuid':'', 'mac':'', 'name':'', 'ip':'', 'version':'', 'product':'', 'model':''},
@@ -308,51 +327,56 @@ class WBEM:
 					vpd['sp']['makerid'] = makerid
 					vpd['sp']['productid'] = productid
 					vpd['sp']['label'] = c['ElementName']
-					vpd['sp']['status'] = '/'.join(WBEMC.getHumanValueForList(self.__wbempipe, c, 'OperationalStatus'))
-
-					for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_NetworkPort'):
-						LOG.debug("CIM_NetworkPort for SP %s", instance['BurnedInMAC'])
-						vpd['sp']['mac']=instance['BurnedInMAC']
-
-					for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_IPProtocolEndpoint'):
-
-						ipv4=ipv6=False
-						if instance['ProtocolIFType'] == WBEMC.IPv4v6:
-							ipv4=ipv6=True
-						elif instance['ProtocolIFType'] == WBEMC.IPv6:
-							ipv6=True
-						elif instance['ProtocolIFType'] == WBEMC.IPv4:
-							ipv4=True
+					if 'OperationalStatus' in queries:
+						vpd['sp']['status'] = '/'.join(WBEMC.getHumanValueForList(self.__wbempipe, c, 'OperationalStatus'))
+
+					if 'CIM_NetworkPort' in queries:
+						for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_NetworkPort'):
+							LOG.debug("CIM_NetworkPort for SP %s", instance['BurnedInMAC'])
+							vpd['sp']['mac']=instance['BurnedInMAC']
+
+					if 'CIM_IPProtocolEndpoint' in queries:
+						for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_IPProtocolEndpoint'):
+
+							ipv4=ipv6=False
+							if instance['ProtocolIFType'] == WBEMC.IPv4v6:
+								ipv4=ipv6=True
+							elif instance['ProtocolIFType'] == WBEMC.IPv6:
+								ipv6=True
+							elif instance['ProtocolIFType'] == WBEMC.IPv4:
+								ipv4=True
 						
-						if ipv4:
-							LOG.debug("CIM_IPProtocolEndpoint for SP IPv4:%s", instance['IPv4Address'])
-							vpd['sp']['ipv4']=         instance['IPv4Address']
-							vpd['sp']['ipv4_mask']=    instance['SubnetMask']
-							vpd['sp']['ipv4_origin']=  WBEMC.getHumanValue(self.__wbempipe, instance, 'AddressOrigin')
-							vpd['sp']['ipv4_enabled']= WBEMC.getHumanValue(self.__wbempipe, instance, 'EnabledState')
-
-						if ipv6:
-							LOG.debug("CIM_IPProtocolEndpoint for SP IPv6:%s", instance['IPv6Address'])
-							vpd['sp']['ipv6']=         instance['IPv6Address']
-							vpd['sp']['ipv6_mask']=    instance['PrefixLength']
-							vpd['sp']['ipv6_origin']=  WBEMC.getHumanValue(self.__wbempipe, instance, 'AddressOrigin')
-							#vpd['sp']['ipv6_type']=    WBEMC.getHumanValue(self.__wbempipe, instance, 'IPv6AddressType')
-							vpd['sp']['ipv6_enabled']= WBEMC.getHumanValue(self.__wbempipe, instance, 'EnabledState')
-
-					for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_DNSProtocolEndpoint'):
-						vpd['sp']['name']=instance['Hostname']
-
-					for soft in self.__wbempipe.AssociatorNames(c.path, ResultClass='CIM_SoftwareIdentity'):
-						s=self.__wbempipe.GetInstance(soft)
-						LOG.debug("CIM_SoftwareIdentity for SP %s version %s", s['InstanceID'], s['VersionString'])
-						vpd['sp']['model']=s['InstanceID']
-						vpd['sp']['version']=s['VersionString']
-						vpd['sp']['version_major']=s['MajorVersion']
-						vpd['sp']['version_minor']=s['MinorVersion']
-						# String time in CIMDateTime() example '20110209000000.000000+000'
-						releasedate=s['ReleaseDate'].datetime
-						releasedate=time.mktime(releasedate.timetuple())
-						vpd['sp']['version_date']=int(releasedate)
+							if ipv4:
+								LOG.debug("CIM_IPProtocolEndpoint for SP IPv4:%s", instance['IPv4Address'])
+								vpd['sp']['ipv4']=         instance['IPv4Address']
+								vpd['sp']['ipv4_mask']=    instance['SubnetMask']
+								vpd['sp']['ipv4_origin']=  WBEMC.getHumanValue(self.__wbempipe, instance, 'AddressOrigin')
+								vpd['sp']['ipv4_enabled']= WBEMC.getHumanValue(self.__wbempipe, instance, 'EnabledState')
+
+							if ipv6:
+								LOG.debug("CIM_IPProtocolEndpoint for SP IPv6:%s", instance['IPv6Address'])
+								vpd['sp']['ipv6']=         instance['IPv6Address']
+								vpd['sp']['ipv6_mask']=    instance['PrefixLength']
+								vpd['sp']['ipv6_origin']=  WBEMC.getHumanValue(self.__wbempipe, instance, 'AddressOrigin')
+								#vpd['sp']['ipv6_type']=    WBEMC.getHumanValue(self.__wbempipe, instance, 'IPv6AddressType')
+								vpd['sp']['ipv6_enabled']= WBEMC.getHumanValue(self.__wbempipe, instance, 'EnabledState')
+
+					if 'CIM_DNSProtocolEndpoint' in queries:
+						for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_DNSProtocolEndpoint'):
+							vpd['sp']['name']=instance['Hostname']
+
+					if 'CIM_SoftwareIdentity' in queries:
+						for soft in self.__wbempipe.AssociatorNames(c.path, ResultClass='CIM_SoftwareIdentity'):
+							s=self.__wbempipe.GetInstance(soft)
+							LOG.debug("CIM_SoftwareIdentity for SP %s version %s", s['InstanceID'], s['VersionString'])
+							vpd['sp']['firmware_id']=s['InstanceID']
+							vpd['sp']['version']=s['VersionString']
+							vpd['sp']['version_major']=s['MajorVersion']
+							vpd['sp']['version_minor']=s['MinorVersion']
+							# String time in CIMDateTime() example '20110209000000.000000+000'
+							releasedate=s['ReleaseDate'].datetime
+							releasedate=time.mktime(releasedate.timetuple())
+							vpd['sp']['version_date']=int(releasedate)
 				else:
 					# We are in Host association
 					if dedication != 0:
@@ -362,36 +386,39 @@ class WBEM:
 					vpd['sys'][uuid]['sn']    = sn
 					vpd['sys'][uuid]['model'] = model
 					LOG.debug("path for Host %s", c.path)
-					ifaces_ids=set()
-					ifaces_count=0
-					for iface_name in self.__wbempipe.Associators(c.path, ResultClass='CIM_NetworkPort'):
-						LOG.debug("CIM_NetworkPort for Host %s", iface_name['BurnedInMAC'])
-						res = re.search(r"(?m)^host-ethernetport-([0-9]+$)", iface_name['DeviceID'])
-						if res:
-							iface = res.group(1)
-							eth_index = str(int(iface) - 1)
-						else:
-							eth_index = ifaces_count
-
-						while eth_index in ifaces_ids:
-							eth_index = eth_index + 1
-
-						ifaces_ids.add(eth_index)
-						ifaces_count = ifaces_count + 1
-						vpd['sys'][uuid]['macs'][eth_index] = iface_name['BurnedInMAC']
-
-					for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_Chassis'):
-						LOG.debug("CIM_Chassis for Host %s %s %s", instance['Manufacturer'], instance['Model'], instance['SerialNumber'])
-						vpd['sys'][uuid]['vendor']       = instance['Manufacturer']
-						vpd['sys'][uuid]['partnumber']   = instance['PartNumber']
-						vpd['sys'][uuid]['sku']          = instance['SKU']
-						vpd['sys'][uuid]['model_name']   = instance['Name']
-						vpd['sys'][uuid]['chassis_type'] = WBEMC.getHumanValue(self.__wbempipe, instance, 'ChassisPackageType')
-						vpd['sys'][uuid]['package_type'] = WBEMC.getHumanValue(self.__wbempipe, instance, 'PackageType')
-
-					for instance in self.__wbempipe.References(c.path, ResultClass='CIM_AssociatedPowerManagementService'):
-						LOG.debug("CIM_AssociatedPowerManagementService for Host %s %s %s", instance['PowerState'])
-						vpd['sys'][uuid]['power']        = WBEMC.getHumanValue(self.__wbempipe, instance, 'PowerState')
+					if 'CIM_NetworkPort' in queries:
+						ifaces_ids=set()
+						ifaces_count=0
+						for iface_name in self.__wbempipe.Associators(c.path, ResultClass='CIM_NetworkPort'):
+							LOG.debug("CIM_NetworkPort for Host %s", iface_name['BurnedInMAC'])
+							res = re.search(r"(?m)^host-ethernetport-([0-9]+$)", iface_name['DeviceID'])
+							if res:
+								iface = res.group(1)
+								eth_index = str(int(iface) - 1)
+							else:
+								eth_index = ifaces_count
+
+							while eth_index in ifaces_ids:
+								eth_index = eth_index + 1
+
+							ifaces_ids.add(eth_index)
+							ifaces_count = ifaces_count + 1
+							vpd['sys'][uuid]['macs'][eth_index] = iface_name['BurnedInMAC']
+
+					if 'CIM_Chassis' in queries:
+						for instance in self.__wbempipe.Associators(c.path, ResultClass='CIM_Chassis'):
+							LOG.debug("CIM_Chassis for Host %s %s %s", instance['Manufacturer'], instance['Model'], instance['SerialNumber'])
+							vpd['sys'][uuid]['vendor']       = instance['Manufacturer']
+							vpd['sys'][uuid]['partnumber']   = instance['PartNumber']
+							vpd['sys'][uuid]['sku']          = instance['SKU']
+							vpd['sys'][uuid]['model_name']   = instance['Name']
+							vpd['sys'][uuid]['chassis_type'] = WBEMC.getHumanValue(self.__wbempipe, instance, 'ChassisPackageType')
+							vpd['sys'][uuid]['package_type'] = WBEMC.getHumanValue(self.__wbempipe, instance, 'PackageType')
+
+					if 'CIM_AssociatedPowerManagementService' in queries:
+						for instance in self.__wbempipe.References(c.path, ResultClass='CIM_AssociatedPowerManagementService'):
+							LOG.debug("CIM_AssociatedPowerManagementService for Host %s", instance['PowerState'])
+							vpd['sys'][uuid]['power']        = WBEMC.getHumanValue(self.__wbempipe, instance, 'PowerState')
 
 		LOG.debug("VPD: %s", vpd)
 		return vpd
@@ -21,12 +21,11 @@
 """Tools to scan for WBEM devices"""
 
 import logging
-import subprocess
 import time
-import re
 
-from ssp.chassis.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks
+from ssp.netconfig import get_global_to_local_networks_projection, get_all_global_to_local_networks_projection, get_attrset_of_networks, iter_hosts
 from ssp.chassis.common.scanner import COM_SCANNER
+from ssp.chassis.wbem.slp import find_services
 from socket import gethostname,getaddrinfo
 
 HWCONTROLS = [ "WBEM_SCANNER" ]
@@ -69,60 +68,73 @@ class WBEM_SCANNER(COM_SCANNER):
 	@Request_decorator
 	def _scan(self, networks={}):
 		"""Scan for IPMI devices on restricted set of networks."""
-		s = self.__scan_specific_ifaces_by_slptool(networks)
+		s = self.__scan_specific_ifaces_by_slp(networks)
 		return s
 
 	@Request_decorator
 	def _scan_blindly(self):
 		"""Scan for IPMI devices on all networks"""
-		s = self.__scan_blindly_by_slptool()
+		s = self.__scan_blindly_by_slp()
 		return s
 
 	@Request_decorator
-	def __scan_specific_ifaces_by_slptool(self, networks={}):
-		"""Scan for SLP devices with rmcp_ping on restricted set of networks."""
+	def _scan_unicast(self, cidrs=[], **pacing):
+		"""Sweep every address of CIDRs for SLP devices."""
+		hosts=[]
+		for cidr in cidrs:
+			hosts.extend(iter_hosts(cidr))
+		if not hosts:
+			return []
+		return self.__slp(hosts=hosts, **pacing)
+
+	@Request_decorator
+	def _probe(self, ips=[]):
+		"""Probe specified IPs for SLP devices."""
+		if not ips:
+			return []
+		s = self.__slp(hosts=ips)
+		return s
+
+	@Request_decorator
+	def __scan_specific_ifaces_by_slp(self, networks={}):
+		"""Scan for SLP devices via the local interfaces of restricted set of networks."""
 		if_ips=set()
 		if networks.keys():
 			for ifip in get_attrset_of_networks(networks,'iface_ip_and_preffix'):
-				if_ips.add(ifip.split('/')[0])
-		ifspec=",".join(if_ips)
-		s = self.__slptool(ifs=ifspec)
+				if ifip:
+					if_ips.add(ifip.split('/')[0])
+		if not if_ips:
+			return []
+		s = self.__slp(ifs=sorted(if_ips))
 		return s
 
 	@Request_decorator
-	def __scan_blindly_by_slptool(self):
-		"""Scan for IPMI devices with rmcp_ping without specifing interfaces"""
-		s = self.__slptool()
+	def __scan_blindly_by_slp(self):
+		"""Scan for SLP devices without specifing interfaces"""
+		s = self.__slp()
 		return s
 
 	@Request_decorator
-	def __slptool(self, ifs=None, scantype="SLP"):
-		"""Run slptool on IP and return list of hosts. scantype is 'WBEM' or 'SLP'
-		   slptool can restrict """
+	def __slp(self, ifs=None, hosts=None, **pacing):
+		"""Multicast SLP service requests for every scanspec service at once and return list of hosts.
+		   Requests are sent by unicast to hosts if specified."""
 
-		hosts=[]
+		found_hosts=[]
 		myhost=gethostname()
-
-		icmd=["slptool"]
+		tags=dict([(service, tag) for tag, service in self.scanspec])
+		iface_ip=None
 		if ifs:
-			icmd.append("-i")
-			icmd.append(ifs)
-			LOG.debug("scanning via " + ifs)
-		icmd.append("findsrvs")
-
-		for scantype,scanservice in self.scanspec:
-			cmd=list(icmd)
-			cmd.append(scanservice)
-			LOG.debug(str(cmd))
-			try:
-				s = subprocess.Popen(cmd, stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
-				print str(s)
-				for r in re.finditer(r"(?m)^.*//(?P<host>[^\s/,]+),+.*$",s):
-					h=r.groupdict()
-					h['type']=scantype
-					h['scanner']={'host': myhost, 'iface_ip': ifs, 'scanner': 'slptool', 'scanproto': scantype}
-					hosts.append(h)
-			except:
-				LOG.error("Cannot run slptool command.")
-				raise
-		return hosts
+			iface_ip=",".join(ifs)
+			LOG.debug("scanning via " + iface_ip)
+
+		def found(service):
+			scantype=tags[service['srvtype']]
+			h={'host': service['host'], 'type': scantype}
+			h['scanner']={'host': myhost, 'iface_ip': iface_ip, 'scanner': 'slp', 'scanproto': scantype, 'url': service['url']}
+			if hosts:
+				h['scanner']['scan_ip']=service['responder']
+			found_hosts.append(h)
+			self._found(h)
+
+		find_services([service for tag, service in self.scanspec], ifaces=ifs, timeout=self.timeout, callback=found, hosts=hosts, **pacing)
+		return found_hosts
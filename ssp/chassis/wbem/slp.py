@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Service Location Protocol v2 multicast client (RFC 2608)"""
+
+import logging
+import socket
+import struct
+import random
+import re
+
+from ssp.chassis.common.probe import UDP_PROBER
+from ssp.netconfig import get_special_ipv4
+
+__all__ = [ "find_services" ]
+LOG = logging.getLogger("ssp.chassis.wbem.slp")
+
+SLP_PORT = 427
+SLP_VERSION = 2
+SLP_SRVRQST = 1
+SLP_SRVRPLY = 2
+SLP_DAADVERT = 8
+SLP_SAADVERT = 11
+SLP_FLAG_MCAST = 0x2000
+SLP_MC_TTL = 255
+SLP_MAX_PRLIST = 1024
+"""Stop retransmitting once the previous responders list would not fit into a datagram."""
+
+_HEADER = struct.Struct("!BB3sH3sHH")
+
+
+class _SLPError(ValueError):
+	"""Malformed SLP message."""
+
+
+def _string(value):
+	"""Return SLP <length><string> encoding of value."""
+	return struct.pack("!H", len(value)) + value
+
+
+def _unpack_string(data, offset):
+	"""Return (string, next offset) for SLP string at offset."""
+	if len(data) < offset + 2:
+		raise _SLPError("truncated string length")
+	length = struct.unpack_from("!H", data, offset)[0]
+	offset += 2
+	if len(data) < offset + length:
+		raise _SLPError("truncated string")
+	return data[offset:offset + length], offset + length
+
+
+def _uint24(value):
+	return struct.pack("!I", value)[1:]
+
+
+def srvrqst(xid, srvtype, prlist='', scopes='DEFAULT', lang='en', multicast=True):
+	"""Return SLP SrvRqst datagram for srvtype."""
+	body = _string(prlist) + _string(srvtype) + _string(scopes) + _string('') + _string('')
+	length = _HEADER.size + 2 + len(lang) + len(body)
+	flags = 0
+	if multicast:
+		flags |= SLP_FLAG_MCAST
+	return _HEADER.pack(SLP_VERSION, SLP_SRVRQST, _uint24(length), flags, _uint24(0), xid, len(lang)) + lang + body
+
+
+def parse_reply(data, addr=None):
+	"""Return dict with 'xid', 'function', 'error' and 'urls' of a SLP reply or None."""
+	try:
+		if len(data) < _HEADER.size:
+			return None
+		version, function, length, flags, ext, xid, langlen = _HEADER.unpack_from(data)
+		if version != SLP_VERSION or function not in (SLP_SRVRPLY, SLP_DAADVERT, SLP_SAADVERT):
+			return None
+		offset = _HEADER.size + langlen
+		urls = []
+		error = 0
+		if function == SLP_SRVRPLY:
+			error, count = struct.unpack_from("!HH", data, offset)
+			offset += 4
+			for i in xrange(count):
+				# reserved(1) lifetime(2) then the URL
+				url, offset = _unpack_string(data, offset + 3)
+				urls.append(url)
+				auths = struct.unpack_from("!B", data, offset)[0]
+				offset += 1
+				for a in xrange(auths):
+					blocklen = struct.unpack_from("!H", data, offset + 2)[0]
+					offset += blocklen
+		elif function == SLP_DAADVERT:
+			error = struct.unpack_from("!H", data, offset)[0]
+			url, offset = _unpack_string(data, offset + 6)
+			urls.append(url)
+		else:
+			url, offset = _unpack_string(data, offset)
+			urls.append(url)
+	except (struct.error, _SLPError), e:
+		LOG.debug("Malformed SLP reply from %s. %s", addr and addr[0], e)
+		return None
+	return {'xid': xid, 'function': function, 'error': error, 'urls': urls}
+
+
+def host_of_url(url):
+	"""Return host part of a service URL like service:wbem:https://10.0.0.1:5989."""
+	res = re.search(r"//\[?(?P<host>[^\s/,\]]+?)\]?(:[0-9]+)?(/|,|$)", url)
+	if res:
+		return res.group('host')
+
+
+class SLP_PROBER(UDP_PROBER):
+	"""UDP prober with SLP multicast TTL."""
+
+	def _open(self):
+		sock = UDP_PROBER._open(self)
+		sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, SLP_MC_TTL)
+		return sock
+
+
+def find_services(srvtypes, ifaces=None, timeout=1.0, rounds=3, callback=None, hosts=None, rate=None, retries=0, adaptive=False, expected=None):
+	"""Multicast SrvRqst for all srvtypes at once via every local interface address in ifaces
+	   and return the list of found services as dicts with 'host', 'srvtype', 'url' and 'responder'.
+
+	   All requests share one collection window per round. Requests are retransmitted with the
+	   previous responders list until a round brings no new responders or rounds are exhausted.
+	   If hosts are given the requests are sent to each of them by unicast in a single round instead,
+	   limited to rate requests per second and resent up to retries times to silent hosts.
+	   See UDP_PROBER for adaptive pacing and the final retry wave for expected hosts."""
+
+	group = get_special_ipv4('slp-multicast')
+	if hosts:
+		dests = [(host, None) for host in hosts]
+		rounds = 1
+	else:
+		dests = [(group, via) for via in (ifaces or [None])]
+	xids = {}
+	responders = {}
+	base = random.randint(1, 0xFFFF)
+	for i, srvtype in enumerate(srvtypes):
+		# Sequential from one random base so service types never share an XID
+		xids[(base + i - 1) % 0xFFFF + 1] = srvtype
+		responders[srvtype] = []
+	xid_of = dict([(t, x) for x, t in xids.items()])
+	found = []
+	seen = set()
+
+	def request(target):
+		srvtype = target[2]
+		return srvrqst(xid_of[srvtype], srvtype, prlist=",".join(responders[srvtype]), multicast=not hosts)
+
+	def parse(data, addr):
+		reply = parse_reply(data, addr)
+		if reply is None or reply['xid'] not in xids:
+			return None
+		if reply['error']:
+			LOG.debug("SLP error %s from %s", reply['error'], addr[0])
+			return None
+		srvtype = xids[reply['xid']]
+		if hosts:
+			reply['target'] = (addr[0], None, srvtype)
+		if addr[0] not in responders[srvtype]:
+			responders[srvtype].append(addr[0])
+		for url in reply['urls']:
+			if (srvtype, url) in seen:
+				continue
+			seen.add((srvtype, url))
+			service = {'host': host_of_url(url) or addr[0], 'srvtype': srvtype, 'url': url, 'responder': addr[0]}
+			found.append(service)
+			if callback:
+				callback(service)
+		return reply
+
+	prober = SLP_PROBER(SLP_PORT, timeout=timeout, rate=rate, retries=retries, adaptive=adaptive)
+	types = list(srvtypes)
+	for r in xrange(rounds):
+		targets = []
+		for srvtype in types:
+			for dest, via in dests:
+				targets.append((dest, via, srvtype))
+		LOG.debug("SLP round %d for %s", r, ", ".join(types))
+		before = len(found)
+		wave = None
+		if hosts and expected:
+			wave = [(host, None, srvtype) for host in expected for srvtype in types]
+		replies = prober.probe(targets, request, parse, expected=wave)
+		if not replies or len(found) == before:
+			break
+		types = [t for t in types if len(",".join(responders[t])) < SLP_MAX_PRLIST]
+		if not types:
+			break
+	return found
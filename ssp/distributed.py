@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Gives a facility to spread discovery over several scanner hosts"""
+
+import logging
+import threading
+import Queue
+import time
+import httplib
+import xmlrpclib
+import base64
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from SocketServer import ThreadingMixIn
+from socket import gethostname
+
+from ssp.scanner import Scanner
+from ssp.chassis.common.result import DiscoveryResultSet
+from ssp.netconfig import get_all_global_to_local_networks_projection, split_network, NETWORK_INDEX
+
+__all__ = [ "ScanWorker", "ScanCoordinator" ]
+LOG = logging.getLogger("ssp.distributed")
+
+DEFAULT_PORT = 8623
+DEFAULT_ADDR = '127.0.0.1'
+SHARD_PREFIX = 24
+"""Unicast sweeps are spread over workers in networks of this size."""
+
+
+class _TimeoutTransport(xmlrpclib.Transport):
+	"""XML-RPC transport with a socket timeout, passing secret as HTTP basic authentication password."""
+
+	def __init__(self, timeout, secret=None):
+		xmlrpclib.Transport.__init__(self)
+		self.__timeout = timeout
+		self.__secret = secret
+
+	def get_host_info(self, host):
+		host, extra_headers, x509 = xmlrpclib.Transport.get_host_info(self, host)
+		if self.__secret:
+			extra_headers = list(extra_headers or []) + [("Authorization", "Basic " + base64.b64encode("ssp:" + self.__secret))]
+		return host, extra_headers, x509
+
+	def make_connection(self, host):
+		conn = xmlrpclib.Transport.make_connection(self, host)
+		conn.timeout = self.__timeout
+		return conn
+
+
+def _same(a, b):
+	"""Compare strings in time not depending on where they differ."""
+	if len(a) != len(b):
+		return False
+	diff = 0
+	for x, y in zip(a, b):
+		diff |= ord(x) ^ ord(y)
+	return diff == 0
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+	"""XML-RPC request handler refusing clients not passing ScanWorker checks."""
+
+	def parse_request(self):
+		if not SimpleXMLRPCRequestHandler.parse_request(self):
+			return False
+		if self.server.admits(self.client_address[0], self.headers.get('Authorization')):
+			return True
+		LOG.warning("Refused request from %s", self.client_address[0])
+		self.send_error(403)
+		return False
+
+
+class _Server(ThreadingMixIn, SimpleXMLRPCServer):
+	"""XML-RPC server handling every request in its own thread and
+	   admitting only clients from allow networks knowing secret (if set)."""
+
+	daemon_threads = True
+	secret = None
+	allow = None
+
+	def admits(self, ip, authorization):
+		if self.allow is not None and not self.allow.classify(ip):
+			return False
+		if self.secret is None:
+			return True
+		scheme, sep, credentials = (authorization or '').partition(' ')
+		if scheme.lower() != 'basic':
+			return False
+		try:
+			password = base64.b64decode(credentials).partition(':')[2]
+		except TypeError:
+			return False
+		return _same(password, self.secret)
+
+
+class ScanWorker:
+	"""Represents a scanner host serving discovery requests of a ScanCoordinator over XML-RPC."""
+
+	__server = None
+	"""XML-RPC server."""
+
+	__scanner = None
+	"""Local Scanner doing the work."""
+
+	def __init__(self, addr=DEFAULT_ADDR, port=DEFAULT_PORT, secret=None, allow=None):
+		"""Listen on addr:port. Requests are served at the same time, so a shard retried
+		   here does not wait behind a running sweep. With secret only clients giving it
+		   as HTTP basic authentication password (see ScanCoordinator) are served, with
+		   allow (list of IPs or CIDRs) only clients from these networks."""
+		self.__scanner = Scanner()
+		self.__server = _Server((addr, port), requestHandler=_RequestHandler, allow_none=True, logRequests=False)
+		self.__server.secret = secret
+		if allow is not None:
+			self.__server.allow = NETWORK_INDEX(dict([(net, {'allow': net}) for net in allow]))
+		self.__server.register_function(self.info, 'info')
+		self.__server.register_function(self.scan, 'scan')
+		self.__server.register_function(self.scan_unicast, 'scan_unicast')
+
+	def address(self):
+		"""Return (address, port) the worker listens on."""
+		return self.__server.server_address
+
+	def serve_forever(self):
+		self.__server.serve_forever()
+
+	def shutdown(self):
+		self.__server.shutdown()
+
+	def info(self):
+		"""Return the host name, the globaly defined networks reachable from it and its scanners."""
+		return {'host': gethostname(),
+			'networks': sorted(get_all_global_to_local_networks_projection().keys()),
+			'scanners': self.__scanner.names()}
+
+	def scan(self, networks, timeout=60):
+		"""Scan specified networks with all scanners. Return plain results and stats."""
+		r, stats = self.__scanner.scan_concurrently(networks, timeout)
+		return {'host': gethostname(), 'results': r.to_list(), 'stats': stats}
+
+	def scan_unicast(self, cidrs, timeout=600, pacing={}):
+		"""Sweep specified CIDRs with all scanners. Return plain results and stats."""
+		r, stats = self.__scanner.scan_unicast(cidrs=cidrs, timeout=timeout, **pacing)
+		return {'host': gethostname(), 'results': r.to_list(), 'stats': stats}
+
+
+class ScanCoordinator:
+	"""Represents a coordinator sharding discovery over several ScanWorker hosts
+	   and merging their partial results into one deduplicated DiscoveryResultSet."""
+
+	__workers = None
+	"""XML-RPC URLs of the workers."""
+
+	__timeout = None
+	"""Seconds a worker is given to complete its shard."""
+
+	__secret = None
+	"""Shared secret of the workers."""
+
+	def __init__(self, workers, timeout=60, secret=None):
+		self.__workers = list(workers)
+		self.__timeout = timeout
+		self.__secret = secret
+
+	def __proxy(self, url, timeout=None):
+		return xmlrpclib.ServerProxy(url, transport=_TimeoutTransport(timeout or self.__timeout + 10, self.__secret), allow_none=True)
+
+	def workers_info(self):
+		"""Return {worker url: info} of all workers which replied."""
+		infos = {}
+		for url in self.__workers:
+			try:
+				infos[url] = self.__proxy(url, 10).info()
+			except Exception, e:
+				LOG.error("Worker %s is not available. %s", url, e)
+		return infos
+
+	def plan(self, networks=None):
+		"""Return ({worker url: [network names]}, [networks reachable by no worker]).
+		   Every network goes to the least loaded worker having it locally configured."""
+		infos = self.workers_info()
+		capable = {}
+		for url, info in infos.items():
+			for net in info['networks']:
+				capable.setdefault(net, set()).add(url)
+		wanted = set(networks or capable.keys())
+		unreachable = sorted(wanted - set(capable.keys()))
+		shards = {}
+		for net in sorted(wanted - set(unreachable), key=lambda n: (len(capable[n]), n)):
+			url = min(capable[net], key=lambda u: (len(shards.get(u, ())), u))
+			shards.setdefault(url, []).append(net)
+		return shards, unreachable
+
+	def scan(self, networks=None):
+		"""Scan globaly defined networks (all by default) on the workers which can reach them.
+		   Return merged results with per-worker statistics as a tuple (results, stats)."""
+		shards, unreachable = self.plan(networks)
+		if unreachable:
+			LOG.warning("Networks %s are not reachable by any worker", ", ".join(unreachable))
+		infos = self.workers_info()
+		def capable(net):
+			return [url for url, info in infos.items() if net in info['networks']]
+		results, stats = self.__run(shards, lambda proxy, shard: proxy.scan(shard, self.__timeout), capable)
+		stats['unreachable'] = unreachable
+		return results, stats
+
+	def scan_unicast(self, cidrs, **pacing):
+		"""Sweep CIDRs by unicast, spread over all workers in /SHARD_PREFIX pieces.
+		   Return merged results with per-worker statistics as a tuple (results, stats)."""
+		urls = sorted(self.workers_info().keys())
+		if not urls:
+			raise RuntimeError("No scan worker is available.")
+		shards = {}
+		pieces = []
+		for cidr in cidrs:
+			pieces.extend(split_network(cidr, SHARD_PREFIX))
+		for index, piece in enumerate(pieces):
+			shards.setdefault(urls[index % len(urls)], []).append(piece)
+		return self.__run(shards, lambda proxy, shard: proxy.scan_unicast(shard, self.__timeout, pacing), lambda piece: urls)
+
+	def __run(self, shards, call, capable):
+		"""Run call(proxy, shard) on every worker at once and merge results as they come.
+		   Shards of failed workers are given once to other capable workers."""
+
+		done = Queue.Queue()
+		stats = {}
+		started = time.time()
+		all = DiscoveryResultSet()
+
+		def run(url, shard):
+			t = time.time()
+			try:
+				reply = call(self.__proxy(url), shard)
+				done.put((url, shard, 'done', reply, None, time.time() - t))
+			except Exception, e:
+				LOG.error("Worker %s failed on %s. %s", url, shard, e)
+				done.put((url, shard, 'error', None, str(e), time.time() - t))
+
+		def start(shards):
+			for url, shard in shards.items():
+				t = threading.Thread(target=run, name=url, args=(url, shard))
+				t.daemon = True
+				t.start()
+			return len(shards)
+
+		running = start(shards)
+		failed = set()
+		while running:
+			url, shard, status, reply, error, elapsed = done.get()
+			running -= 1
+			stats.setdefault(url, []).append({'shard': shard, 'status': status, 'elapsed': elapsed})
+			if status == 'done':
+				r = DiscoveryResultSet.from_list(reply['results'])
+				stats[url][-1]['hosts'] = len(r)
+				stats[url][-1]['scanners'] = reply['stats']
+				all |= r
+				continue
+			stats[url][-1]['error'] = error
+			failed.add(url)
+			retry = {}
+			for item in shard:
+				others = [u for u in capable(item) if u not in failed]
+				if others:
+					retry.setdefault(sorted(others)[0], []).append(item)
+				else:
+					LOG.error("No other worker can take %s", item)
+			running += start(retry)
+		stats['total'] = {'status': 'done', 'elapsed': time.time() - started, 'hosts': len(all)}
+		return all, stats
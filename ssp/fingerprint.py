@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Racing SP fingerprint engine combining web, SSH and IPMI evidence"""
+
+import logging
+import socket
+import ssl
+import threading
+import Queue
+import time
+import re
+from multiprocessing.pool import ThreadPool
+
+from ssp.chassis.ipmi.authcap import get_channel_auth_capabilities
+from ssp.remote.sshprobe import ssh_fingerprint, guess_family, FAMILY_SPTYPES
+
+__all__ = [ "fingerprint", "fingerprint_many" ]
+LOG = logging.getLogger("ssp.fingerprint")
+
+PROBES = ('http', 'https', 'ssh', 'ipmi')
+"""All probes, launched at once."""
+
+THRESHOLD = 0.9
+"""Confidence at which a SP type is taken as decided and outstanding probes are cancelled."""
+
+BODY_PREFIX = 4096
+"""Bytes of a web response read at most. Redirects are decided by headers alone."""
+
+WEB_SIGNATURES = [
+	# probe, field, regular expression ({ip} is the probed address), SP type, score
+	('http',  'location', r"https://{ip}/start.html",                  "DELL-iDRAC6",     1.0),
+	('http',  'location', r"http://{ip}/private/main.php",             "IBM-BLADECENTER", 1.0),
+	('http',  'location', r"http://{ip}/private/testcookie.ssi",       "IBM-RSA",         1.0),
+	('https', 'location', r"https://{ip}:443//cgi-bin/webcgi/index",   "DELL-CMC",        1.0),
+	('http',  'body',     r"HP Integrated Lights-Out 2",               "HP-iLO2",         1.0),
+	('https', 'body',     r"HP Integrated Lights-Out 2",               "HP-iLO2",         1.0),
+]
+
+IPMI_OEM = {
+	# IANA enterprise number reported in channel auth capabilities -> SP types
+	674:   ("DELL-iDRAC6", "DELL-CMC"),
+	2:     ("IBM-RSA", "IBM-BLADECENTER"),
+	20301: ("IBM-RSA", "IBM-BLADECENTER"),
+	11:    ("HP-iLO2",),
+}
+
+
+class _Race(object):
+	"""Shared state of probes racing for one host."""
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.__lock = threading.Lock()
+		self.__socks = []
+
+	def connect(self, addr, timeout):
+		"""Return a TCP socket connected to addr which is closed if the race is decided."""
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.settimeout(timeout)
+		with self.__lock:
+			if self.done.is_set():
+				sock.close()
+				raise socket.error("cancelled")
+			self.__socks.append(sock)
+		sock.connect(addr)
+		return sock
+
+	def cancel(self):
+		"""Stop outstanding probes by closing their sockets."""
+		with self.__lock:
+			self.done.set()
+			for sock in self.__socks:
+				try:
+					sock.shutdown(socket.SHUT_RDWR)
+				except socket.error:
+					pass
+				sock.close()
+			self.__socks = []
+
+
+def _read_response(sock, limit=BODY_PREFIX):
+	"""Return (status, headers, body prefix) of an HTTP response. Stops after headers of a redirect."""
+	data = ''
+	head = None
+	while len(data) < limit:
+		chunk = sock.recv(limit - len(data))
+		if not chunk:
+			break
+		data += chunk
+		if head is None and '\r\n\r\n' in data:
+			head, body = data.split('\r\n\r\n', 1)
+			lines = head.split('\r\n')
+			headers = {}
+			for line in lines[1:]:
+				name, sep, value = line.partition(':')
+				headers[name.strip().lower()] = value.strip()
+			parts = lines[0].split(None, 2)
+			status = len(parts) > 1 and parts[1].isdigit() and int(parts[1]) or 0
+			if 'location' in headers or 300 <= status < 400:
+				return status, headers, body
+	if head is None:
+		return 0, {}, ''
+	return status, headers, data.split('\r\n\r\n', 1)[1]
+
+
+def _web_probe(name, ip, timeout, race):
+	port = name == 'https' and 443 or 80
+	sock = race.connect((ip, port), timeout)
+	try:
+		if name == 'https':
+			sock = ssl.wrap_socket(sock)
+		sock.sendall("GET / HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n" % ip)
+		status, headers, body = _read_response(sock)
+	finally:
+		sock.close()
+	evidence = {'status': status}
+	if 'location' in headers:
+		evidence['location'] = headers['location']
+	if 'server' in headers:
+		evidence['server'] = headers['server']
+	scores = {}
+	fields = {'location': headers.get('location'), 'body': body}
+	for probe, field, pattern, sptype, score in WEB_SIGNATURES:
+		if probe == name and fields[field] and re.search(pattern.replace('{ip}', re.escape(ip)), fields[field]):
+			evidence['match'] = pattern.replace('{ip}', ip)
+			scores[sptype] = max(scores.get(sptype, 0), score)
+	return evidence, scores
+
+
+def _ssh_probe(ip, timeout, race):
+	found = ssh_fingerprint(ip, timeout=timeout, connect=race.connect)
+	scores = {}
+	for family, score in guess_family(found).items():
+		sptype = FAMILY_SPTYPES.get(family)
+		if sptype:
+			scores[sptype] = max(scores.get(sptype, 0), score)
+	evidence = {'banner': found['banner']}
+	if 'kex' in found:
+		evidence['kex'] = found['kex']
+		evidence['hostkey'] = found['hostkey']
+	return evidence, scores
+
+
+def _ipmi_probe(ip, timeout, race):
+	if race.done.is_set():
+		raise socket.error("cancelled")
+	replies = get_channel_auth_capabilities([ip], timeout=timeout, cancel=race.done)
+	if not replies:
+		return {}, {}
+	caps = replies[0]
+	evidence = {'ipmi_version': caps.get('ipmi_version'), 'oem_iana': caps.get('oem_iana')}
+	scores = {}
+	for sptype in IPMI_OEM.get(caps.get('oem_iana'), ()):
+		scores[sptype] = 0.5
+	return evidence, scores
+
+
+def _run_probe(name, ip, timeout, race):
+	if name == 'ssh':
+		return _ssh_probe(ip, timeout, race)
+	if name == 'ipmi':
+		return _ipmi_probe(ip, timeout, race)
+	return _web_probe(name, ip, timeout, race)
+
+
+def fingerprint(ip, timeout=3.0, probes=PROBES, threshold=THRESHOLD):
+	"""Run probes against ip at the same time and return (sptype, confidence, evidence).
+	   Scores of all signals for a SP type are combined as independent evidence
+	   (1 - product of 1 - score). As soon as a type reaches threshold the outstanding
+	   probes are cancelled. sptype is None if no probe gave any signal.
+	   evidence holds per-probe findings, the 'scores' and the 'decided_by' probe if any."""
+
+	race = _Race()
+	results = Queue.Queue()
+	started = time.time()
+
+	def run(name):
+		try:
+			evidence, scores = _run_probe(name, ip, timeout, race)
+		except Exception, e:
+			evidence, scores = {'error': str(e)}, {}
+		evidence['elapsed'] = time.time() - started
+		results.put((name, evidence, scores))
+
+	for name in probes:
+		t = threading.Thread(target=run, name="%s-%s" % (name, ip), args=(name,))
+		t.daemon = True
+		t.start()
+
+	evidence = {}
+	doubt = {}
+	decided = None
+	deadline = started + timeout + 1
+	for i in range(len(probes)):
+		try:
+			name, found, scores = results.get(timeout=max(0, deadline - time.time()))
+		except Queue.Empty:
+			break
+		evidence[name] = found
+		for sptype, score in scores.items():
+			doubt[sptype] = doubt.get(sptype, 1.0) * (1 - score)
+		if doubt and 1 - min(doubt.values()) >= threshold:
+			decided = name
+			break
+	race.cancel()
+	confidence = dict([(sptype, 1 - d) for sptype, d in doubt.items()])
+	evidence['scores'] = confidence
+	if decided:
+		evidence['decided_by'] = decided
+	if not confidence:
+		return None, 0.0, evidence
+	sptype = max(confidence.keys(), key=lambda t: (confidence[t], t))
+	LOG.debug("%s looks like %s (%.2f) in %.3fs", ip, sptype, confidence[sptype], time.time() - started)
+	return sptype, confidence[sptype], evidence
+
+
+def fingerprint_many(ips, concurrency=64, timeout=3.0, probes=PROBES, threshold=THRESHOLD):
+	"""Fingerprint many ips with at most concurrency hosts at once and yield
+	   (ip, sptype, confidence, evidence) as each host is decided."""
+
+	ips = list(ips)
+
+	def run(ip):
+		return (ip,) + fingerprint(ip, timeout, probes, threshold)
+
+	pool = ThreadPool(max(1, min(concurrency, len(ips))))
+	try:
+		for result in pool.imap_unordered(run, ips):
+			yield result
+	finally:
+		pool.terminate()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Gives a facility to run Service Processor operations across many hosts"""
+
+import logging
+import threading
+import time
+import math
+import socket
+import Queue
+import pickle
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from ssp.service_processor import ServiceProcessor
+from ssp.chassis.common.icmp import alive_hosts
+
+__all__ = [ "Fleet" ]
+LOG = logging.getLogger("ssp.fleet")
+
+__SLOTS = {'lock': threading.Lock(), 'hosts': {}}
+"""Operations running on each host, shared by all fleets of the process."""
+
+
+class _HostSlot(object):
+	"""Context of one operation on a host. It waits until fewer than limit operations
+	   of all fleets of the process run on the host, so fleets with different per_sp
+	   share the host and each of them keeps its own cap."""
+
+	def __init__(self, state, limit):
+		self.__state = state
+		self.__limit = limit
+
+	def __enter__(self):
+		with self.__state['changed']:
+			while self.__state['running'] >= self.__limit:
+				self.__state['changed'].wait()
+			self.__state['running'] += 1
+
+	def __exit__(self, *exc_info):
+		with self.__state['changed']:
+			self.__state['running'] -= 1
+			self.__state['changed'].notify_all()
+		return False
+
+
+def _host_slots(host, limit):
+	with __SLOTS['lock']:
+		if host not in __SLOTS['hosts']:
+			__SLOTS['hosts'][host] = {'running': 0, 'changed': threading.Condition()}
+		return _HostSlot(__SLOTS['hosts'][host], limit)
+
+def percentile(values, p):
+	"""Return p-th percentile (nearest rank) of sorted values. None for no values."""
+	if not values:
+		return None
+	rank = int(math.ceil(p / 100.0 * len(values))) - 1
+	return values[max(0, min(len(values) - 1, rank))]
+
+def summarize(results, elapsed=None):
+	"""Return counts and latency percentiles of fleet results."""
+	latencies = sorted([r['elapsed'] for r in results if r['elapsed'] is not None])
+	summary = {'total': len(results),
+		'ok': len([r for r in results if r['ok']]),
+		'failed': len([r for r in results if not r['ok'] and not r.get('skipped')]),
+		'skipped': len([r for r in results if r.get('skipped')]),
+		'elapsed': elapsed,
+		'max': latencies and latencies[-1] or None}
+	for p in (50, 90, 99):
+		summary['p%d' % p] = percentile(latencies, p)
+	return summary
+
+
+def _resolve(hosts, concurrency=64):
+	"""Return dict of host -> IPv4 address. Hosts which cannot be resolved are left out."""
+	hosts = list(hosts)
+
+	def resolve(host):
+		try:
+			return host, socket.gethostbyname(host)
+		except socket.error, e:
+			LOG.debug("Cannot resolve %s. %s", host, e)
+			return host, None
+
+	if not hosts:
+		return {}
+	pool = ThreadPool(max(1, min(concurrency, len(hosts))))
+	try:
+		return dict([(host, ip) for host, ip in pool.map(resolve, hosts) if ip])
+	finally:
+		pool.terminate()
+
+def _compact(result):
+	"""Return result as it can be sent to the parent process. Unpicklable values become repr()."""
+	try:
+		pickle.dumps(result['result'], pickle.HIGHEST_PROTOCOL)
+	except Exception:
+		result['result'] = repr(result['result'])
+	return result
+
+def _shard(index, specs, operation, args, concurrency, per_sp, queue):
+	"""Worker process: run operation on a shard of SPs and send results back as they complete.
+	   specs are (ServiceProcessor.spec(), (type, user, password)) pairs. Every result carries
+	   the SP type and credentials as found afterwards, in 'identity'."""
+	try:
+		sps = []
+		for spec, identity in specs:
+			sps.append(ServiceProcessor(**spec))
+			sps[-1].adopt(*identity)
+		by_host = dict([(sp.getHost(), sp) for sp in sps])
+		for result in Fleet(sps, concurrency, per_sp).run(operation, *args):
+			sp = by_host[result['host']]
+			result['identity'] = (sp.getType(), sp.getUser(), sp.getPassword())
+			queue.put((index, _compact(result)))
+	except Exception, e:
+		LOG.error("Fleet shard %d failed. %s", index, e)
+	queue.put((index, None))
+
+
+class Fleet(object):
+	"""Represents many Service Processors to run the same operation on.
+
+	   Hosts are host names, dicts of ServiceProcessor arguments (host, type, user, password)
+	   or ServiceProcessor objects. At most concurrency operations run at once and at most
+	   per_sp of them on the same SP.
+
+	   With processes > 1 the SPs are sharded over that many worker processes, each running
+	   up to concurrency operations in its own threads, for CPU heavy operations (e.g. getvpd
+	   parsing). Then operation has to be a method name or a picklable module level function.
+	   SP type and credentials guessed by workers are taken back into the SPs of the fleet,
+	   and workers share the identity caches of the SPs (see IdentityCache.save())."""
+
+	__sps = None
+	"""ServiceProcessor objects."""
+
+	__concurrency = None
+	"""Operations running at once in the whole fleet."""
+
+	__per_sp = None
+	"""Operations running at once on one SP."""
+
+	__prefilter = None
+	"""Skip SPs not replying to ping before connecting."""
+
+	__processes = None
+	"""Worker processes to spread SPs over. Operations run in threads of this process if 1."""
+
+	summary = None
+	"""Summary of the last completed run. See summarize()."""
+
+	def __init__(self, hosts, concurrency=64, per_sp=1, prefilter=False, processes=1):
+		self.__sps = []
+		for h in hosts:
+			if isinstance(h, ServiceProcessor):
+				self.__sps.append(h)
+			elif isinstance(h, dict):
+				self.__sps.append(ServiceProcessor(**h))
+			else:
+				self.__sps.append(ServiceProcessor(h))
+		self.__concurrency = concurrency
+		self.__per_sp = per_sp
+		self.__prefilter = prefilter
+		self.__processes = processes
+
+	def __len__(self):
+		return len(self.__sps)
+
+	def __call(self, sp, operation, args):
+		host = sp.getHost()
+		result = {'host': host, 'ok': False, 'result': None, 'error': None, 'elapsed': None}
+		with _host_slots(host, self.__per_sp):
+			started = time.time()
+			try:
+				if callable(operation):
+					result['result'] = operation(sp, *args)
+				else:
+					result['result'] = sp.run(operation, *args)
+				result['ok'] = True
+			except Exception, e:
+				LOG.debug("Operation %s failed on %s. %s", operation, host, e)
+				result['error'] = str(e) or e.__class__.__name__
+			result['elapsed'] = time.time() - started
+		return result
+
+	def run(self, operation, *args):
+		"""Run operation on every SP and yield per-host results as they complete:
+		   {'host', 'ok', 'result', 'error', 'elapsed'}. operation is a method name of
+		   the SP control (see ServiceProcessor.run()) or a callable(sp, *args).
+		   The summary attribute is set once all results were yielded."""
+
+		started = time.time()
+		done = []
+		sps = self.__sps
+		if self.__prefilter and sps:
+			# Replies come from addresses, so names are pinged by what they resolve to
+			addrs = _resolve(set([sp.getHost() for sp in sps]), self.__concurrency)
+			replied = alive_hosts(set(addrs.values()))
+			alive = set([host for host, ip in addrs.items() if ip in replied])
+			for sp in sps:
+				if sp.getHost() not in alive:
+					result = {'host': sp.getHost(), 'ok': False, 'result': None, 'error': 'unreachable',
+						'elapsed': None, 'skipped': True}
+					done.append(result)
+					yield result
+			sps = [sp for sp in sps if sp.getHost() in alive]
+		if self.__processes > 1 and len(sps) > 1:
+			results = self.__run_sharded(sps, operation, args)
+		else:
+			results = self.__run_threaded(sps, operation, args)
+		for result in results:
+			done.append(result)
+			yield result
+		self.summary = summarize(done, time.time() - started)
+		LOG.info("%s on %d SPs: %d ok, %d failed, %d skipped in %.1fs (p50 %s, p99 %s)", operation,
+			len(done), self.summary['ok'], self.summary['failed'], self.summary['skipped'],
+			self.summary['elapsed'], self.summary['p50'], self.summary['p99'])
+
+	def __run_threaded(self, sps, operation, args):
+		if not sps:
+			return
+		pool = ThreadPool(max(1, min(self.__concurrency, len(sps))))
+		try:
+			for result in pool.imap_unordered(lambda sp: self.__call(sp, operation, args), sps):
+				yield result
+		finally:
+			pool.terminate()
+
+	def __run_sharded(self, sps, operation, args):
+		"""Spread SPs over worker processes (all operations on one host in the same shard)
+		   and yield results as workers send them."""
+
+		hosts = sorted(set([sp.getHost() for sp in sps]))
+		count = min(self.__processes, len(hosts))
+		shard_of = dict([(host, i % count) for i, host in enumerate(hosts)])
+		shards = [[] for i in range(count)]
+		sps_of = {}
+		for sp in sps:
+			shards[shard_of[sp.getHost()]].append((sp.spec(), (sp.getType(), sp.getUser(), sp.getPassword())))
+			sps_of.setdefault(sp.getHost(), []).append(sp)
+		queue = multiprocessing.Queue()
+		workers = []
+		pending = []
+		for index, specs in enumerate(shards):
+			w = multiprocessing.Process(target=_shard, name="fleet-shard-%d" % index,
+				args=(index, specs, operation, args, self.__concurrency, self.__per_sp, queue))
+			w.daemon = True
+			w.start()
+			workers.append(w)
+			pending.append([spec['host'] for spec, identity in specs])
+		running = set(range(count))
+		try:
+			while running:
+				try:
+					index, result = queue.get(timeout=1)
+				except Queue.Empty:
+					for index in list(running):
+						if not workers[index].is_alive() and queue.empty():
+							# Died without saying goodbye
+							LOG.error("Fleet worker %d exited with %s", index, workers[index].exitcode)
+							for result in self.__lost(index, pending):
+								yield result
+							running.discard(index)
+					continue
+				if result is None:
+					for result in self.__lost(index, pending):
+						yield result
+					running.discard(index)
+					continue
+				pending[index].remove(result['host'])
+				identity = result.pop('identity')
+				for sp in sps_of[result['host']]:
+					sp.adopt(*identity)
+				yield result
+		finally:
+			for w in workers:
+				if w.is_alive():
+					w.terminate()
+				w.join()
+
+	def __lost(self, index, pending):
+		"""Yield errors for SPs of a shard which never reported."""
+		for host in pending[index]:
+			yield {'host': host, 'ok': False, 'result': None, 'error': 'worker process failed', 'elapsed': None}
+		pending[index] = []
+
+	def run_all(self, operation, *args):
+		"""Run operation on every SP and return (results, summary)."""
+		results = list(self.run(operation, *args))
+		return results, self.summary
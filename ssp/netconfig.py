@@ -24,11 +24,22 @@ import subprocess
 import time
 import sys,os,re
 import array
+import socket
+import struct
+import errno
+import threading
+import copy
+import json
 from IPy import IP
 
+from ssp.netlink import NETLINK_SNAPSHOT, NETLINK_MONITOR
+
 __all__ = [ "NETCONFIG" ]
 LOG = logging.getLogger("ssp.netconfig")
 
+DEFAULT_NETWORKS_FILE="/etc/ssp/networks.json"
+"""Network definitions loaded at import if present. Same layout as __NETWORKS."""
+
 __NETWORKS={'cluster'	:{'ipv4':'192.168.50.0/24'},
 	    'management':{'ipv4':'172.24.8.0/23'},
 	    'storage'	:{'ipv4':'192.168.50.0/24'},
@@ -41,6 +52,13 @@ __SPECIAL_IPV4={'slp-multicast':	{'ipv4':'239.255.255.253',	'type': 'multicast'}
 		'upnp-multicast':	{'ipv4':'239.255.255.250',	'type': 'multicast'},
 		'ganglia-multicast':	{'ipv4':'239.2.11.71',		'type': 'multicast'}}
 
+__INDEX={'index': None}
+"""NETWORK_INDEX over __NETWORKS built on first use."""
+
+__WATCH={'lock': threading.RLock(), 'monitor': None, 'pid': os.getpid(), 'generation': 0, 'snapshot': None,
+	 'projections': {}, 'known': None, 'callbacks': []}
+"""Cached snapshot and projections, valid while netlink monitor reports no change."""
+
 def Request_decorator(func):
 	"""Logs all requests."""
 
@@ -63,8 +81,212 @@ def get_attrset_of_networks(networks={}, attr='iface_name'):
 				attrs.add(networks[net][nettype][attr])
 	return attrs
 
-def get_ifaces():
+def get_networks(networkset=None, nettype='ipv4'):
+	"""Return the sorted list of CIDRs of specified (all by default) globaly defined networks."""
+	nets=set()
+	for name in __NETWORKS.keys():
+		if networkset and name not in networkset:
+			continue
+		if nettype in __NETWORKS[name]:
+			nets.add(__NETWORKS[name][nettype])
+	return sorted(nets)
+
+def get_special_ipv4(name):
+	"""Return the well-known IPv4 address (multicast or broadcast) registered under name."""
+	return __SPECIAL_IPV4[name]['ipv4']
+
+def iter_hosts(spec):
+	"""Yield every host address of the CIDR network spec. A single address (e.g. broadcast) is yielded as is."""
+	net=IP(spec, make_net=True)
+	size=net.len()
+	if size == 1:
+		yield str(net.net())
+		return
+	first=net.int()
+	last=first+size-1
+	if size > 2:
+		# Skip network and broadcast addresses
+		first+=1
+		last-=1
+	for i in xrange(first, last+1):
+		if net.version() == 4:
+			yield socket.inet_ntoa(struct.pack('!I', i))
+		else:
+			yield str(IP(i, ipversion=6))
+
+def split_network(spec, prefix=24):
+	"""Return list of CIDRs of at most /prefix size covering the CIDR network spec."""
+	net=IP(spec, make_net=True)
+	if net.version() != 4 or net.prefixlen() >= prefix:
+		return [str(net)]
+	step=2 ** (32 - prefix)
+	first=net.int()
+	return ["%s/%d" % (socket.inet_ntoa(struct.pack('!I', i)), prefix) for i in xrange(first, first + net.len(), step)]
+
+def _parse_addr(ip):
+	"""Return (family, integer) of IPv4 or IPv6 address string."""
+	if ':' in ip:
+		hi, lo = struct.unpack('!QQ', socket.inet_pton(socket.AF_INET6, ip))
+		return socket.AF_INET6, (hi << 64) | lo
+	return socket.AF_INET, struct.unpack('!I', socket.inet_aton(ip))[0]
+
+def _parse_cidr(spec):
+	"""Return (family, prefix length, network integer shifted right by host bits) of CIDR spec."""
+	ip, sep, length = spec.partition('/')
+	family, addr = _parse_addr(ip)
+	bits = family == socket.AF_INET and 32 or 128
+	length = sep and int(length) or bits
+	return family, length, addr >> (bits - length)
+
+
+class NETWORK_INDEX(object):
+	"""Longest-prefix-match index over named CIDR networks.
+	   Keeps a dict of shifted network integers per family and prefix length,
+	   so a lookup costs one dict probe per distinct prefix length."""
+
+	__prefixes = None
+	"""{family: {prefix length: {shifted network: [names]}}}"""
+
+	__lengths = None
+	"""{family: prefix lengths sorted longest first}"""
+
+	def __init__(self, networks):
+		self.__prefixes = {}
+		for name in sorted(networks.keys()):
+			for nettype in networks[name].keys():
+				try:
+					family, length, net = _parse_cidr(networks[name][nettype])
+				except (socket.error, ValueError), e:
+					LOG.error("Wrong configuration. Bad network %s: %s", name, networks[name][nettype])
+					continue
+				self.__prefixes.setdefault(family, {}).setdefault(length, {}).setdefault(net, []).append(name)
+		self.__lengths = {}
+		for family in self.__prefixes.keys():
+			self.__lengths[family] = sorted(self.__prefixes[family].keys(), reverse=True)
+
+	def classify(self, ip):
+		"""Return the list of network names containing ip, most specific first. Overlapping networks give several names."""
+		try:
+			family, addr = _parse_addr(ip)
+		except (socket.error, ValueError):
+			return []
+		bits = family == socket.AF_INET and 32 or 128
+		names = []
+		prefixes = self.__prefixes.get(family, {})
+		for length in self.__lengths.get(family, ()):
+			names.extend(prefixes[length].get(addr >> (bits - length), ()))
+		return names
+
+	def classify_all(self, ips):
+		"""Return dict of ip -> list of network names (see classify()) for every ip."""
+		classify = self.classify
+		return dict([(ip, classify(ip)) for ip in ips])
+
+
+def load_networks(path=DEFAULT_NETWORKS_FILE):
+	"""Replace globaly defined networks with definitions from JSON file, e.g.
+	   {"management": {"ipv4": "172.24.8.0/23"}, ...}. Cached index and projections are dropped."""
+	fd = open(path, 'r')
+	try:
+		networks = json.load(fd)
+	finally:
+		fd.close()
+	if not isinstance(networks, dict):
+		raise ValueError("%s: network definitions must be a JSON object" % path)
+	with __WATCH['lock']:
+		__NETWORKS.clear()
+		for name, defs in networks.items():
+			__NETWORKS[str(name)] = dict([(str(k), str(v)) for k, v in defs.items()])
+		__INDEX['index'] = None
+		__WATCH['generation'] += 1
+		__WATCH['snapshot'] = None
+		__WATCH['projections'] = {}
+	LOG.debug("Loaded %d networks from %s", len(__NETWORKS), path)
+
+def get_network_index():
+	"""Return NETWORK_INDEX over globaly defined networks."""
+	index = __INDEX['index']
+	if index is None:
+		index = __INDEX['index'] = NETWORK_INDEX(__NETWORKS)
+	return index
+
+def classify_ips(ips):
+	"""Return dict of ip -> list of globaly defined network names containing it, most specific first."""
+	return get_network_index().classify_all(ips)
+
+ARP_TABLE_FILE="/proc/net/arp"
+ATF_COM=0x2
+"""Flag of a complete neighbor entry in ARP_TABLE_FILE."""
+
+def read_arp_table(path=ARP_TABLE_FILE):
+	"""Return dict of IP -> MAC of all complete entries of the kernel ARP table."""
+	table={}
+	fd=open(path, 'r')
+	try:
+		fd.readline()
+		for line in fd:
+			f=line.split()
+			if len(f) < 4:
+				continue
+			try:
+				flags=int(f[2], 16)
+			except ValueError:
+				continue
+			if flags & ATF_COM and f[3] != "00:00:00:00:00:00":
+				table[f[0]]=f[3].lower()
+	finally:
+		fd.close()
+	return table
+
+def resolve_macs(ips, timeout=1.0, port=9):
+	"""Return dict of IP -> MAC for directly connected ips. Neighbor resolution is
+	   triggered for all unknown ips at once by one UDP datagram each (to discard port),
+	   then the ARP table is read until every ip is resolved or timeout expires."""
+	ips=set(ips)
+	found=read_arp_table()
+	missing=ips-set(found.keys())
+	if missing:
+		sock=socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			for ip in missing:
+				for attempt in range(3):
+					try:
+						sock.sendto('', (ip, port))
+						break
+					except socket.error, e:
+						if e.args[0] != errno.ENOBUFS:
+							LOG.debug("Cannot trigger neighbor resolution of %s. %s", ip, e)
+							break
+						time.sleep(0.01)
+		finally:
+			sock.close()
+		deadline=time.time()+timeout
+		while True:
+			found=read_arp_table()
+			if not ips-set(found.keys()) or time.time() >= deadline:
+				break
+			time.sleep(0.05)
+	return dict([(ip, found[ip]) for ip in ips if ip in found])
+
+def get_snapshot(cached=False):
+	"""Return NETLINK_SNAPSHOT of local links, addresses and routes. None if rtnetlink is not available.
+	   With cached the last snapshot is reused until netlink reports a change."""
+	if cached and __watch():
+		with __WATCH['lock']:
+			if not __WATCH['snapshot']:
+				__WATCH['snapshot']=get_snapshot()
+			return __WATCH['snapshot']
+	try:
+		return NETLINK_SNAPSHOT.load()
+	except (socket.error, AttributeError), e:
+		LOG.warning("Cannot dump network configuration by netlink, falling back to 'ip' command. %s", e)
+		return None
+
+def get_ifaces(snapshot=None):
 	"""Return a list of all local configured interfaces."""
+	snapshot=snapshot or get_snapshot()
+	if snapshot:
+		return snapshot.link_scope_ifaces()
 	ifaces=set()
 	try:
 		s = subprocess.Popen(["ip","r","s","scope","link"], stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
@@ -75,8 +297,11 @@ def get_ifaces():
 		LOG.error("Cannot run ping command.")
 		raise
 
-def get_iface_by_route(ip):
+def get_iface_by_route(ip, snapshot=None):
 	"""Return the local interface name for specific IP address. None for indirectly routed addresses"""
+	snapshot=snapshot or get_snapshot()
+	if snapshot:
+		return snapshot.iface_by_route(ip)
 	try:
 		s = subprocess.Popen(["ip","r","g",ip], stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
 		for r in re.finditer(r"(?m)^"+ip+"\s+dev\s+(?P<iface>[^\s]+).*$",s):
@@ -85,34 +310,123 @@ def get_iface_by_route(ip):
 		LOG.error("Cannot run 'ip r g' command.")
 		raise
 
-def check_actual_iface(network, iface):
-	"""Return the local interface IP/prefix and broadcast address for specific network."""
-	net=network.net()
-	brd=str(network.broadcast())
+def get_iface_addresses(iface, snapshot=None):
+	"""Return a list of (IP/prefix, broadcast) of IPv4 addresses with broadcast set on the interface."""
+	snapshot=snapshot or get_snapshot()
+	if snapshot:
+		return [a for a in snapshot.iface_addresses(iface) if a[1]]
 	try:
 		s = subprocess.Popen(["ip","a","s","dev",iface], stderr=open('/dev/null', 'w'), stdout=subprocess.PIPE).communicate()[0]
-		for r in re.finditer(r"(?m)^\s+inet\s+(?P<net>[^\s]+)\s+brd\s+(?P<brd>[^\s]+).*$",s):
-			n=r.groupdict()
-			localif=IP(n['net'],make_net=True)
-			if localif.net() == net:
-				if n['brd'] != brd:
-					LOG.error("Interface (%s) should have broadcast (%s), but set to (%s).",iface, brd, n['brd'])
-				return n['net'],n['brd']
-			elif network[1] in localif:
-				LOG.error("Interface (%s) configured incorrectly. Preffix on net (%s) is set to (%s).",iface, net, localif)
-				return n['net'],n['brd']
-		LOG.error("Broadcast is not set on interface (%s) or this is a bug. Direct route for (%s) exists, but I can't find this network with broadcast (%s).",iface, str(net), brd)
-		return None,None
+		return [(r.group('net'), r.group('brd')) for r in re.finditer(r"(?m)^\s+inet\s+(?P<net>[^\s]+)\s+brd\s+(?P<brd>[^\s]+).*$",s)]
 	except:
 		LOG.error("Cannot run 'ip a s dev' command.")
 		raise
 
-def get_all_global_to_local_networks_projection():
+def check_actual_iface(network, iface, snapshot=None):
+	"""Return the local interface IP/prefix and broadcast address for specific network."""
+	net=network.net()
+	brd=str(network.broadcast())
+	family, length, shifted = _parse_cidr(str(network))
+	bits = family == socket.AF_INET and 32 or 128
+	first = (shifted << (bits - length)) + 1
+	for ifnet, ifbrd in get_iface_addresses(iface, snapshot):
+		iffamily, iflength, ifshifted = _parse_cidr(ifnet)
+		if iffamily != family:
+			continue
+		if (iflength, ifshifted) == (length, shifted):
+			if ifbrd != brd:
+				LOG.error("Interface (%s) should have broadcast (%s), but set to (%s).",iface, brd, ifbrd)
+			return ifnet,ifbrd
+		elif first >> (bits - iflength) == ifshifted:
+			LOG.error("Interface (%s) configured incorrectly. Preffix on net (%s) is set to (%s).",iface, net, str(IP(ifnet,make_net=True)))
+			return ifnet,ifbrd
+	LOG.error("Broadcast is not set on interface (%s) or this is a bug. Direct route for (%s) exists, but I can't find this network with broadcast (%s).",iface, str(net), brd)
+	return None,None
+
+def __watch():
+	"""Start netlink monitor once. Return True if changes are being watched.
+	   A forked child starts its own monitor and drops what it inherited."""
+	with __WATCH['lock']:
+		if __WATCH['monitor'] and not __WATCH['monitor'].running():
+			__WATCH['monitor']=None
+			__WATCH['generation']+=1
+			__WATCH['snapshot']=None
+			__WATCH['projections']={}
+		if __WATCH['pid'] != os.getpid():
+			# Callbacks belong to the parent
+			__WATCH['pid']=os.getpid()
+			__WATCH['known']=None
+			__WATCH['callbacks']=[]
+		if __WATCH['monitor'] is None:
+			monitor=NETLINK_MONITOR(__on_change)
+			try:
+				monitor.start()
+				__WATCH['monitor']=monitor
+			except (socket.error, AttributeError), e:
+				LOG.warning("Cannot watch network changes by netlink, caching is disabled. %s", e)
+				__WATCH['monitor']=False
+		return bool(__WATCH['monitor']) and __WATCH['monitor'].running()
+
+def __on_change(kinds):
+	"""Drop cached snapshot and projections. Notify callbacks of networks which projection changed."""
+	with __WATCH['lock']:
+		LOG.debug("Local network configuration changed (%s)", ", ".join(sorted(kinds)))
+		__WATCH['generation']+=1
+		__WATCH['snapshot']=None
+		__WATCH['projections']={}
+		callbacks=list(__WATCH['callbacks'])
+		if not callbacks:
+			return
+		old=__WATCH['known'] or {}
+		new=get_all_global_to_local_networks_projection()
+		__WATCH['known']=new
+	for name in sorted(set(old.keys()) | set(new.keys())):
+		if old.get(name) == new.get(name):
+			continue
+		for callback in callbacks:
+			try:
+				callback(name, old.get(name), new.get(name))
+			except Exception, e:
+				LOG.error("Network change callback failed for %s. %s", name, e)
+
+def add_network_change_callback(callback):
+	"""Call callback(name, old, new) from a background thread whenever the local projection of
+	   a globaly defined network changes (e.g. its interface comes up). old or new is None if
+	   the network was or became not reachable. Return False if changes cannot be watched."""
+	if not __watch():
+		return False
+	with __WATCH['lock']:
+		if __WATCH['known'] is None:
+			__WATCH['known']=get_all_global_to_local_networks_projection()
+		__WATCH['callbacks'].append(callback)
+	return True
+
+def remove_network_change_callback(callback):
+	with __WATCH['lock']:
+		if callback in __WATCH['callbacks']:
+			__WATCH['callbacks'].remove(callback)
+
+def get_all_global_to_local_networks_projection(cached=True):
 	"""Returns dict of all defined global networks as they seen on local host (if any). Return an empty dict if none is actually configured"""
-	return get_global_to_local_networks_projection(set(__NETWORKS.keys()))
+	return get_global_to_local_networks_projection(set(__NETWORKS.keys()), cached)
+
+def get_global_to_local_networks_projection(networkset=set(), cached=True):
+	"""Returns dict of specified networks as they seen on local host (if any). Return an empty dict if none of specified networks is actually configured.
+	   With cached the projection is computed once and reused until netlink reports a change of links, addresses or routes."""
+	if not cached or not __watch():
+		return __project(networkset, get_snapshot())
+	key=frozenset(networkset)
+	with __WATCH['lock']:
+		generation=__WATCH['generation']
+		if key in __WATCH['projections']:
+			return copy.deepcopy(__WATCH['projections'][key])
+	networks=__project(networkset, get_snapshot(True))
+	with __WATCH['lock']:
+		if generation == __WATCH['generation']:
+			__WATCH['projections'][key]=copy.deepcopy(networks)
+	return networks
 
-def get_global_to_local_networks_projection(networkset=set()):
-	"""Returns dict of specified networks as they seen on local host (if any). Return an empty dict if none of specified networks is actually configured"""
+def __project(networkset, snapshot):
 	networks={}
 	for name in networkset.intersection(__NETWORKS.keys()):
 		networks[name]={}
@@ -126,7 +440,7 @@ def get_global_to_local_networks_projection(networkset=set()):
 			except:
 				LOG.error("Wrong configuration. Bad network: %s", str(net))
 				continue
-			iface=get_iface_by_route(first)
+			iface=get_iface_by_route(first, snapshot)
 			if iface:
 				v='IPv'+version
 				networks[name][v]={}
@@ -136,7 +450,13 @@ def get_global_to_local_networks_projection(networkset=set()):
 				networks[name][v]['firstIP']=first
 				# Actual configuration part of the dict
 				networks[name][v]['iface_name']=iface
-				networks[name][v]['iface_ip_and_preffix'],networks[name][v]['iface_broadcast']=check_actual_iface(IPnet,iface)
+				networks[name][v]['iface_ip_and_preffix'],networks[name][v]['iface_broadcast']=check_actual_iface(IPnet,iface,snapshot)
 			else:
 				del networks[name]
 	return networks
+
+if os.path.exists(DEFAULT_NETWORKS_FILE):
+	try:
+		load_networks(DEFAULT_NETWORKS_FILE)
+	except (IOError, ValueError, AttributeError), e:
+		LOG.error("Cannot load network definitions from %s, using built-in ones. %s", DEFAULT_NETWORKS_FILE, e)
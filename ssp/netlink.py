@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reads local links, addresses and routes from the kernel by rtnetlink"""
+
+import logging
+import os
+import socket
+import struct
+import binascii
+import time
+import select
+import threading
+
+__all__ = [ "NETLINK_SNAPSHOT", "NETLINK_MONITOR" ]
+LOG = logging.getLogger("ssp.netlink")
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_LABEL = 3
+IFA_BROADCAST = 4
+
+RTA_DST = 1
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_PREFSRC = 7
+RTA_TABLE = 15
+
+RTN_UNICAST = 1
+RTN_LOCAL = 2
+RT_SCOPE_LINK = 253
+RT_TABLE_MAIN = 254
+RT_TABLE_LOCAL = 255
+
+IFF_UP = 0x1
+
+_NLMSGHDR = struct.Struct("=LHHLL")
+_IFINFOMSG = struct.Struct("=BxHiII")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_RTMSG = struct.Struct("=BBBBBBBBI")
+_RTATTR = struct.Struct("=HH")
+
+_BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+
+
+def _align(n):
+	return (n + 3) & ~3
+
+def _attrs(data, offset):
+	"""Return dict of rtattr type -> raw value found in data from offset."""
+	attrs = {}
+	while offset + _RTATTR.size <= len(data):
+		length, kind = _RTATTR.unpack_from(data, offset)
+		if length < _RTATTR.size:
+			break
+		attrs[kind & 0x3fff] = data[offset + _RTATTR.size:offset + length]
+		offset += _align(length)
+	return attrs
+
+def _addr_to_int(packed):
+	return int(binascii.hexlify(packed), 16)
+
+def _dump(sock, seq, kind, payload):
+	"""Send a dump request and yield (message type, message body) of every reply."""
+	sock.send(_NLMSGHDR.pack(_NLMSGHDR.size + len(payload), kind, NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + payload)
+	while True:
+		data = sock.recv(65536)
+		offset = 0
+		while offset + _NLMSGHDR.size <= len(data):
+			length, mtype, flags, mseq, pid = _NLMSGHDR.unpack_from(data, offset)
+			if length < _NLMSGHDR.size:
+				return
+			body = data[offset + _NLMSGHDR.size:offset + length]
+			offset += _align(length)
+			if mseq != seq:
+				continue
+			if mtype == NLMSG_DONE:
+				return
+			if mtype == NLMSG_ERROR:
+				error = -struct.unpack_from("=i", body)[0]
+				if error:
+					raise socket.error(error, "netlink dump request %d failed" % kind)
+				continue
+			yield mtype, body
+
+
+class NETLINK_SNAPSHOT(object):
+	"""Represents the state of local links, addresses and routes at some moment.
+	   Answers route lookups and interface address queries without asking the kernel again."""
+
+	links = None
+	"""Dict of interface index -> {'name', 'flags', 'mac'}."""
+
+	addresses = None
+	"""List of {'iface', 'family', 'address', 'prefixlen', 'broadcast'} dicts."""
+
+	routes = None
+	"""List of {'family', 'dst', 'dst_len', 'table', 'type', 'scope', 'iface', 'gateway', 'priority'} dicts."""
+
+	taken = None
+	"""Time the snapshot was taken."""
+
+	__index = None
+	"""Routing index: {(family, table): {prefix length: {masked destination: route}}}."""
+
+	def __init__(self, links, addresses, routes):
+		self.links = links
+		self.addresses = addresses
+		self.routes = routes
+		self.taken = time.time()
+		self.__index = {}
+		for r in sorted(routes, key=lambda r: -r['priority']):
+			# Lowest metric wins as it is stored last
+			if r['type'] not in (RTN_UNICAST, RTN_LOCAL):
+				continue
+			bits = _BITS[r['family']]
+			table = self.__index.setdefault((r['family'], r['table']), {})
+			dst = _addr_to_int(socket.inet_pton(r['family'], r['dst'])) >> (bits - r['dst_len'])
+			table.setdefault(r['dst_len'], {})[dst] = r
+
+	@classmethod
+	def load(cls):
+		"""Take a new snapshot by dumping links, addresses and routes over one rtnetlink socket."""
+		sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+		try:
+			sock.bind((0, 0))
+			links = {}
+			for mtype, body in _dump(sock, 1, RTM_GETLINK, _IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+				if mtype != RTM_NEWLINK:
+					continue
+				family, iftype, index, flags, change = _IFINFOMSG.unpack_from(body)
+				a = _attrs(body, _IFINFOMSG.size)
+				mac = a.get(IFLA_ADDRESS)
+				links[index] = {'name': a.get(IFLA_IFNAME, '').rstrip('\0'), 'flags': flags,
+					'mac': mac and ":".join(["%02x" % ord(c) for c in mac])}
+			addresses = []
+			for mtype, body in _dump(sock, 2, RTM_GETADDR, _IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)):
+				if mtype != RTM_NEWADDR:
+					continue
+				family, prefixlen, flags, scope, index = _IFADDRMSG.unpack_from(body)
+				if family not in _BITS:
+					continue
+				a = _attrs(body, _IFADDRMSG.size)
+				local = a.get(IFA_LOCAL, a.get(IFA_ADDRESS))
+				brd = a.get(IFA_BROADCAST)
+				addresses.append({'iface': links.get(index, {}).get('name'), 'family': family, 'prefixlen': prefixlen,
+					'address': local and socket.inet_ntop(family, local),
+					'broadcast': brd and socket.inet_ntop(family, brd)})
+			routes = []
+			for mtype, body in _dump(sock, 3, RTM_GETROUTE, _RTMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0, 0, 0)):
+				if mtype != RTM_NEWROUTE:
+					continue
+				family, dst_len, src_len, tos, table, proto, scope, rtype, flags = _RTMSG.unpack_from(body)
+				if family not in _BITS:
+					continue
+				a = _attrs(body, _RTMSG.size)
+				if RTA_TABLE in a:
+					table = struct.unpack("=I", a[RTA_TABLE])[0]
+				dst = a.get(RTA_DST, '\0' * (_BITS[family] / 8))
+				gw = a.get(RTA_GATEWAY)
+				oif = a.get(RTA_OIF)
+				routes.append({'family': family, 'dst': socket.inet_ntop(family, dst), 'dst_len': dst_len,
+					'table': table, 'type': rtype, 'scope': scope,
+					'iface': oif and links.get(struct.unpack("=i", oif)[0], {}).get('name'),
+					'gateway': gw and socket.inet_ntop(family, gw),
+					'priority': RTA_PRIORITY in a and struct.unpack("=I", a[RTA_PRIORITY])[0] or 0})
+		finally:
+			sock.close()
+		return cls(links, addresses, routes)
+
+	def __lookup(self, family, table, ip):
+		index = self.__index.get((family, table))
+		if not index:
+			return None
+		bits = _BITS[family]
+		addr = _addr_to_int(socket.inet_pton(family, ip))
+		for length in sorted(index.keys(), reverse=True):
+			r = index[length].get(addr >> (bits - length))
+			if r:
+				return r
+		return None
+
+	def route(self, ip):
+		"""Return the route the kernel would use to reach ip (local table first) or None."""
+		family = ':' in ip and socket.AF_INET6 or socket.AF_INET
+		r = self.__lookup(family, RT_TABLE_LOCAL, ip)
+		if r and r['type'] == RTN_LOCAL:
+			return r
+		return self.__lookup(family, RT_TABLE_MAIN, ip)
+
+	def iface_by_route(self, ip):
+		"""Return the interface name ip is directly reachable on. None for local, routed via gateway or unreachable ip."""
+		r = self.route(ip)
+		if not r or r['type'] != RTN_UNICAST or r['gateway']:
+			return None
+		return r['iface']
+
+	def link_scope_ifaces(self):
+		"""Return a set of interface names having routes of link scope in the main table (as 'ip r s scope link')."""
+		return set([r['iface'] for r in self.routes
+			if r['table'] == RT_TABLE_MAIN and r['scope'] == RT_SCOPE_LINK and r['type'] == RTN_UNICAST and r['iface']])
+
+	def iface_addresses(self, iface, family=socket.AF_INET):
+		"""Return a list of ('address/prefix', broadcast) configured on the interface."""
+		return [("%s/%d" % (a['address'], a['prefixlen']), a['broadcast'])
+			for a in self.addresses if a['iface'] == iface and a['family'] == family]
+
+
+class NETLINK_MONITOR(object):
+	"""Listens to kernel notifications about link, address and route changes in a background thread.
+	   callback(kinds) is called with a set of 'link', 'address' and 'route' for every batch of
+	   relevant notifications. Routes of tables other than main and local are ignored."""
+
+	GROUPS = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE
+
+	__callback = None
+	__sock = None
+	__thread = None
+	__running = False
+
+	__pid = None
+	"""Process the monitor thread runs in."""
+
+	def __init__(self, callback):
+		self.__callback = callback
+
+	def start(self):
+		"""Subscribe to notifications. Raises socket.error if rtnetlink is not available."""
+		sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+		try:
+			sock.bind((0, self.GROUPS))
+		except:
+			sock.close()
+			raise
+		self.__sock = sock
+		self.__pid = os.getpid()
+		self.__running = True
+		self.__thread = threading.Thread(target=self.__run, name="netlink-monitor")
+		self.__thread.daemon = True
+		self.__thread.start()
+
+	def stop(self):
+		self.__running = False
+		if self.__thread:
+			self.__thread.join()
+			self.__thread = None
+
+	def running(self):
+		"""Return True while notifications are being read. False in a forked child,
+		   as the monitor thread stays with the parent."""
+		if self.__running and self.__pid != os.getpid():
+			self.__running = False
+			self.__thread = None
+			self.__sock.close()
+		return self.__running
+
+	def __kinds(self, data):
+		kinds = set()
+		offset = 0
+		while offset + _NLMSGHDR.size <= len(data):
+			length, mtype, flags, seq, pid = _NLMSGHDR.unpack_from(data, offset)
+			if length < _NLMSGHDR.size:
+				break
+			body = data[offset + _NLMSGHDR.size:offset + length]
+			offset += _align(length)
+			if mtype in (RTM_NEWLINK, RTM_DELLINK):
+				kinds.add('link')
+			elif mtype in (RTM_NEWADDR, RTM_DELADDR):
+				kinds.add('address')
+			elif mtype in (RTM_NEWROUTE, RTM_DELROUTE) and len(body) >= _RTMSG.size:
+				table = _RTMSG.unpack_from(body)[4]
+				a = _attrs(body, _RTMSG.size)
+				if RTA_TABLE in a:
+					table = struct.unpack("=I", a[RTA_TABLE])[0]
+				if table in (RT_TABLE_MAIN, RT_TABLE_LOCAL):
+					kinds.add('route')
+		return kinds
+
+	def __run(self):
+		try:
+			while self.__running:
+				r, w, x = select.select([self.__sock], [], [], 1)
+				if not r:
+					continue
+				kinds = set()
+				while r:
+					# Coalesce notifications arrived at once (e.g. interface brought up)
+					try:
+						kinds.update(self.__kinds(self.__sock.recv(65536)))
+					except socket.error, e:
+						LOG.warning("Netlink notifications lost. %s", e)
+						kinds.update(['link', 'address', 'route'])
+					r, w, x = select.select([self.__sock], [], [], 0.05)
+				if kinds:
+					try:
+						self.__callback(kinds)
+					except Exception, e:
+						LOG.error("Netlink change callback failed. %s", e)
+		finally:
+			self.__running = False
+			self.__sock.close()
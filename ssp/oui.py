@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compiled OUI vendor index of the nmap-mac-prefixes table"""
+
+import logging
+import os
+import array
+import bisect
+import threading
+
+__all__ = [ "OUI_INDEX", "vendor_for", "vendors_for", "normalize_mac" ]
+LOG = logging.getLogger("ssp.oui")
+
+MAC_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nmap-mac-prefixes")
+"""nmap-mac-prefixes table shipped with the package."""
+
+__INDEX = {'index': None, 'lock': threading.Lock()}
+"""OUI_INDEX of MAC_TABLE_FILE loaded on first lookup."""
+
+
+def oui_of(mac):
+	"""Return the 24-bit OUI of a MAC written with ':' or '-' separators or without them. None if not a MAC."""
+	if not mac:
+		return None
+	digits = mac.replace(":", "").replace("-", "").replace(".", "")
+	if len(digits) < 6:
+		return None
+	try:
+		return int(digits[:6], 16)
+	except ValueError:
+		return None
+
+
+def normalize_mac(mac):
+	"""Return MAC written with ':', '-' or '.' separators or without them as lower case 'aa:bb:cc:dd:ee:ff'.
+	   Anything else is returned lower cased as is."""
+	if not mac:
+		return mac
+	digits = mac.replace(":", "").replace("-", "").replace(".", "").lower()
+	if len(digits) != 12 or digits.strip("0123456789abcdef"):
+		return mac.lower()
+	return ":".join([digits[i:i + 2] for i in range(0, 12, 2)])
+
+
+class OUI_INDEX(object):
+	"""Represents the OUI table compiled into a sorted array of 24-bit prefixes
+	   with vendor names kept in a parallel list. Lookups are binary searches."""
+
+	__ouis = None
+	"""Sorted array('I') of OUIs."""
+
+	__vendors = None
+	"""Vendor names in the order of __ouis."""
+
+	def __init__(self, path=MAC_TABLE_FILE):
+		entries = {}
+		names = {}
+		fd = open(path, 'r')
+		try:
+			for line in fd:
+				if line.startswith('#'):
+					continue
+				prefix, sep, vendor = line.rstrip('\r\n').partition(' ')
+				try:
+					oui = int(prefix, 16)
+				except ValueError:
+					continue
+				# Many OUIs share a vendor name, keep one copy of each
+				entries[oui] = names.setdefault(vendor, vendor)
+		finally:
+			fd.close()
+		self.__ouis = array.array('I', sorted(entries.keys()))
+		self.__vendors = [entries[oui] for oui in self.__ouis]
+		LOG.debug("Loaded %d OUIs of %d vendors from %s", len(self.__ouis), len(names), path)
+
+	def __len__(self):
+		return len(self.__ouis)
+
+	def lookup(self, mac):
+		"""Return the vendor name of MAC or None if unknown."""
+		oui = oui_of(mac)
+		if oui is None:
+			return None
+		i = bisect.bisect_left(self.__ouis, oui)
+		if i < len(self.__ouis) and self.__ouis[i] == oui:
+			return self.__vendors[i]
+		return None
+
+	def lookup_all(self, macs):
+		"""Return dict of MAC -> vendor name (None if unknown) for every MAC."""
+		lookup = self.lookup
+		return dict([(mac, lookup(mac)) for mac in macs])
+
+
+def get_index():
+	"""Return OUI_INDEX of the packaged table, loading it once per process."""
+	if __INDEX['index'] is None:
+		with __INDEX['lock']:
+			if __INDEX['index'] is None:
+				__INDEX['index'] = OUI_INDEX()
+	return __INDEX['index']
+
+def vendor_for(mac):
+	"""Return vendor name of MAC or None if unknown."""
+	return get_index().lookup(mac)
+
+def vendors_for(macs):
+	"""Return dict of MAC -> vendor name (None if unknown) for every MAC."""
+	return get_index().lookup_all(macs)
@@ -23,9 +23,23 @@ import logging
 import paramiko
 import re
 
+from ssp.remote.sshprobe import ssh_fingerprint, guess_family
+
 __all__ = [ "SSHchannel" ]
 LOG = logging.getLogger("ssp.hw.remote.ssh")
 
+GUESS_THRESHOLD = 0.5
+"""Score a pre-auth fingerprint needs to be trusted without logging in. See ssp.remote.sshprobe."""
+
+FAMILY_TYPES = {
+	'idrac': "idrac",
+	'ilo':   "ilo",
+	'rsa':   "rsa",
+	'imm':   "rsa",
+	'amm':   "rsa",
+}
+"""guessType() value for every fingerprinted SP family."""
+
 LOG.setLevel(logging.DEBUG)
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
@@ -102,7 +116,17 @@ class SSHchannel:
 
 	@Request_decorator
 	def guessType(self):
-		"""Returns string representing possible type of service processor."""
+		"""Returns string representing possible type of service processor.
+		   The SSH banner and key exchange offer are checked first, without logging in.
+		   Only iLO and IBM SPs are told apart that way, iDRAC needs the racadm login."""
+
+		try:
+			families = guess_family(ssh_fingerprint(self.__host, self.__port))
+			families = dict([(f, score) for f, score in families.items() if f in FAMILY_TYPES and score >= GUESS_THRESHOLD])
+			if families:
+				return FAMILY_TYPES[max(families.keys(), key=lambda f: (families[f], f))]
+		except Exception, e:
+			LOG.debug("No pre-auth fingerprint of %s. %s", self.__host, e)
 
 		stdout = self.command("racadm help")
 		sptype = stdout.splitlines()[-2].strip()
@@ -110,9 +134,9 @@ class SSHchannel:
 		if sptype not in ("idrac", "rsa", "ilo"):
 			LOG.error("SP %s is off unknown type. %s",
 				self.__host, sptype)
-			state = "unknown"
+			return "unknown"
 
-		return state
+		return sptype
 
 
 	def command(self, command):
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2012-2013  Yury Konovalov <YKonovalov@gmail.com>
+#
+# This file is part of SSP.
+#
+# SSP is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SSP is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SSP.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pre-authentication SSH fingerprinting: version banner and server KEXINIT"""
+
+import logging
+import socket
+import struct
+import re
+from multiprocessing.pool import ThreadPool
+
+__all__ = [ "ssh_fingerprint", "guess_family", "ssh_fingerprint_many" ]
+LOG = logging.getLogger("ssp.remote.sshprobe")
+
+CLIENT_BANNER = "SSH-2.0-ssp_probe\r\n"
+SSH_MSG_KEXINIT = 20
+MAX_PACKET = 35000
+
+KEXINIT_LISTS = ('kex', 'hostkey', 'ciphers_c2s', 'ciphers_s2c', 'macs_c2s', 'macs_s2c',
+		 'compression_c2s', 'compression_s2c', 'languages_c2s', 'languages_s2c')
+"""Name-lists of SSH_MSG_KEXINIT in wire order (RFC 4253, 7.1)."""
+
+SIGNATURES = [
+	# family, score, banner regex, {KEXINIT list: regex on the comma separated list}
+	('ilo',   0.9, r"^SSH-[\d.]+-mpSSH_",         {}),
+	('idrac', 0.4, r"^SSH-2\.0-OpenSSH_5\.2\b",   {'hostkey': r"^ssh-rsa,ssh-dss$|^ssh-dss,ssh-rsa$"}),
+	('amm',   0.6, r"^SSH-[\d.]+-RomSShell_",     {}),
+	('rsa',   0.5, r"^SSH-1\.99-",                {'kex': r"^diffie-hellman-group1-sha1$"}),
+	('imm',   0.4, r"^SSH-2\.0-OpenSSH_",         {'kex': r"^diffie-hellman-group-exchange-sha1,diffie-hellman-group14-sha1,diffie-hellman-group1-sha1$"}),
+]
+"""Signatures of SP families. All conditions of a signature have to match.
+   iDRAC6 runs a stock OpenSSH 5.2 which other hosts run as well, so its score stays below
+   ssp.remote.ssh.GUESS_THRESHOLD: it only moves iDRAC to the front of the login order
+   (see ssp.identify.rank_sptypes()) and is confirmed by logging in."""
+
+FAMILY_SPTYPES = {
+	'idrac': "DELL-iDRAC6",
+	'amm':   "IBM-BLADECENTER",
+	'rsa':   "IBM-RSA",
+	'imm':   "IBM-RSA",
+	'ilo':   "HP-iLO2",
+}
+"""SP type of ssp.identify for every family."""
+
+
+def _recv_exactly(sock, size):
+	data = ''
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			raise socket.error("connection closed by peer")
+		data += chunk
+	return data
+
+
+def _read_banner(sock):
+	"""Return the server version line. Lines before it (RFC 4253, 4.2) are skipped."""
+	buf = ''
+	while True:
+		while '\n' not in buf:
+			if len(buf) > 8192:
+				raise socket.error("no SSH version banner")
+			chunk = sock.recv(256)
+			if not chunk:
+				raise socket.error("connection closed by peer")
+			buf += chunk
+		line, buf = buf.split('\n', 1)
+		if line.startswith('SSH-'):
+			return line.rstrip('\r'), buf
+
+
+def parse_kexinit(payload):
+	"""Return dict of KEXINIT_LISTS names to comma separated algorithm lists."""
+	if not payload or ord(payload[0]) != SSH_MSG_KEXINIT:
+		return None
+	offset = 17
+	lists = {}
+	for name in KEXINIT_LISTS:
+		length = struct.unpack_from("!I", payload, offset)[0]
+		offset += 4
+		lists[name] = payload[offset:offset + length]
+		offset += length
+	return lists
+
+
+def ssh_fingerprint(ip, port=22, timeout=3.0, connect=socket.create_connection):
+	"""Return dict with the server 'banner' and its KEXINIT lists. No key exchange is done
+	   and no credentials are used: the connection is closed right after server KEXINIT.
+	   SSH-1 only servers give the banner alone. Raises socket.error if SSH is not reachable.
+	   connect(address, timeout) returns the connected socket."""
+
+	sock = connect((ip, port), timeout)
+	try:
+		banner, rest = _read_banner(sock)
+		found = {'banner': banner}
+		if not re.match(r"^SSH-(2\.0|1\.99)-", banner):
+			return found
+		sock.sendall(CLIENT_BANNER)
+		header = rest + _recv_exactly(sock, max(0, 5 - len(rest)))
+		length, padding = struct.unpack("!IB", header[:5])
+		if length > MAX_PACKET or padding >= length:
+			return found
+		body = header[5:] + _recv_exactly(sock, max(0, length - 1 - len(header[5:])))
+		lists = parse_kexinit(body[:length - 1 - padding])
+		if lists:
+			found.update(lists)
+		return found
+	finally:
+		sock.close()
+
+
+def guess_family(found):
+	"""Return dict of SP family -> score of all SIGNATURES matching ssh_fingerprint() result."""
+	scores = {}
+	for family, score, banner, lists in SIGNATURES:
+		if not re.search(banner, found.get('banner', '')):
+			continue
+		if [name for name, pattern in lists.items() if not re.search(pattern, found.get(name, ''))]:
+			continue
+		scores[family] = max(scores.get(family, 0), score)
+	return scores
+
+
+def ssh_fingerprint_many(ips, port=22, timeout=3.0, concurrency=256):
+	"""Fingerprint many hosts at once and yield (ip, found, families) as each one is done.
+	   found is None for hosts without reachable SSH."""
+
+	ips = list(ips)
+
+	def run(ip):
+		try:
+			found = ssh_fingerprint(ip, port, timeout)
+		except (socket.error, struct.error), e:
+			LOG.debug("No SSH fingerprint of %s. %s", ip, e)
+			return ip, None, {}
+		return ip, found, guess_family(found)
+
+	pool = ThreadPool(max(1, min(concurrency, len(ips))))
+	try:
+		for result in pool.imap_unordered(run, ips):
+			yield result
+	finally:
+		pool.terminate()
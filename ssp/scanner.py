@@ -18,8 +18,14 @@
 # along with SSP.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import threading
+import Queue
+import time
 
-from   ssp.chassis.common.scanner import COM_SCANNER
+from   ssp.chassis.common.scanner import COM_SCANNER, stream_records
+from   ssp.chassis.common.result import DiscoveryResultSet
+from   ssp.netconfig import add_network_change_callback
+from   socket import gethostname
 import ssp.chassis
 
 __all__ = [ "Scanner" ]
@@ -36,27 +42,143 @@ class Scanner:
 	"""A list of active scan methods."""
 
 	def __init__(self):
-		self.__name = c2.misc.get_host_name()
+		self.__name = gethostname()
 		self.__scanners = {}
 
-		for module_name in c2.hw.chassis.__scanners__:
-			module = __import__("c2.hw.chassis." + module_name)
+		for module_name in ssp.chassis.__scanners__:
+			module = __import__("ssp.chassis." + module_name)
 			#for action_name, action_handler in module.ACTIONS.iteritems():
 			#	self.__actions["{0}.{1}".format(module_name, action_name)] = action_handler
 		for scanner in COM_SCANNER.__subclasses__():
 			self.__scanners[scanner.name] = scanner
 
-
-	def scan(self):
-		"""Returns the garbage collector object."""
-		all={}
+	def scan(self, networks=None):
+		"""Run all registered scanners one after another and return merged results."""
+		all=DiscoveryResultSet()
 		for s in self.__scanners.keys():
 			scanner=self.__scanners[s]()
-			r=scanner.scan()
-			for rip in r.keys():
-				if rip in all.keys():
-					all[rip]['proto'].update(r[rip]['proto'])
-					all[rip]['scanners'].append(r[rip]['scanners'])
-				else:
-					all[rip]=r[rip]
+			all|=scanner.scan(networks)
 		return all
+
+	def names(self):
+		"""Return names of all registered scanners."""
+		return self.__scanners.keys()
+
+	def scan_concurrently(self, networks=None, timeout=60):
+		"""Run all registered scanners at the same time and return merged results
+		   with per-scanner statistics as a tuple (results, stats).
+
+		   Results are merged as each scanner finishes. Scanners still running after
+		   timeout seconds are reported with 'timeout' status and their results are dropped."""
+		return self.__run_concurrently(lambda scanner: scanner.scan(networks), timeout)
+
+	def scan_unicast(self, networks=None, cidrs=None, timeout=600, **pacing):
+		"""Sweep every address of selected networks and/or CIDRs with all registered scanners
+		   at the same time. See COM_SCANNER.scan_unicast() and scan_concurrently()."""
+		return self.__run_concurrently(lambda scanner: scanner.scan_unicast(networks, cidrs, **pacing), timeout)
+
+	def __run_concurrently(self, call, timeout):
+		"""Run call(scanner) for every registered scanner in its own thread."""
+
+		done=Queue.Queue()
+		stats={}
+		started=time.time()
+
+		def run(name, scanner):
+			t=time.time()
+			try:
+				r=call(scanner())
+				done.put((name, 'done', r, None, time.time()-t))
+			except Exception, e:
+				LOG.error("Scanner %s failed. %s", name, e)
+				done.put((name, 'error', DiscoveryResultSet(), str(e), time.time()-t))
+
+		for name in self.__scanners.keys():
+			stats[name]={'status': 'timeout', 'elapsed': None, 'hosts': 0}
+			t=threading.Thread(target=run, name=name, args=(name, self.__scanners[name]))
+			t.daemon=True
+			t.start()
+
+		all=DiscoveryResultSet()
+		deadline=started+timeout
+		for i in range(len(self.__scanners)):
+			wait=deadline-time.time()
+			if wait <= 0:
+				break
+			try:
+				name, status, r, error, elapsed = done.get(timeout=wait)
+			except Queue.Empty:
+				break
+			stats[name]={'status': status, 'elapsed': elapsed, 'hosts': len(r)}
+			if error:
+				stats[name]['error']=error
+			LOG.debug("Scanner %s %s in %.2fs with %d hosts", name, status, elapsed, len(r))
+			all|=r
+		for name in stats.keys():
+			if stats[name]['status'] == 'timeout':
+				LOG.warning("Scanner %s did not finish in %ss", name, timeout)
+		stats['total']={'status': 'done', 'elapsed': time.time()-started, 'hosts': len(all)}
+		return all, stats
+
+	def iscan(self, networks=None):
+		"""Run all registered scanners at the same time and yield (event, host, record)
+		   as replies arrive. event is 'new' for the first reply from a host and 'update'
+		   for later replies enriching it."""
+
+		def run(callback):
+			threads=[]
+			for name in self.__scanners.keys():
+				t=threading.Thread(target=self.__scanners[name]().scan, name=name, args=(networks, callback))
+				t.daemon=True
+				t.start()
+				threads.append(t)
+			for t in threads:
+				t.join()
+
+		return stream_records(run)
+
+	def scan_incremental(self, cache, networks=None, listen=0.5, callback=None):
+		"""Re-probe only the hosts of DiscoveryCache cache which are stale, listen briefly
+		   for new responders and return the list of (event, ip, entry) against the previous
+		   snapshot. See DiscoveryCache.update() for events. The cache is saved afterwards."""
+
+		stale=cache.stale()
+		results=DiscoveryResultSet()
+		for name in self.__scanners.keys():
+			ips=[ip for ip in stale if not cache.origins(ip) or name in cache.origins(ip)]
+			if ips:
+				LOG.debug("Scanner %s re-probing %d stale hosts", name, len(ips))
+				results|=self.__scanners[name]().probe(ips)
+		for name in self.__scanners.keys():
+			results|=self.__scanners[name](timeout=listen).scan(networks)
+		events=cache.update(results, probed=stale, callback=callback)
+		cache.save()
+		return events
+
+	def rescan_on_change(self, callback):
+		"""Scan a globaly defined network again as soon as it becomes reachable locally (e.g. its
+		   interface comes up) and pass results to callback(name, results) from a background thread.
+		   Rescans run one after another in their own thread, so netlink notifications keep being read.
+		   Return False if local network changes cannot be watched."""
+
+		pending=Queue.Queue()
+
+		def changed(name, old, new):
+			if new:
+				pending.put(name)
+
+		def rescan():
+			while True:
+				name=pending.get()
+				LOG.info("Network %s is reachable now, scanning", name)
+				try:
+					callback(name, self.scan([name]))
+				except Exception, e:
+					LOG.error("Rescan of network %s failed. %s", name, e)
+
+		if not add_network_change_callback(changed):
+			return False
+		t=threading.Thread(target=rescan, name="rescan")
+		t.daemon=True
+		t.start()
+		return True
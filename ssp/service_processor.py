@@ -23,9 +23,14 @@ import logging
 import subprocess
 import time
 import re
+import threading
+
+from paramiko import AuthenticationException
+from pywbem import AuthError
 
 import ssp.identify
 from ssp.chassis.dell.idrac6 import DELLiDRAC6
+from ssp.chassis.wbem.generic import WBEM
 
 
 __all__ = [ "ServiceProcessor" ]
@@ -35,6 +40,22 @@ SSH_PUBKEY  = "/etc/c2/hw-ssh-pubkey.pem"
 SSH_PRIVKEY = "/etc/c2/hw-ssh-privkey.pem"
 SSH_SSLCRT  = "/etc/c2/hw-ssl.crt"
 KNOWN_SPTYPES = ('DELL-iDRAC6','IBM-RSA','IBM-BLADECENTER','HP-iLO')
+LOGIN_CONCURRENCY = 2
+"""Simultaneous login attempts allowed per SP. iDRAC6 has only a few sessions."""
+AUTH_ERRORS = (AuthenticationException, AuthError)
+"""Errors of SP controls meaning the credentials were rejected."""
+
+VPD_GROUPS = {
+	# group:     (TTL seconds, SP keys, system keys)
+	'identity':  (3 * 86400, ('uuid', 'model', 'product', 'subtype', 'sn', 'label', 'makerid', 'productid'),
+			('sn', 'model', 'vendor', 'partnumber', 'sku', 'model_name', 'chassis_type', 'package_type')),
+	'macs':      (3 * 86400, ('mac',), ('macs',)),
+	'firmware':  (3600, ('version', 'version_major', 'version_minor', 'version_date', 'firmware_id'), ()),
+	'network':   (30, ('ip', 'name', 'status', 'ipv4', 'ipv4_mask', 'ipv4_origin', 'ipv4_enabled',
+			'ipv6', 'ipv6_mask', 'ipv6_origin', 'ipv6_enabled'), ()),
+	'power':     (5, (), ('power',)),
+}
+"""VPD field groups with default time to live of their cached values."""
 
 def Request_decorator(func):
 	"""Logs all requests."""
@@ -72,10 +93,39 @@ class ServiceProcessor:
 	__uuid = None
 	"""Internal chassis Id. If specified will be compared to actual uuid for all commands."""
 
-	__vpd = {}
+	__vpd = None
 	"""Most current chassis info."""
 
-	def __init__(self, host=None, type=None, user=None, password=None, secret=None, uuid=None):
+	__vpd_ttl = None
+	"""Seconds VPD of each group stays valid. See VPD_GROUPS."""
+
+	__vpd_updated = None
+	"""Time each VPD group was retrieved."""
+
+	__vpd_lock = None
+
+	__vpd_refresh = None
+	"""Refresh in progress: {'groups', 'done' event, 'error'}. Other readers wait for it."""
+
+	__slots = {}
+	"""Login attempt semaphores by host, shared by all instances."""
+
+	__slots_lock = threading.Lock()
+
+	__cache = None
+	"""IdentityCache to remember SP type and working credentials in. Optional."""
+
+	__given = None
+	"""SP type and credentials as specified, restored when guessed ones are rejected."""
+
+	def __init__(self, host=None, type=None, user=None, password=None, secret=None, uuid=None, cache=None, vpd_ttl=None):
+		self.__cache = cache
+		self.__given = (type, user, password)
+		self.__vpd = {}
+		self.__vpd_updated = {}
+		self.__vpd_lock = threading.Lock()
+		self.__vpd_ttl = dict([(group, VPD_GROUPS[group][0]) for group in VPD_GROUPS.keys()])
+		self.__vpd_ttl.update(vpd_ttl or {})
 		self.__host = host
 		self.__type = type
 		self.__user = user
@@ -88,6 +138,8 @@ class ServiceProcessor:
 		
 		if sptype == "DELL-iDRAC6":
 			return DELLiDRAC6(host, user, password)
+		if sptype == "WBEM":
+			return WBEM(host, user, password)
 
 	def __validate_sptype(self, sptype, host, user, password):
 		"""Check if given sptype is indeed correct."""
@@ -98,47 +150,256 @@ class ServiceProcessor:
 			return True
 		return False
 
-	@Request_decorator
-	def __trydefaultcred(self, sptype):
-		"""Try to authenticate on SP with given or default credentials."""
-		
-		user=self.__user
-		password=self.__password
-		if sptype not in KNOWN_SPTYPES:
-			LOG.error("Unknown service processor type")
+	def __candidates(self, sptypes):
+		"""Return list of (sptype, user, password) to try: given or default credentials for every type."""
+
+		candidates = []
+		for sptype in sptypes:
+			if sptype not in KNOWN_SPTYPES:
+				LOG.debug("Service processor type %s is not supported", sptype)
+				continue
+			sets = ssp.identify.defaults.get(sptype, {})
+			if isinstance(sets, dict):
+				sets = [sets]
+			for default in sets:
+				user = self.__user or default.get('user')
+				password = self.__password or default.get('pass')
+				if user and password and (sptype, user, password) not in candidates:
+					candidates.append((sptype, user, password))
+		return candidates
+
+	def __login_slots(self):
+		"""Return the semaphore limiting simultaneous login attempts to this SP."""
+		with ServiceProcessor.__slots_lock:
+			if self.__host not in ServiceProcessor.__slots:
+				ServiceProcessor.__slots[self.__host] = threading.BoundedSemaphore(LOGIN_CONCURRENCY)
+			return ServiceProcessor.__slots[self.__host]
+
+	def __trycandidates(self, candidates):
+		"""Try to authenticate with all candidates at once, at most LOGIN_CONCURRENCY at a time.
+		   The first success cancels the attempts not started yet. Return True on success."""
+
+		# Passwords are not logged
+		LOG.info("Trying to log in to %s as %s", self.__host,
+			", ".join(["%s of %s" % (user, sptype) for sptype, user, password in candidates]))
+
+		slots = self.__login_slots()
+		won = []
+		lock = threading.Lock()
+		done = threading.Event()
+
+		def attempt(sptype, user, password):
+			with slots:
+				if done.is_set():
+					return
+				try:
+					ok = self.__validate_sptype(sptype, self.__host, user, password)
+				except Exception, e:
+					LOG.debug("Login to %s as %s of %s failed. %s", self.__host, user, sptype, e)
+					ok = False
+			if ok:
+				with lock:
+					if not won:
+						won.append((sptype, user, password))
+						done.set()
+
+		threads = []
+		for candidate in candidates:
+			t = threading.Thread(target=attempt, name="login-%s" % self.__host, args=candidate)
+			t.daemon = True
+			t.start()
+			threads.append(t)
+		while not done.is_set() and [t for t in threads if t.is_alive()]:
+			done.wait(0.05)
+		if not won:
 			return False
-		if not user:
-			user = ssp.chassis.identify.defaults[sptype]['user']
-		if not password:
-			password = ssp.chassis.identify.defaults[sptype]['pass']
-		if user and password and self.__host:
-			if self.__validate_sptype(sptype, self.__host, user, password):
-				self.__type = sptype
-				self.__user = user
-				self.__password = password
-				return True
+		self.__type, self.__user, self.__password = won[0]
+		return True
+
+	def __use_cached(self, mac):
+		"""Take SP type and credentials from the identity cache. Credentials older than
+		   cache TTL are validated by one login and dropped from cache if it fails."""
+
+		entry = self.__cache.lookup(self.__host, mac)
+		if not entry or not entry.get('sptype') or not entry.get('user'):
+			return False
+		if not self.__cache.fresh(entry):
+			LOG.debug("Revalidating cached credentials of %s", self.__host)
+			try:
+				valid = self.__validate_sptype(entry['sptype'], self.__host, entry['user'], entry.get('password'))
+			except AUTH_ERRORS, e:
+				valid = False
+			except Exception, e:
+				# Cannot tell, so probe as if the SP was not known
+				LOG.debug("Revalidating cached credentials of %s failed. %s", self.__host, e)
+				return False
+			if not valid:
+				LOG.info("Cached credentials of %s are not valid anymore", self.__host)
+				self.__cache.invalidate(self.__host, mac)
+				self.__cache.save()
+				return False
+			self.__cache.remember(self.__host, mac)
+		# Keep the new IP of a moved SP
+		if self.__cache.changed():
+			self.__cache.save()
+		self.__type = entry['sptype']
+		self.__user = entry['user']
+		self.__password = entry.get('password')
+		return True
 
 	@Request_decorator
 	def guess_type_and_creds(self):
-		"""Identify the type of SP and credentials."""
+		"""Identify the type of SP and credentials. With identity cache a known SP
+		   (by MAC, so also after IP change) is not probed and logged in again."""
 
 		if not self.__host:
 			raise Error("Host is required, but not specified.")
-		trylist = ssp.chassis.identify.suggest_sptype(self.__host)
-		if trylist:
-			for sptype in [trylist]:
-				if self.__trydefaultcred(sptype):
-					return True
+		mac = None
+		if self.__cache is not None:
+			mac = ssp.identify.mac_by_ip(self.__host)
+			if self.__use_cached(mac):
+				return True
+		# Every type the probes point to, or all of them if they point nowhere
+		trylist = ssp.identify.rank_sptypes(self.__host) or list(KNOWN_SPTYPES)
+		if self.__trycandidates(self.__candidates(trylist)):
+			if self.__cache is not None:
+				self.__cache.remember(self.__host, mac, self.__type, self.__user, self.__password)
+				self.__cache.save()
+			return True
 		return False
 
+	def authentication_failed(self):
+		"""Report that stored credentials were rejected by SP, so they are not used from cache again.
+		   SP type and credentials fall back to the specified ones and are guessed again on next use."""
+		LOG.info("Credentials of %s were rejected", self.__host)
+		if self.__cache is not None:
+			self.__cache.invalidate(self.__host, ssp.identify.mac_by_ip(self.__host))
+			self.__cache.save()
+		self.__type, self.__user, self.__password = self.__given
+
+	def spec(self):
+		"""Return ServiceProcessor arguments creating the same SP, e.g. in another process.
+		   Type and credentials are the given ones, see adopt() for the ones found working."""
+		sptype, user, password = self.__given
+		return {'host': self.__host, 'type': sptype, 'user': user, 'password': password,
+			'secret': self.__secret, 'uuid': self.__uuid, 'cache': self.__cache, 'vpd_ttl': dict(self.__vpd_ttl)}
+
+	def adopt(self, sptype, user, password):
+		"""Take SP type and credentials as found by a copy of this SP, e.g. in another process."""
+		self.__type, self.__user, self.__password = sptype, user, password
+
+	def __connect(self):
+		"""Return connected SP control, guessing SP type and credentials first if not known.
+		   Rejected credentials are reported to authentication_failed()."""
+
+		if not self.__type and not self.guess_type_and_creds():
+			raise RuntimeError("Service processor type could not be guessed for %s." % self.__host)
+		c = self.__spcontrol(self.__type, self.__host, self.__user, self.__password)
+		if c is None:
+			raise RuntimeError("Service processor type %s is not supported." % self.__type)
+		try:
+			connected = c.connect()
+		except AUTH_ERRORS:
+			self.authentication_failed()
+			raise
+		if not connected:
+			self.authentication_failed()
+			raise RuntimeError("Cannot log in to %s." % self.__host)
+		return c
+
 	@Request_decorator
-	def updatevpd(self):
-		"""Retrieve HW data from SP."""
+	def run(self, operation, *args):
+		"""Connect to SP, call operation (a method name of the SP control, e.g. 'powerstate',
+		   'poweron', 'getvpd' or 'setpxeboot') with args, disconnect and return its result.
+		   SP type and credentials are guessed first if not known."""
+
+		c = self.__connect()
+		try:
+			return getattr(c, operation)(*args)
+		finally:
+			c.disconnect()
+
+	def __fetch_vpd(self, groups):
+		"""Connect to SP and return its VPD. Only groups are asked for when they are not all of them."""
+
+		c = self.__connect()
+		try:
+			if set(groups) >= set(VPD_GROUPS.keys()):
+				return c.getvpd()
+			return c.getvpd(fields=sorted(groups))
+		finally:
+			c.disconnect()
+
+	def __merge_vpd(self, vpd, groups, now):
+		"""Take values of groups from freshly retrieved vpd into the cached one."""
+
+		if set(groups) >= set(VPD_GROUPS.keys()):
+			self.__vpd = vpd
+		else:
+			cached = self.__vpd or {'sp': {}, 'sys': {}}
+			for group in groups:
+				ttl, spkeys, syskeys = VPD_GROUPS[group]
+				for key in spkeys:
+					if key in vpd.get('sp', {}):
+						cached.setdefault('sp', {})[key] = vpd['sp'][key]
+				for uuid, system in vpd.get('sys', {}).items():
+					for key in syskeys:
+						if key in system:
+							cached.setdefault('sys', {}).setdefault(uuid, {})[key] = system[key]
+			self.__vpd = cached
+		for group in groups:
+			self.__vpd_updated[group] = now
+
+	def __refresh_vpd(self, groups):
+		"""Retrieve VPD groups from SP. Concurrent refreshes are coalesced: a caller finding
+		   a refresh in progress waits for it instead of logging in again."""
+
+		groups = set(groups)
+		while groups:
+			with self.__vpd_lock:
+				pending = self.__vpd_refresh
+				if pending is None:
+					pending = self.__vpd_refresh = {'groups': groups, 'done': threading.Event(), 'error': None}
+					owner = True
+				else:
+					owner = False
+			if not owner:
+				pending['done'].wait()
+				if pending['error']:
+					raise pending['error']
+				groups = groups - pending['groups']
+				continue
+			try:
+				now = time.time()
+				vpd = self.__fetch_vpd(groups)
+				with self.__vpd_lock:
+					self.__merge_vpd(vpd, groups, now)
+			except Exception, e:
+				pending['error'] = e
+				raise
+			finally:
+				with self.__vpd_lock:
+					self.__vpd_refresh = None
+				pending['done'].set()
+			break
+
+	def stale_vpd_groups(self, groups=None, now=None):
+		"""Return the set of VPD groups (all by default) older than their TTL."""
+		now = now or time.time()
+		return set([group for group in (groups or VPD_GROUPS.keys())
+			if self.__vpd_updated.get(group, 0) + self.__vpd_ttl[group] <= now])
+
+	@Request_decorator
+	def updatevpd(self, groups=None):
+		"""Retrieve HW data (all VPD groups by default) from SP."""
 		
-		c = self.__spcontrol(self.__type, self.__host, self.__user, self.__password)
-		c.connect()
-		self.__vpd=c.getvpd()
-		c.disconnect()
+		groups = groups or VPD_GROUPS.keys()
+		self.__refresh_vpd(groups)
+		sp = self.__vpd.get('sp', {})
+		if self.__cache is not None and 'firmware' in groups and sp.get('version'):
+			if self.__cache.record_firmware(self.__host, sp.get('mac') or None, self.__type, sp['version']):
+				self.__cache.save()
+		return True
 
 	@Request_decorator
 	def getHost(self):
@@ -171,7 +432,11 @@ class ServiceProcessor:
 		return self.__uuid
 
 	@Request_decorator
-	def getVPD(self):
-		"""Return HW VPD of current SP."""
+	def getVPD(self, groups=None):
+		"""Return HW VPD of current SP. Cached values are returned while within the TTL
+		   of their group, only stale groups (of requested ones, all by default) are retrieved."""
+		stale = self.stale_vpd_groups(groups)
+		if stale:
+			self.updatevpd(stale)
 		return self.__vpd
 
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import threading
+import time
+import unittest
+import xmlrpclib
+
+from ssp.chassis.common.result import DiscoveryResultSet
+from ssp.distributed import ScanWorker, ScanCoordinator
+
+
+class SlowScanner(object):
+    """Replaces the worker's Scanner with one taking a while to sweep."""
+
+    def names(self):
+        return ['FAKE']
+
+    def scan_unicast(self, cidrs=None, timeout=600, **pacing):
+        time.sleep(1.0)
+        return DiscoveryResultSet(), {}
+
+
+class TestScanWorker(unittest.TestCase):
+
+    def start(self, **kwargs):
+        w = ScanWorker('127.0.0.1', 0, **kwargs)
+        w._ScanWorker__scanner = SlowScanner()
+        t = threading.Thread(target=w.serve_forever)
+        t.daemon = True
+        t.start()
+        self.addCleanup(w.shutdown)
+        return "http://127.0.0.1:{0}/".format(w.address()[1])
+
+    def test_listens_on_loopback_by_default(self):
+        w = ScanWorker(port=0)
+        self.assertEqual(w.address()[0], '127.0.0.1')
+
+    def test_secret(self):
+        url = self.start(secret='s3cret')
+        self.assertEqual(ScanCoordinator([url], secret='s3cret').workers_info().keys(), [url])
+        self.assertEqual(ScanCoordinator([url], secret='wrong').workers_info(), {})
+        self.assertRaises(xmlrpclib.ProtocolError, xmlrpclib.ServerProxy(url).info)
+
+    def test_allow(self):
+        self.assertRaises(xmlrpclib.ProtocolError, xmlrpclib.ServerProxy(self.start(allow=['10.0.0.0/8'])).info)
+        self.assertTrue(xmlrpclib.ServerProxy(self.start(allow=['127.0.0.0/8'])).info())
+
+    def test_busy_worker_serves_other_requests(self):
+        url = self.start()
+        proxy = xmlrpclib.ServerProxy(url, allow_none=True)
+        sweep = threading.Thread(target=lambda: proxy.scan_unicast(['10.0.0.0/30']))
+        sweep.start()
+        time.sleep(0.2)
+        started = time.time()
+        xmlrpclib.ServerProxy(url).info()
+        self.assertTrue(time.time() - started < 0.5)
+        sweep.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,26 @@
+#!/usr/bin/python
+import threading
+import time
+import unittest
+
+import ssp.fingerprint as fingerprint
+
+
+class TestIpmiProbe(unittest.TestCase):
+
+    def test_stops_when_race_is_decided(self):
+        race = fingerprint._Race()
+        threading.Timer(0.2, race.cancel).start()
+        started = time.time()
+        # Nothing answers RMCP on the loopback, so only the race can end the probe early
+        self.assertEqual(fingerprint._ipmi_probe('127.0.0.1', 3.0, race), ({}, {}))
+        self.assertTrue(time.time() - started < 1.0)
+
+    def test_not_started_after_race_is_decided(self):
+        race = fingerprint._Race()
+        race.cancel()
+        self.assertRaises(Exception, fingerprint._ipmi_probe, '127.0.0.1', 3.0, race)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import ssp.fleet as fleet
+from ssp.chassis.common.cache import IdentityCache
+from ssp.fleet import Fleet, percentile, summarize
+from ssp.service_processor import ServiceProcessor
+
+
+def identify_in_worker(sp):
+    """Stands for an operation guessing SP type and credentials in a worker process."""
+    sp.adopt('DELL-iDRAC6', 'root', 'calvin')
+    cache = sp.spec()['cache']
+    cache.remember(sp.getHost(), None, 'DELL-iDRAC6', 'root', 'calvin')
+    cache.save()
+    return sp.spec()['vpd_ttl']['power']
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile(range(1, 11), 90), 9)
+        self.assertEqual(percentile(range(1, 101), 99), 99)
+        self.assertEqual(percentile(range(1, 101), 50), 50)
+        self.assertEqual(percentile([1, 2, 3], 50), 2)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertEqual(percentile(range(1, 11), 0), 1)
+        self.assertEqual(percentile(range(1, 11), 100), 10)
+
+    def test_no_values(self):
+        self.assertEqual(percentile([], 50), None)
+
+    def test_summarize(self):
+        results = [{'host': str(i), 'ok': i % 4 != 0, 'elapsed': float(i)} for i in range(1, 11)]
+        results.append({'host': 'x', 'ok': False, 'elapsed': None, 'skipped': True})
+        summary = summarize(results, 12.5)
+        self.assertEqual((summary['total'], summary['ok'], summary['failed'], summary['skipped']), (11, 8, 2, 1))
+        self.assertEqual((summary['p50'], summary['p90'], summary['p99'], summary['max']), (5.0, 9.0, 10.0, 10.0))
+        self.assertEqual(summary['elapsed'], 12.5)
+
+
+class TestRun(unittest.TestCase):
+
+    def test_threaded_callable(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def operation(sp, value):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+            if sp.getHost() == '10.0.0.3':
+                raise ValueError("boom")
+            return sp.getHost() + value
+
+        f = Fleet(['10.0.0.%d' % i for i in range(20)], concurrency=4)
+        results, summary = f.run_all(operation, '!')
+        self.assertEqual(len(results), 20)
+        self.assertEqual(state['peak'], 4)
+        failed = [r for r in results if not r['ok']]
+        self.assertEqual([(r['host'], r['error']) for r in failed], [('10.0.0.3', 'boom')])
+        self.assertEqual(sorted([r['result'] for r in results if r['ok']])[0], '10.0.0.0!')
+        self.assertEqual((summary['ok'], summary['failed']), (19, 1))
+
+    def test_per_sp_limit(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def operation(sp):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+
+        Fleet(['10.0.1.1'] * 6, concurrency=6, per_sp=2).run_all(operation)
+        self.assertEqual(state['peak'], 2)
+
+    def test_per_sp_limit_shared_across_fleets(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def operation(sp):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+
+        fleets = [Fleet(['10.0.1.2'] * 6, concurrency=6, per_sp=limit) for limit in (2, 3)]
+        threads = [threading.Thread(target=f.run_all, args=(operation,)) for f in fleets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertTrue(2 <= state['peak'] <= 3)
+
+    def test_prefilter_resolves_names(self):
+        saved = fleet.alive_hosts
+        pinged = []
+        fleet.alive_hosts = lambda ips: pinged.extend(ips) or set(['127.0.0.1'])
+        try:
+            results, summary = Fleet(['localhost', '127.0.0.1', '10.255.255.1'], prefilter=True).run_all(lambda sp: 'up')
+        finally:
+            fleet.alive_hosts = saved
+        self.assertEqual(sorted(set(pinged)), ['10.255.255.1', '127.0.0.1'])
+        self.assertEqual(sorted([r['host'] for r in results if r['ok']]), ['127.0.0.1', 'localhost'])
+        self.assertEqual([r['host'] for r in results if r.get('skipped')], ['10.255.255.1'])
+
+
+class TestSharded(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_workers_report_identity_and_share_cache(self):
+        path = os.path.join(self.dir, 'identity.json')
+        cache = IdentityCache(path)
+        sps = [ServiceProcessor('10.0.2.%d' % i, cache=cache, vpd_ttl={'power': 7}) for i in range(6)]
+        results, summary = Fleet(sps, processes=3).run_all(identify_in_worker)
+        self.assertEqual(summary['ok'], 6)
+        self.assertEqual(set([r['result'] for r in results]), set([7]))
+        self.assertFalse([r for r in results if 'identity' in r])
+        for sp in sps:
+            self.assertEqual((sp.getType(), sp.getUser(), sp.getPassword()), ('DELL-iDRAC6', 'root', 'calvin'))
+        self.assertEqual(sorted(IdentityCache(path).keys()), sorted(['ip:10.0.2.%d' % i for i in range(6)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+import threading
+import unittest
+
+import ssp.identify
+import ssp.chassis.ipmi.identify
+
+
+class TestSuggestSptypes(unittest.TestCase):
+
+    modules = (ssp.identify, ssp.chassis.ipmi.identify)
+
+    def setUp(self):
+        self.saved = [(m, m.fingerprint, m.macs_by_ip) for m in self.modules]
+        for m in self.modules:
+            m.fingerprint = lambda ip, timeout: (None, 0.0, {})
+
+    def tearDown(self):
+        for m, fingerprint, macs_by_ip in self.saved:
+            m.fingerprint = fingerprint
+            m.macs_by_ip = macs_by_ip
+
+    def suggest(self, module, ips):
+        out = []
+        t = threading.Thread(target=lambda: out.extend(module.suggest_sptypes(ips, timeout=0.5)))
+        t.daemon = True
+        t.start()
+        t.join(5)
+        self.assertFalse(t.is_alive(), "suggest_sptypes() hangs")
+        return sorted(out)
+
+    def test_failing_mac_resolution_does_not_hang(self):
+        def fail(ips, timeout=1.0):
+            raise ValueError("unexpected")
+        for m in self.modules:
+            m.macs_by_ip = fail
+            self.assertEqual([(ip, sptype) for ip, sptype, evidence in self.suggest(m, ['10.0.0.1', '10.0.0.2'])],
+                [('10.0.0.1', None), ('10.0.0.2', None)])
+
+    def test_vendor_is_used_when_probes_give_nothing(self):
+        for m in self.modules:
+            m.macs_by_ip = lambda ips, timeout=1.0: {'10.0.0.1': '00:1e:c9:00:00:01'}
+            results = self.suggest(m, ['10.0.0.1'])
+            self.assertEqual(results[0][2]['source'], 'mac')
+            self.assertEqual(results[0][1], m.sptype_by_vendor(results[0][2]['vendor']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+import unittest
+
+from ssp.chassis.dell.idrac6 import DELLiDRAC6, VPD_COMMANDS, VPD_QUERIES
+from ssp.service_processor import VPD_GROUPS
+
+SYSINFO = """RAC Information:
+RAC Date/Time           = Thu Feb 10 10:31:05 2011
+
+Firmware Version        = 1.80
+Firmware Build          = 17
+Last Firmware Update    = 01/18/2011 14:38:12
+Hardware Version        = 0.01
+MAC Address             = 00:24:e8:3c:aa:01
+
+Common settings:
+Register DNS RAC Name   = 0
+DNS RAC Name            = idrac-ABC1234
+Current DNS Domain      =
+Domain Name from DHCP   = Disabled
+
+IPv4 settings:
+Enabled                 = 1
+Current IP Address      = 10.0.0.5
+Current IP Gateway      = 10.0.0.1
+
+System Information:
+System Model            = PowerEdge R610
+System Revision         = I
+System BIOS Version     = 2.2.10
+Service Tag             = ABC1234
+Host Name               = node1
+OS Name                 =
+Power Status            = ON
+
+Embedded NIC MAC Addresses:
+NIC1 Ethernet           = 00:24:e8:3c:bb:01
+NIC2 Ethernet           = 00:24:e8:3c:bb:03
+"""
+
+SPINFO = """# idRacProductInfo=Integrated Dell Remote Access Controller
+# idRacDescriptionInfo=This system component provides a complete set of remote management functions
+# idRacVersionInfo=1.80
+# idRacBuildInfo=17
+# idRacName=iDRAC
+# idRacType=10
+"""
+
+SPXINFO = """/admin1/system1/sp1/hdwr1/chassis1
+
+  Properties:
+    PlatformGUID = 44454c4c-4200-1042-8031-c4c04f313233
+"""
+
+
+class FakeSSH(object):
+    """SSH channel answering the racadm commands of VPD_COMMANDS."""
+
+    def __init__(self, spxinfo):
+        self.outputs = {VPD_COMMANDS['sysinfo']: SYSINFO, VPD_COMMANDS['spinfo']: SPINFO,
+                        VPD_COMMANDS['spxinfo']: spxinfo}
+        self.commands = []
+
+    def command(self, command):
+        self.commands.append(command)
+        return self.outputs[command]
+
+
+class TestSelectiveVPD(unittest.TestCase):
+
+    def idrac(self, spxinfo):
+        idrac = DELLiDRAC6('10.0.0.5', 'root', 'calvin')
+        idrac._DELLiDRAC6__sshpipe = FakeSSH(spxinfo)
+        return idrac
+
+    def check_groups(self, spxinfo):
+        idrac = self.idrac(spxinfo)
+        full = idrac.getvpd()
+        for group in VPD_QUERIES.keys():
+            ttl, sp_keys, sys_keys = VPD_GROUPS[group]
+            pipe = idrac._DELLiDRAC6__sshpipe = FakeSSH(spxinfo)
+            vpd = idrac.getvpd(fields=[group])
+            self.assertEqual(sorted(set(pipe.commands)), sorted([VPD_COMMANDS[c] for c in VPD_QUERIES[group]]))
+            for key in sp_keys:
+                self.assertEqual(vpd['sp'].get(key), full['sp'].get(key), "%s sp %s" % (group, key))
+            if sys_keys:
+                self.assertEqual(sorted(vpd['sys'].keys()), sorted(full['sys'].keys()))
+            for uuid in full['sys'].keys():
+                for key in sys_keys:
+                    self.assertEqual(vpd['sys'][uuid].get(key), full['sys'][uuid].get(key),
+                        "%s sys %s %s" % (group, uuid, key))
+        return full
+
+    def test_groups_agree_with_full_vpd(self):
+        full = self.check_groups(SPXINFO)
+        uuid = '44454C4C420010428031C4C04F313233'
+        self.assertEqual(full['sp']['uuid'], uuid)
+        self.assertEqual((full['sp']['version'], full['sp']['mac'], full['sp']['ip']), ('1.80', '00:24:e8:3c:aa:01', '10.0.0.5'))
+        self.assertEqual((full['sp']['model'], full['sp']['subtype']), ('iDRAC', '10'))
+        self.assertEqual(full['sys'][uuid]['macs'], {'0': '00:24:e8:3c:bb:01', '1': '00:24:e8:3c:bb:03'})
+        self.assertEqual((full['sys'][uuid]['sn'], full['sys'][uuid]['power']), ('ABC1234', 'ON'))
+
+    def test_groups_agree_without_platform_guid(self):
+        full = self.check_groups("/admin1/system1/sp1/hdwr1/chassis1\n")
+        self.assertEqual(full['sys'], {})
+        self.assertEqual((full['sp']['version'], full['sp']['model']), ('1.80', 'iDRAC'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+import unittest
+
+import ssp.chassis.ipmi.authcap as authcap
+
+
+class ProberRecorder(object):
+    """Replaces UDP_PROBER and records how it was created."""
+
+    created = []
+
+    def __init__(self, port, **kwargs):
+        self.created.append(kwargs)
+
+    def probe(self, targets, request, parse, expected=None, cancel=None):
+        return []
+
+
+class TestWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = authcap.UDP_PROBER
+        authcap.UDP_PROBER = ProberRecorder
+        del ProberRecorder.created[:]
+
+    def tearDown(self):
+        authcap.UDP_PROBER = self.saved
+
+    def window(self, **kwargs):
+        authcap.get_channel_auth_capabilities(['10.0.0.0/30'], **kwargs)
+        return ProberRecorder.created[-1]['window']
+
+    def test_default_without_rate(self):
+        self.assertEqual(self.window(), authcap.WINDOW)
+
+    def test_scales_with_rate_and_timeout(self):
+        self.assertEqual(self.window(rate=2000, timeout=1.0), 2000)
+        self.assertEqual(self.window(rate=2000, timeout=2.5), 5000)
+        self.assertEqual(self.window(rate=50, timeout=1.0), authcap.WINDOW)
+
+    def test_explicit_window(self):
+        self.assertEqual(self.window(rate=2000, window=64), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+import os
+import threading
+import time
+import unittest
+
+import ssp.netconfig as netconfig
+import ssp.scanner as scanner
+from ssp.netlink import NETLINK_MONITOR
+
+
+def watching():
+    return netconfig.add_network_change_callback(lambda name, old, new: None)
+
+
+class TestFork(unittest.TestCase):
+
+    def setUp(self):
+        if not watching():
+            self.skipTest("netlink is not available")
+
+    def test_child_starts_its_own_monitor(self):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                parent = netconfig.__dict__['__WATCH']['monitor']
+                ok = not parent.running() and watching()
+                child = netconfig.__dict__['__WATCH']['monitor']
+                ok = ok and child is not parent and child.running()
+                ok = ok and len(netconfig.__dict__['__WATCH']['callbacks']) == 1
+                os.write(w, ok and 'ok' or 'failed')
+            finally:
+                os._exit(0)
+        os.close(w)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(r, 16), 'ok')
+        self.assertTrue(netconfig.__dict__['__WATCH']['monitor'].running())
+
+
+class TestRescan(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = scanner.add_network_change_callback
+        self.callbacks = []
+        scanner.add_network_change_callback = lambda cb: self.callbacks.append(cb) or True
+
+    def tearDown(self):
+        scanner.add_network_change_callback = self.saved
+
+    def test_rescan_does_not_block_notifications(self):
+        s = scanner.Scanner()
+        done = threading.Event()
+        s.scan = lambda networks: time.sleep(0.5) or networks
+        got = []
+        self.assertTrue(s.rescan_on_change(lambda name, results: got.append((name, results)) or done.set()))
+        started = time.time()
+        self.callbacks[0]('management', None, {'iface': 'eth0'})
+        self.callbacks[0]('storage', {'iface': 'eth1'}, None)
+        self.assertTrue(time.time() - started < 0.1)
+        done.wait(5)
+        self.assertEqual(got, [('management', ['management'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
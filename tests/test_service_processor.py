@@ -0,0 +1,274 @@
+#!/usr/bin/python
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from paramiko import AuthenticationException
+
+import ssp.identify
+import ssp.service_processor as spm
+from ssp.chassis.common.cache import IdentityCache
+from ssp.service_processor import ServiceProcessor
+
+
+class FakeSP(object):
+    """SP control accepting only the password in FakeSP.accepted."""
+
+    accepted = 'calvin'
+    logins = []
+
+    def __init__(self, host, user, password):
+        self.password = password
+
+    def connect(self):
+        self.logins.append(self.password)
+        if self.password != self.accepted:
+            raise AuthenticationException("rejected")
+        return True
+
+    def disconnect(self):
+        return True
+
+    def powerstate(self):
+        return 'on'
+
+
+class TestIdentityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_mac_forms_share_an_entry(self):
+        cache = IdentityCache(os.path.join(self.dir, 'identity.json'))
+        cache.remember('10.0.0.5', '00:1E:C9:AA:BB:CC', 'DELL-iDRAC6', 'root', 'calvin')
+        cache.remember('10.0.0.5', '001ec9aabbcc', firmware='1.80')
+        cache.remember('10.0.0.5', '00-1e-c9-aa-bb-cc', firmware='1.81')
+        self.assertEqual(cache.keys(), ['00:1e:c9:aa:bb:cc'])
+        self.assertEqual(cache.lookup(mac='001EC9AABBCC')['firmware'], '1.81')
+
+    def test_saves_merge_entries_of_other_processes(self):
+        path = os.path.join(self.dir, 'identity.json')
+        first, second = IdentityCache(path), IdentityCache(path)
+        first.remember('10.0.0.5', '00:1e:c9:aa:bb:01', 'DELL-iDRAC6', 'root', 'calvin')
+        first.remember('10.0.0.7', '00:1e:c9:aa:bb:03', 'DELL-iDRAC6', 'root', 'calvin')
+        first.save()
+        second.remember('10.0.0.6', '00:1e:c9:aa:bb:02', 'HP-iLO3', 'admin', 'admin')
+        second.forget('10.0.0.7', '00:1e:c9:aa:bb:03')
+        second.save()
+        self.assertEqual(sorted(IdentityCache(path).keys()), ['00:1e:c9:aa:bb:01', '00:1e:c9:aa:bb:02'])
+
+
+class TestAuthenticationFailure(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved = (spm.DELLiDRAC6, ssp.identify.mac_by_ip, ssp.identify.rank_sptypes)
+        spm.DELLiDRAC6 = FakeSP
+        ssp.identify.mac_by_ip = lambda ip: '00:1e:c9:aa:bb:cc'
+        ssp.identify.rank_sptypes = lambda ip: ['DELL-iDRAC6']
+        del FakeSP.logins[:]
+
+    def tearDown(self):
+        spm.DELLiDRAC6, ssp.identify.mac_by_ip, ssp.identify.rank_sptypes = self.saved
+        FakeSP.accepted = 'calvin'
+        shutil.rmtree(self.dir)
+
+    def test_rejected_cached_credentials_are_dropped(self):
+        path = os.path.join(self.dir, 'identity.json')
+        cache = IdentityCache(path)
+        cache.remember('10.0.0.5', '00:1E:C9:AA:BB:CC', 'DELL-iDRAC6', 'root', 'old')
+        cache.save()
+        sp = ServiceProcessor('10.0.0.5', cache=cache)
+        self.assertRaises(AuthenticationException, sp.run, 'powerstate')
+        self.assertEqual(sp.getType(), None)
+        self.assertEqual(sp.getPassword(), None)
+        self.assertEqual(IdentityCache(path).lookup(mac='00:1e:c9:aa:bb:cc').get('user'), None)
+        # Guessed again with the factory default on next use
+        self.assertEqual(sp.run('powerstate'), 'on')
+        self.assertEqual(FakeSP.logins, ['old', 'calvin', 'calvin'])
+        self.assertEqual(IdentityCache(path).lookup(mac='00:1e:c9:aa:bb:cc')['password'], 'calvin')
+
+    def test_expired_credentials_rejected_on_revalidation(self):
+        path = os.path.join(self.dir, 'identity.json')
+        cache = IdentityCache(path, ttl=0)
+        cache.remember('10.0.0.5', '00:1E:C9:AA:BB:CC', 'DELL-iDRAC6', 'root', 'old', now=time.time() - 10)
+        cache.save()
+        sp = ServiceProcessor('10.0.0.5', cache=cache)
+        self.assertTrue(sp.guess_type_and_creds())
+        self.assertEqual(sp.getPassword(), 'calvin')
+        self.assertEqual(FakeSP.logins, ['old', 'calvin'])
+        self.assertEqual(IdentityCache(path).lookup(mac='00:1e:c9:aa:bb:cc')['password'], 'calvin')
+
+    def test_fresh_cache_hit_is_not_saved(self):
+        cache = IdentityCache(os.path.join(self.dir, 'identity.json'))
+        cache.remember('10.0.0.5', '00:1E:C9:AA:BB:CC', 'DELL-iDRAC6', 'root', 'calvin')
+        cache.save()
+        saves = []
+        cache.save = lambda: saves.append(True)
+        self.assertTrue(ServiceProcessor('10.0.0.5', cache=cache).guess_type_and_creds())
+        self.assertEqual(saves, [])
+        # Moved SP keeps its new IP
+        self.assertTrue(ServiceProcessor('10.0.0.9', cache=cache).guess_type_and_creds())
+        self.assertEqual(saves, [True])
+        self.assertEqual(FakeSP.logins, [])
+
+    def test_vpd_refresh_reports_rejection(self):
+        sp = ServiceProcessor('10.0.0.5', type='DELL-iDRAC6', user='root', password='calvin')
+        FakeSP.accepted = 'changed'
+        self.assertRaises(AuthenticationException, sp.getVPD)
+        self.assertEqual(sp.getType(), 'DELL-iDRAC6')
+        self.assertEqual(sp.getPassword(), 'calvin')
+
+
+class TestConcurrentLogin(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (ssp.identify.rank_sptypes, ssp.identify.defaults)
+        ssp.identify.rank_sptypes = lambda ip: []
+        ssp.identify.defaults = dict([(sptype, [{'user': 'u', 'pass': '%s-%d' % (sptype, i)} for i in range(3)])
+            for sptype in spm.KNOWN_SPTYPES])
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.tried = []
+
+    def tearDown(self):
+        ssp.identify.rank_sptypes, ssp.identify.defaults = self.saved
+
+    def validate(self, sptype, host, user, password):
+        with self.lock:
+            self.tried.append(password)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.1)
+        with self.lock:
+            self.running -= 1
+        return password == 'IBM-RSA-1'
+
+    def test_all_types_are_tried_when_nothing_is_ranked(self):
+        sp = ServiceProcessor('10.0.0.21')
+        sp._ServiceProcessor__validate_sptype = self.validate
+        self.assertTrue(sp.guess_type_and_creds())
+        self.assertEqual((sp.getType(), sp.getPassword()), ('IBM-RSA', 'IBM-RSA-1'))
+        self.assertEqual(self.peak, spm.LOGIN_CONCURRENCY)
+        # Attempts waiting for a slot are cancelled by the first success
+        time.sleep(0.3)
+        self.assertTrue(len(self.tried) < 3 * len(spm.KNOWN_SPTYPES))
+        self.assertTrue(set(['DELL-iDRAC6-0', 'IBM-RSA-1']) <= set(self.tried))
+
+    def test_passwords_are_not_logged(self):
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        level = spm.LOG.level
+        spm.LOG.addHandler(handler)
+        spm.LOG.setLevel(logging.DEBUG)
+        try:
+            sp = ServiceProcessor('10.0.0.22', user='admin', password='s3cret')
+            sp._ServiceProcessor__validate_sptype = self.validate
+            sp.guess_type_and_creds()
+        finally:
+            spm.LOG.removeHandler(handler)
+            spm.LOG.setLevel(level)
+        self.assertTrue([m for m in messages if 'admin' in m])
+        self.assertFalse([m for m in messages if 's3cret' in m])
+
+
+class FakeVPDControl(object):
+    """SP control returning VPD stamped with the number of the getvpd() call."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.fields = []
+
+    def connect(self):
+        return True
+
+    def disconnect(self):
+        return True
+
+    def getvpd(self, fields=None):
+        self.fields.append(fields)
+        time.sleep(self.delay)
+        n = len(self.fields)
+        return {'sp': {'uuid': 'SP', 'model': 'm%d' % n, 'version': '1.%d' % n, 'ip': '10.0.0.%d' % n},
+                'sys': {'SYS': {'model': 'm%d' % n, 'macs': {'0': 'mac%d' % n}, 'power': 'on%d' % n}}}
+
+
+class TestVPDCache(unittest.TestCase):
+
+    def sp(self, control, **kwargs):
+        sp = ServiceProcessor('10.0.0.5', type='DELL-iDRAC6', user='root', password='calvin', **kwargs)
+        sp._ServiceProcessor__spcontrol = lambda sptype, host, user, password: control
+        return sp
+
+    def test_group_ttls(self):
+        control = FakeVPDControl()
+        sp = self.sp(control)
+        sp.getVPD()
+        sp.getVPD()
+        self.assertEqual(control.fields, [None])
+        self.assertEqual(sp.stale_vpd_groups(now=time.time() + 10), set(['power']))
+        self.assertEqual(sp.stale_vpd_groups(now=time.time() + 60), set(['power', 'network']))
+        self.assertEqual(sp.stale_vpd_groups(now=time.time() + 4 * 86400), set(spm.VPD_GROUPS.keys()))
+
+    def test_ttl_overrides(self):
+        control = FakeVPDControl()
+        sp = self.sp(control, vpd_ttl={'power': 0, 'network': 3600})
+        sp.getVPD()
+        self.assertEqual(sp.stale_vpd_groups(now=time.time() + 60), set(['power']))
+        sp.getVPD()
+        self.assertEqual(control.fields, [None, ['power']])
+
+    def test_partial_refresh_keeps_other_groups(self):
+        control = FakeVPDControl()
+        sp = self.sp(control, vpd_ttl={'power': 0})
+        sp.getVPD()
+        vpd = sp.getVPD()
+        self.assertEqual(control.fields, [None, ['power']])
+        self.assertEqual(vpd['sys']['SYS']['power'], 'on2')
+        self.assertEqual(vpd['sys']['SYS']['model'], 'm1')
+        self.assertEqual(vpd['sys']['SYS']['macs'], {'0': 'mac1'})
+        self.assertEqual((vpd['sp']['model'], vpd['sp']['version'], vpd['sp']['ip']), ('m1', '1.1', '10.0.0.1'))
+
+    def test_concurrent_reads_share_one_fetch(self):
+        control = FakeVPDControl(delay=0.2)
+        sp = self.sp(control)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(sp.getVPD())) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(control.fields, [None])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(set([r['sp']['model'] for r in results]), set(['m1']))
+
+    def test_firmware_recorded_only_when_refreshed_and_changed(self):
+        dir = tempfile.mkdtemp()
+        try:
+            cache = IdentityCache(os.path.join(dir, 'identity.json'))
+            cache.remember('10.0.0.5', None, 'DELL-iDRAC6', 'root', 'calvin', now=1000)
+            saves = []
+            save = cache.save
+            cache.save = lambda: saves.append(True) or save()
+            control = FakeVPDControl()
+            sp = self.sp(control, cache=cache, vpd_ttl={'power': 0})
+            sp.getVPD()
+            sp.getVPD()
+            self.assertEqual(saves, [True])
+            entry = IdentityCache(os.path.join(dir, 'identity.json')).lookup('10.0.0.5')
+            self.assertEqual((entry['firmware'], entry['validated']), ('1.1', 1000))
+        finally:
+            shutil.rmtree(dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/python
+import unittest
+
+import ssp.remote.ssh as ssh
+from ssp.remote.ssh import SSHchannel
+
+RACADM_HELP = "racadm help\n...\nidrac\n\n"
+
+
+class TestGuessType(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = ssh.ssh_fingerprint
+        self.commands = []
+
+    def tearDown(self):
+        ssh.ssh_fingerprint = self.saved
+
+    def guess(self, found):
+        ssh.ssh_fingerprint = lambda host, port: found
+        channel = SSHchannel('10.0.0.5')
+        channel.command = lambda command: self.commands.append(command) or RACADM_HELP
+        return channel.guessType()
+
+    def test_confident_fingerprint_skips_login(self):
+        self.assertEqual(self.guess({'banner': 'SSH-2.0-mpSSH_0.2.1'}), 'ilo')
+        self.assertEqual(self.guess({'banner': 'SSH-2.0-RomSShell_4.62'}), 'rsa')
+        self.assertEqual(self.commands, [])
+
+    def test_weak_fingerprint_falls_back_to_login(self):
+        # Any OpenSSH 5.2 with a plain RSA/DSS host key list looks a bit like iDRAC
+        self.assertEqual(self.guess({'banner': 'SSH-2.0-OpenSSH_5.2', 'hostkey': 'ssh-rsa,ssh-dss'}), 'idrac')
+        self.assertEqual(self.commands, ['racadm help'])
+
+    def test_ordinary_host(self):
+        self.assertEqual(self.guess({'banner': 'SSH-2.0-OpenSSH_8.9p1'}), 'idrac')
+        self.assertEqual(self.commands, ['racadm help'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+import socket
+import struct
+import threading
+import unittest
+
+from ssp.remote.sshprobe import KEXINIT_LISTS, SSH_MSG_KEXINIT, ssh_fingerprint, guess_family
+
+OPENSSH52_LISTS = {
+    'kex': 'diffie-hellman-group-exchange-sha256,diffie-hellman-group-exchange-sha1,diffie-hellman-group14-sha1,diffie-hellman-group1-sha1',
+    'hostkey': 'ssh-rsa,ssh-dss',
+    'ciphers_c2s': 'aes128-ctr,aes192-ctr,aes256-ctr,3des-cbc',
+    'ciphers_s2c': 'aes128-ctr,aes192-ctr,aes256-ctr,3des-cbc',
+    'macs_c2s': 'hmac-md5,hmac-sha1',
+    'macs_s2c': 'hmac-md5,hmac-sha1',
+    'compression_c2s': 'none,zlib@openssh.com',
+    'compression_s2c': 'none,zlib@openssh.com',
+    'languages_c2s': '',
+    'languages_s2c': '',
+}
+
+
+def kexinit_packet(lists):
+    """Return SSH binary packet of SSH_MSG_KEXINIT with the given name-lists."""
+    payload = chr(SSH_MSG_KEXINIT) + 'c' * 16
+    for name in KEXINIT_LISTS:
+        payload += struct.pack("!I", len(lists[name])) + lists[name]
+    payload += '\0' + struct.pack("!I", 0)
+    padding = 8 - (len(payload) + 5) % 8 + 4
+    return struct.pack("!IB", len(payload) + padding + 1, padding) + payload + '\0' * padding
+
+
+class FakeSSHServer(threading.Thread):
+    """Accepts one connection on a local port and sends greeting to it."""
+
+    def __init__(self, greeting):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.greeting = greeting
+        self.received = ''
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+
+    def run(self):
+        conn, addr = self.server.accept()
+        try:
+            # Banner and KEXINIT in separate segments, as servers send them
+            conn.sendall(self.greeting[0])
+            for part in self.greeting[1:]:
+                self.received += conn.recv(256)
+                conn.sendall(part)
+            conn.settimeout(1)
+            try:
+                while True:
+                    data = conn.recv(256)
+                    if not data:
+                        break
+                    self.received += data
+            except socket.timeout:
+                pass
+        finally:
+            conn.close()
+            self.server.close()
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def fingerprint(self, *greeting):
+        server = FakeSSHServer(greeting)
+        server.start()
+        found = ssh_fingerprint('127.0.0.1', server.port, timeout=2)
+        server.join()
+        return found, server.received
+
+    def test_banner_and_kexinit(self):
+        found, received = self.fingerprint("Welcome\r\nSSH-2.0-OpenSSH_5.2\r\n", kexinit_packet(OPENSSH52_LISTS))
+        self.assertEqual(found['banner'], 'SSH-2.0-OpenSSH_5.2')
+        for name in KEXINIT_LISTS:
+            self.assertEqual(found[name], OPENSSH52_LISTS[name])
+        # Only our banner is sent: no key exchange, no credentials
+        self.assertEqual(received, 'SSH-2.0-ssp_probe\r\n')
+        self.assertEqual(guess_family(found), {'idrac': 0.4})
+
+    def test_banner_only_families(self):
+        found, received = self.fingerprint("SSH-2.0-mpSSH_0.2.1\r\n", kexinit_packet(OPENSSH52_LISTS))
+        self.assertEqual(guess_family(found), {'ilo': 0.9})
+        found, received = self.fingerprint("SSH-1.5-RomSShell_4.62\r\n")
+        self.assertEqual(found, {'banner': 'SSH-1.5-RomSShell_4.62'})
+        self.assertEqual(received, '')
+        self.assertEqual(guess_family(found), {'amm': 0.6})
+
+    def test_kex_signature(self):
+        lists = dict(OPENSSH52_LISTS, kex='diffie-hellman-group1-sha1')
+        found, received = self.fingerprint("SSH-1.99-OpenSSH_3.5\r\n", kexinit_packet(lists))
+        self.assertEqual(guess_family(found), {'rsa': 0.5})
+
+    def test_oversized_packet_gives_banner(self):
+        found, received = self.fingerprint("SSH-2.0-OpenSSH_8.9p1\r\n", struct.pack("!IB", 10 ** 6, 4))
+        self.assertEqual(found, {'banner': 'SSH-2.0-OpenSSH_8.9p1'})
+        self.assertEqual(guess_family(found), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+import unittest
+
+from pywbem import CIMDateTime
+
+import ssp.chassis.wbem.common as WBEMC
+from ssp.chassis.wbem.generic import WBEM, VPD_QUERIES
+from ssp.service_processor import VPD_GROUPS
+
+
+class Instance(dict):
+    """CIM instance with a path and class name."""
+
+    def __init__(self, classname, path, **properties):
+        dict.__init__(self, properties)
+        self.classname = classname
+        self.path = path
+
+
+class FakePipe(object):
+    """WBEM connection of an SP managing one host."""
+
+    def __init__(self):
+        self.instances = {
+            'sp': Instance('CIM_ComputerSystem', 'sp', Name='SP', ElementName='IMM', Dedicated=[WBEMC.ManagementController],
+                IdentifyingDescriptions=['CIM:GUID', 'CIM:Model:SerialNumber'],
+                OtherIdentifyingInfo=['0123456789ABCDEF0123456789ABCDEF', '7945AC1:KD1234'], OperationalStatus=[2]),
+            'host': Instance('CIM_ComputerSystem', 'host', Name='host', ElementName='Host', Dedicated=[0],
+                IdentifyingDescriptions=['CIM:GUID', 'CIM:Model:SerialNumber'],
+                OtherIdentifyingInfo=['FEDCBA9876543210FEDCBA9876543210', '7945AC1:KD5678']),
+            'firmware': Instance('CIM_SoftwareIdentity', 'firmware', InstanceID='IMM-YUOO87A', VersionString='1.30',
+                MajorVersion=1, MinorVersion=30, ReleaseDate=CIMDateTime('20110209000000.000000+000')),
+        }
+        self.associated = {
+            ('sp', 'CIM_NetworkPort'): [Instance('CIM_NetworkPort', 'spport', BurnedInMAC='00:1a:64:00:00:01')],
+            ('sp', 'CIM_IPProtocolEndpoint'): [Instance('CIM_IPProtocolEndpoint', 'ip', ProtocolIFType=WBEMC.IPv4,
+                IPv4Address='10.0.0.5', SubnetMask='255.255.255.0', AddressOrigin=3, EnabledState=2)],
+            ('sp', 'CIM_DNSProtocolEndpoint'): [Instance('CIM_DNSProtocolEndpoint', 'dns', Hostname='imm-5')],
+            ('host', 'CIM_NetworkPort'): [Instance('CIM_NetworkPort', 'port1', DeviceID='host-ethernetport-1',
+                BurnedInMAC='00:1a:64:00:00:02')],
+            ('host', 'CIM_Chassis'): [Instance('CIM_Chassis', 'chassis', Manufacturer='IBM', Model='7945AC1',
+                SerialNumber='KD5678', PartNumber='P1', SKU='S1', Name='x3650 M3', ChassisPackageType=17, PackageType=3)],
+            ('host', 'CIM_AssociatedPowerManagementService'): [Instance('CIM_AssociatedPowerManagementService', 'power',
+                PowerState=2)],
+        }
+
+    def EnumerateInstanceNames(self, classname):
+        return [Instance(classname, 'sp'), Instance(classname, 'host')]
+
+    def GetInstance(self, name):
+        return self.instances[name.path]
+
+    def Associators(self, path, ResultClass=None):
+        return self.associated.get((path, ResultClass), [])
+
+    def AssociatorNames(self, path, ResultClass=None):
+        if path == 'sp' and ResultClass == 'CIM_SoftwareIdentity':
+            return [Instance(ResultClass, 'firmware')]
+        return []
+
+    def References(self, path, ResultClass=None):
+        return self.associated.get((path, ResultClass), [])
+
+
+class TestSelectiveVPD(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (WBEMC.getHumanValue, WBEMC.getHumanValueForList)
+        WBEMC.getHumanValue = lambda connection, instance, property: str(instance[property])
+        WBEMC.getHumanValueForList = lambda connection, instance, property: [str(v) for v in instance[property]]
+        self.wbem = WBEM()
+        self.wbem._WBEM__wbempipe = FakePipe()
+
+    def tearDown(self):
+        WBEMC.getHumanValue, WBEMC.getHumanValueForList = self.saved
+
+    def test_groups_agree_with_full_vpd(self):
+        full = self.wbem.getvpd()
+        self.assertEqual(full['sp']['model'], '7945AC1')
+        self.assertEqual(full['sp']['firmware_id'], 'IMM-YUOO87A')
+        for group in VPD_QUERIES.keys():
+            ttl, sp_keys, sys_keys = VPD_GROUPS[group]
+            vpd = self.wbem.getvpd(fields=[group])
+            for key in sp_keys:
+                self.assertEqual(vpd['sp'].get(key), full['sp'].get(key), "%s sp %s" % (group, key))
+            self.assertEqual(sorted(vpd['sys'].keys()), sorted(full['sys'].keys()))
+            for uuid in full['sys'].keys():
+                for key in sys_keys:
+                    self.assertEqual(vpd['sys'][uuid].get(key), full['sys'][uuid].get(key),
+                        "%s sys %s %s" % (group, uuid, key))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+import unittest
+
+import ssp.chassis.wbem.scanner as wbem_scanner
+from ssp.chassis.wbem.scanner import WBEM_SCANNER
+from ssp.chassis.ibm.scanner import IBM_SCANNER
+from ssp.netconfig import iter_hosts
+
+
+class FindServicesRecorder(object):
+    """Replaces find_services() and records the hosts it is asked to query."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, srvtypes, ifaces=None, timeout=1.0, callback=None, hosts=None, **pacing):
+        self.calls.append({'srvtypes': srvtypes, 'ifaces': ifaces, 'hosts': hosts, 'pacing': pacing})
+        for host in hosts or []:
+            callback({'host': host, 'srvtype': srvtypes[0], 'url': 'service:x://' + host, 'responder': host})
+        return []
+
+
+class TestUnicastTargets(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = wbem_scanner.find_services
+        self.recorder = wbem_scanner.find_services = FindServicesRecorder()
+
+    def tearDown(self):
+        wbem_scanner.find_services = self.saved
+
+    def test_probe_sends_to_given_hosts(self):
+        for scanner in (WBEM_SCANNER, IBM_SCANNER):
+            del self.recorder.calls[:]
+            results = scanner().probe(['10.0.0.5', '10.0.0.6'])
+            self.assertEqual(len(self.recorder.calls), 1)
+            self.assertEqual(self.recorder.calls[0]['hosts'], ['10.0.0.5', '10.0.0.6'])
+            self.assertEqual(sorted(results.keys()), ['10.0.0.5', '10.0.0.6'])
+            self.assertEqual(results['10.0.0.5'].scanners[0]['scan_ip'], '10.0.0.5')
+
+    def test_scan_unicast_sends_to_every_address(self):
+        results = WBEM_SCANNER().scan_unicast(cidrs=['10.0.0.0/30'], rate=100)
+        self.assertEqual(self.recorder.calls[0]['hosts'], list(iter_hosts('10.0.0.0/30')))
+        self.assertEqual(self.recorder.calls[0]['pacing']['rate'], 100)
+        self.assertEqual(sorted(results.keys()), sorted(iter_hosts('10.0.0.0/30')))
+
+    def test_multicast_without_hosts(self):
+        WBEM_SCANNER().scan_blindly()
+        self.assertEqual(self.recorder.calls[0]['hosts'], None)
+
+
+if __name__ == '__main__':
+    unittest.main()